@@ -0,0 +1,304 @@
+# DSCI 551 Final Project - Darren Parry
+
+import argparse
+import os
+import platform
+import shutil
+import tempfile
+import time
+from collections.abc import Sized
+import functions
+from parser import SimpleJSONParser, ENGINES, dumps
+from loader import load_directory, load_team_data, read_team_file
+from snapshot import SnapshotCache
+from query import Query
+from fanout import run_all_teams
+from joins import nested_loop_join, hash_join, sort_merge_join
+from synthetic import generate_teams, BASE_BUSINESSES
+
+# Bump this whenever the layout of a results file changes, so older baselines are not compared against
+RESULTS_FORMAT = 1
+
+def list_data_files(directory):
+    # Returns the sorted paths of every JSON file in the data directory
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if filename.endswith('.json')]
+
+def time_call(func, *args, repeat=3):
+    # Runs a function a few times and returns the best wall-clock time along with the last result
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def bench_parser(directory, repeat):
+    # Compares the classic and scanner parser engines on every file in the data directory
+    print(f"{'file':<45}{'size KB':>10}" + ''.join(f"{engine + ' ms':>14}" for engine in ENGINES) + f"{'speedup':>10}")
+    totals = {engine: 0.0 for engine in ENGINES}
+    for file_path in list_data_files(directory):
+        with open(file_path, 'r') as f:
+            json_string = f.read()
+
+        timings = {}
+        results = {}
+        for engine in ENGINES:
+            parser = SimpleJSONParser(engine=engine)
+            timings[engine], results[engine] = time_call(parser.parse, json_string, repeat=repeat)
+            totals[engine] += timings[engine]
+
+        # Both engines have to build exactly the same Python objects
+        if results['scanner'] != results['classic']:
+            raise AssertionError(f"Parser engines disagree on {file_path}")
+
+        speedup = timings['classic'] / timings['scanner'] if timings['scanner'] else float('inf')
+        print(f"{os.path.basename(file_path):<45}{len(json_string) / 1024:>10.1f}" + ''.join(f"{timings[engine] * 1000:>14.1f}" for engine in ENGINES) + f"{speedup:>9.1f}x")
+
+    speedup = totals['classic'] / totals['scanner'] if totals['scanner'] else float('inf')
+    print(f"{'TOTAL':<55}" + ''.join(f"{totals[engine] * 1000:>14.1f}" for engine in ENGINES) + f"{speedup:>9.1f}x")
+
+def bench_load(directory, repeat, worker_counts):
+    # Shows how the wall-clock time of load_directory scales with the number of worker processes (snapshot cache off)
+    print(f"{'workers':>8}{'seconds':>10}{'speedup':>10}   ({os.cpu_count()} CPUs available)")
+    baseline_time = None
+    baseline_result = None
+    for workers in worker_counts:
+        elapsed, result = time_call(load_directory, directory, workers, None, 1, repeat=repeat)
+        if baseline_result is None:
+            baseline_time, baseline_result = elapsed, result
+        elif result != baseline_result or list(result) != list(baseline_result):
+            raise AssertionError(f"load_directory with {workers} workers returned different data")
+        print(f"{workers:>8}{elapsed:>10.2f}{baseline_time / elapsed:>9.2f}x")
+
+def bench_join(directory, repeat, keys, pair_count):
+    # Compares the nested loop join with the hash and sort-merge joins on the pairs of teams with the most businesses
+    all_data = load_directory(directory, workers=1)
+    teams = sorted((name for name, data in all_data.items() if isinstance(data, list)), key=lambda name: -len(all_data[name]))
+    pairs = [(teams[i], teams[i + 1]) for i in range(0, min(pair_count * 2, len(teams) - 1), 2)]
+
+    print(f"{'teams':<60}{'key':>8}{'rows':>8}{'nested ms':>12}{'hash ms':>10}{'merge ms':>10}{'sort ms':>10}")
+    for team1, team2 in pairs:
+        data1, data2 = all_data[team1], all_data[team2]
+        for key in keys:
+            nested_time, expected = time_call(nested_loop_join, data1, key, data2, key, repeat=repeat)
+            hash_time, result = time_call(hash_join, data1, key, data2, key, repeat=repeat)
+            if result != expected:
+                raise AssertionError(f"hash join disagrees with nested loop on {team1} x {team2} by {key}")
+
+            # Sort-merge needs inputs that are already sorted, so the sort is timed separately
+            sort_time, sorted_inputs = time_call(lambda: (sorted((d for d in data1 if key in d), key=lambda d: d[key]), sorted((d for d in data2 if key in d), key=lambda d: d[key])), repeat=repeat)
+            merge_time, result = time_call(sort_merge_join, sorted_inputs[0], key, sorted_inputs[1], key, repeat=repeat)
+            if result != nested_loop_join(sorted_inputs[0], key, sorted_inputs[1], key):
+                raise AssertionError(f"sort-merge join disagrees with nested loop on {team1} x {team2} by {key}")
+
+            label = f"{team1.replace('_restaurants.json', '')} x {team2.replace('_restaurants.json', '')}"
+            print(f"{label:<60}{key:>8}{len(expected):>8}{nested_time * 1000:>12.1f}{hash_time * 1000:>10.1f}{merge_time * 1000:>10.1f}{sort_time * 1000:>10.1f}")
+
+def _rows(result):
+    # The number of rows (or groups) a benchmarked call returned, or None when it returned a single value
+    if isinstance(result, Sized) and not isinstance(result, str):
+        return len(result)
+    return None
+
+def suite_benchmarks(first, second, directory, cache, join_key, nested_limit):
+    # The operators and the query pages' pipelines timed at every scale, as (name, function, args). first and second
+    # are two loaded synthetic teams (second is None with one team).
+    benchmarks = [
+        ('filter ==', functions.filter, (first, 'price', '==', '$$')),
+        ('filter >=', functions.filter, (first, 'rating', '>=', 4.0)),
+        ('filter scan', functions.filter, (list(first), 'rating', '>=', 4.0)),
+        ('filter_where', functions.filter_where, (first, ('and', ('rating', '>=', 4.0), ('price', '==', '$$'), ('review_count', '>', 50)))),
+        ('projection', functions.projection, (first, ['name', 'rating', 'location.city'])),
+        ('group_by', functions.group_by, (first, 'location.city')),
+        ('group_aggregate', functions.group_aggregate, (first, 'price', [('avg', 'rating'), ('count', None), ('max', 'review_count')])),
+        ('aggregate_sum', functions.aggregate_sum, (first, 'review_count')),
+        ('aggregate_avg', functions.aggregate_avg, (first, 'rating')),
+        ('aggregate_count', functions.aggregate_count, (first,)),
+        ('aggregate_max', functions.aggregate_max, (first, 'review_count')),
+        ('aggregate_min', functions.aggregate_min, (first, 'rating')),
+        ('approximate_aggregate', functions.approximate_aggregate, (first, 'price', [('avg', 'rating'), ('count', None), ('max', 'review_count')])),
+        ('distinct_count', functions.distinct_count, (first, 'categories[].alias')),
+        ('approximate_distinct', functions.approximate_distinct, (first, 'categories[].alias')),
+        ('quantiles', functions.quantiles, (first, 'review_count', (0.5, 0.9, 0.99))),
+        ('approximate_quantiles', functions.approximate_quantiles, (first, 'review_count', (0.5, 0.9, 0.99))),
+        ('order_by', functions.order_by, (first, ['rating', 'review_count'], True)),
+        ('top_k', functions.top_k, (first, ['review_count'], 10)),
+        ('text_search', functions.text_search, (first, 'pizza', 'words')),
+        ('text_search prefix', functions.text_search, (first, 'sm', 'prefix', 'rating', True, 10)),
+    ]
+    if second is not None:
+        benchmarks.append(('join', functions.join, (first, join_key, second, join_key)))
+        if len(first) <= nested_limit and len(second) <= nested_limit:
+            benchmarks.append(('join nested loop', nested_loop_join, (first, join_key, second, join_key)))
+
+    # The plans the app's query pages build from their default inputs
+    filter_project = Query().filter('rating', '>=', 4.0).project(['name', 'rating', 'price', 'location.city'])
+    filter_group = Query().filter('rating', '>=', 4.0).group_aggregate('price', [('avg', 'rating')])
+    filter_group_project = Query().filter('rating', '>=', 4.0).group_aggregate('price', {
+        'Count': ('count', None),
+        'Max_rating': ('max', 'rating'),
+        'Avg_rating': ('avg', 'rating'),
+    }).order_by(['Count'], True).project(['price', 'Count', 'Avg_rating'])
+    benchmarks += [
+        ('query filter, project', filter_project.execute, (first,)),
+        ('query filter, group, aggregate', filter_group.execute, (first,)),
+        ('query filter, group, aggregate, project', filter_group_project.execute, (first,)),
+        ('all teams filter, group, aggregate', run_all_teams, (filter_group, directory, False, 1, cache)),
+    ]
+    return benchmarks
+
+def run_suite(scales, teams, seed, repeat, join_key, nested_limit):
+    # Generates synthetic team files at each scale (a multiple of BASE_BUSINESSES businesses per team) in a temporary
+    # directory, and times parsing, loading, every operator and the query pages' pipelines on them.
+    # Returns one result per benchmark and scale.
+    results = []
+    print(f"{'scale':>7} {'benchmark':<45}{'ms':>12}{'rows':>10}")
+    for scale in scales:
+        businesses = int(BASE_BUSINESSES * scale)
+        directory = tempfile.mkdtemp(prefix=f"benchmark-{scale}x-")
+        try:
+            paths = generate_teams(directory, teams, businesses, seed)
+
+            def measure(name, func, *args, rows=_rows):
+                seconds, result = time_call(func, *args, repeat=repeat)
+                rows = rows(result)
+                results.append({'scale': scale, 'businesses': businesses, 'benchmark': name, 'seconds': seconds, 'rows': rows})
+                print(f"{scale:>6g}x {name:<45}{seconds * 1000:>12.2f}{'' if rows is None else rows:>10}")
+
+            with open(paths[0], 'r') as f:
+                json_string = f.read()
+            measure('parse', SimpleJSONParser().parse, json_string, rows=lambda document: len(document['businesses']))
+            del json_string
+            measure('parse stream', read_team_file, paths[0], rows=lambda result: len(result[1]))
+            # Parsing plus building the indexes, columns and text index of the Collection
+            measure('load', load_team_data, paths[0], rows=lambda result: len(result[0]))
+            cache = SnapshotCache(os.path.join(directory, '.snapshots'))
+            for path in paths:
+                cache.store(path, read_team_file(path))
+            measure('load from snapshot', load_team_data, paths[0], cache, rows=lambda result: len(result[0]))
+
+            first = load_team_data(paths[0], cache)[0]
+            second = load_team_data(paths[1], cache)[0] if len(paths) > 1 else None
+            for name, func, args in suite_benchmarks(first, second, directory, cache, join_key, nested_limit):
+                measure(name, func, *args)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def read_results(path):
+    # Reads a results file written by write_results with our parser
+    with open(path, 'r') as f:
+        return SimpleJSONParser().parse(f.read())
+
+def write_results(path, results, settings):
+    # Writes the results of a suite run as JSON, with the machine and settings they were measured with
+    report = {
+        'format': RESULTS_FORMAT,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': settings,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        f.write(dumps(report) + '\n')
+    return report
+
+def compare_results(report, baseline, tolerance, min_seconds):
+    # Compares a suite run with a baseline run and returns the regressions: benchmarks that got slower by more than
+    # `tolerance` (a fraction) and by more than min_seconds, or that returned a different number of rows.
+    # Only runs made with the same settings are compared, since another seed or team count times other data; scales
+    # missing from either run are skipped. Returns None when the runs cannot be compared.
+    def compared(settings):
+        return {key: value for key, value in (settings or {}).items() if key != 'scales'}
+    if baseline.get('format') != RESULTS_FORMAT or compared(baseline.get('settings')) != compared(report['settings']):
+        print(f"The baseline was made with other settings ({baseline.get('settings')}) and is not compared")
+        return None
+    before = {(result['scale'], result['benchmark']): result for result in baseline['results']}
+    regressions = []
+    print(f"{'scale':>7} {'benchmark':<45}{'baseline ms':>13}{'ms':>12}{'change':>10}")
+    for result in report['results']:
+        old = before.get((result['scale'], result['benchmark']))
+        if old is None:
+            status = 'not in baseline'
+            change = ''
+        else:
+            ratio = result['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            status = ''
+            if result['rows'] != old['rows']:
+                status = f"ROWS CHANGED ({old['rows']} -> {result['rows']})"
+            elif ratio > 1 + tolerance and result['seconds'] - old['seconds'] > min_seconds:
+                status = 'REGRESSION'
+            if status:
+                regressions.append((result, old, status))
+        baseline_ms = '' if old is None else f"{old['seconds'] * 1000:.2f}"
+        print(f"{result['scale']:>6g}x {result['benchmark']:<45}{baseline_ms:>13}{result['seconds'] * 1000:>12.2f}{change:>10}  {status}")
+    return regressions
+
+def bench_suite(args):
+    settings = {
+        'scales': args.scales,
+        'teams': args.teams,
+        'seed': args.seed,
+        'base_businesses': BASE_BUSINESSES,
+        'join_key': args.join_key,
+        'nested_limit': args.nested_limit,
+    }
+    results = run_suite(args.scales, args.teams, args.seed, args.repeat, args.join_key, args.nested_limit)
+    report = write_results(args.output, results, settings)
+    print(f"Wrote {len(results)} results to {args.output}")
+    if args.save_baseline:
+        write_results(args.baseline, results, settings)
+        print(f"Saved them as the baseline in {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run again with --save-baseline to store one")
+        return
+    regressions = compare_results(report, read_results(args.baseline), args.tolerance, args.min_ms / 1000)
+    if regressions is None:
+        return
+    if regressions:
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        raise SystemExit(1)
+    print(f"No regressions against {args.baseline}")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks for the MLB restaurant database")
+    arg_parser.add_argument('--data', default='data', help="Directory containing the team JSON files")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement, the best time is reported")
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('parser', help="Compare the classic and scanner parser engines")
+    load_parser = subparsers.add_parser('load', help="Time parallel loading of the data directory by worker count")
+    load_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="Worker counts to try, the first one is the baseline")
+    join_parser = subparsers.add_parser('join', help="Compare the join algorithms on the largest team pairs")
+    join_parser.add_argument('--keys', nargs='+', default=['name', 'alias', 'price'], help="Join keys to try")
+    join_parser.add_argument('--pairs', type=int, default=3, help="Number of team pairs, largest teams first")
+    suite_parser = subparsers.add_parser('suite', help="Time parsing, loading, every operator and the query pages on synthetic data, and compare with a baseline")
+    suite_parser.add_argument('--scales', type=float, nargs='+', default=[1, 10], help=f"Team sizes to generate, as multiples of {BASE_BUSINESSES} businesses")
+    suite_parser.add_argument('--teams', type=int, default=2, help="Synthetic team files per scale (two or more also times the joins)")
+    suite_parser.add_argument('--seed', type=int, default=551, help="Random seed of the synthetic data")
+    suite_parser.add_argument('--join-key', default='id', help="Key the two synthetic teams are joined on")
+    suite_parser.add_argument('--nested-limit', type=int, default=2000, help="Largest team size the nested loop join is timed on")
+    suite_parser.add_argument('--output', default='benchmark_results.json', help="File the results are written to")
+    suite_parser.add_argument('--baseline', default='benchmark_baseline.json', help="Results file to compare against")
+    suite_parser.add_argument('--save-baseline', action='store_true', help="Store this run as the baseline instead of comparing")
+    suite_parser.add_argument('--tolerance', type=float, default=0.25, help="Slowdown allowed before a benchmark is flagged, as a fraction")
+    suite_parser.add_argument('--min-ms', type=float, default=1.0, help="Slowdowns smaller than this many ms are never flagged")
+
+    args = arg_parser.parse_args()
+    if args.command == 'parser':
+        bench_parser(args.data, args.repeat)
+    elif args.command == 'load':
+        bench_load(args.data, args.repeat, args.workers)
+    elif args.command == 'join':
+        bench_join(args.data, args.repeat, args.keys, args.pairs)
+    elif args.command == 'suite':
+        bench_suite(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# DSCI 551 Final Project - Darren Parry
+
+import urllib.error
+import urllib.request
+
+from cursor import ResultCursor, DEFAULT_PAGE_SIZE
+from parser import SimpleJSONParser, dumps
+
+# Talks to a running query server (see server.py), e.g.
+#   client = QueryClient('http://127.0.0.1:8551')
+#   result = client.query('Chicago_Cubs_restaurants.json', Query().filter('rating', '>=', 4.5), limit=10)
+#   results = client.batch([query_request(team, plan) for team in client.teams()])
+
+class QueryServerError(Exception):
+    # The server could not be reached, or answered a query with an error
+    pass
+
+def query_request(team, plan, by_team=False, offset=0, limit=None, version=None):
+    # One query of a batch: a Query (or its steps) on a team file or on "All teams". version, when given, is the
+    # 'version' of an earlier result, and the query fails if the data changed since.
+    steps = plan.steps if hasattr(plan, 'steps') else plan
+    return {'team': team, 'steps': steps, 'by_team': by_team, 'offset': offset, 'limit': limit, 'version': version}
+
+class QueryClient:
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        # Sends one request (a POST when there is a payload) and returns the parsed JSON answer
+        try:
+            data = None if payload is None else dumps(payload).encode('utf-8')
+        except ValueError as e:
+            # Our JSON writer cannot write some values, e.g. a string with a double quote typed into a filter
+            raise QueryServerError(f"Could not send the query to the query server: {e}")
+        request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            body = e.read()
+        except (urllib.error.URLError, OSError) as e:
+            raise QueryServerError(f"Could not reach the query server at {self.url}: {e}")
+        answer = SimpleJSONParser().parse(body.decode('utf-8'))
+        if isinstance(answer, dict) and 'error' in answer:
+            raise QueryServerError(answer['error'])
+        return answer
+
+    def health(self):
+        return self._call('/health')
+
+    def teams(self):
+        # The team file names the server has
+        return self._call('/teams')['teams']
+
+    def batch(self, requests):
+        # Runs several queries (see query_request) in one call and returns their results in the same order. A query
+        # that failed has an 'error' instead of rows, so one bad query does not lose the others.
+        return self._call('/query', {'queries': list(requests)})['results']
+
+    def query(self, team, plan, by_team=False, offset=0, limit=None, version=None):
+        # Runs one query and returns its result: 'rows' (from offset, at most limit of them), 'total', 'filtered' and
+        # the 'version' of the data it read
+        result = self.batch([query_request(team, plan, by_team, offset, limit, version)])[0]
+        if 'error' in result:
+            raise QueryServerError(result['error'])
+        return result
+
+    def cursor(self, team, plan, by_team=False, page_size=DEFAULT_PAGE_SIZE):
+        # A ResultCursor over a query's result that fetches the rows a page at a time as they are shown. The server
+        # keeps the whole result cached, so each later page is a lookup there. Later pages are asked for at the first
+        # page's version, so a write in between raises QueryServerError instead of mixing rows of two versions.
+        first = self.query(team, plan, by_team, 0, page_size)
+
+        def rows():
+            yield from first['rows']
+            offset = len(first['rows'])
+            while offset < first['total']:
+                page = self.query(team, plan, by_team, offset, page_size, first['version'])['rows']
+                if not page:
+                    return
+                yield from page
+                offset += len(page)
+        return ResultCursor(rows(), first['total'], notes={'filtered': first['filtered']})
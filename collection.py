@@ -0,0 +1,164 @@
+# DSCI 551 Final Project - Darren Parry
+
+import uuid
+
+from indexes import HashIndex, SortedIndex
+from columnar import build_column
+from textindex import TextIndex
+from sketches import TeamSketches
+
+# Fields indexed for every loaded team: hash indexes answer equality filters, sorted indexes answer range filters.
+# Hash indexes also cover the nested fields people filter on most, given as paths (see paths.py).
+DEFAULT_HASH_FIELDS = ('id', 'alias', 'name', 'price', 'location.city', 'location.zip_code', 'categories[].alias')
+DEFAULT_SORTED_FIELDS = ('rating', 'review_count', 'distance')
+# Fields also stored as columns: numbers as typed arrays, strings dictionary-encoded
+DEFAULT_COLUMN_FIELDS = ('rating', 'review_count', 'distance', 'price')
+
+def new_version():
+    # A version stamp no other loaded Collection has, even one built in another worker process
+    return uuid.uuid4().hex
+
+class Collection(list):
+    # A team's list of businesses along with its stadium header fields, secondary indexes and optional columns.
+    # It is still a list, so every function in functions.py works on it unchanged.
+    # version changes whenever the team is loaded again or written to, so results cached for an older copy are never reused.
+    def __init__(self, documents=(), header=None):
+        super().__init__(documents)
+        self.header = header if header is not None else {}
+        self.version = new_version()
+        self.hash_indexes = {}
+        self.sorted_indexes = {}
+        self.columns = {}
+        # The team file's operation log (see oplog.py) when the documents can be written to
+        self.log = None
+        # Inverted index over the words of the names, aliases and category titles (see textindex.py)
+        self.text_index = None
+        # Sample and sketches for approximate aggregates (see sketches.py), built again after a write when next used
+        self.sketches = None
+
+    def build_indexes(self, hash_fields=DEFAULT_HASH_FIELDS, sorted_fields=DEFAULT_SORTED_FIELDS):
+        # Builds the hash and sorted indexes once, right after the team is loaded
+        for field in hash_fields:
+            self.hash_indexes[field] = HashIndex(field, self)
+        for field in sorted_fields:
+            index = SortedIndex(field, self)
+            if index.usable:
+                self.sorted_indexes[field] = index
+        return self
+
+    def build_columns(self, fields=DEFAULT_COLUMN_FIELDS):
+        # Builds the columnar copy of the given fields; fields with mixed value types are left out and stay row-only
+        for field in fields:
+            column = build_column(field, self)
+            if column is not None:
+                self.columns[field] = column
+        return self
+
+    def build_text_index(self, index=None):
+        # Keeps a text index built elsewhere (e.g. loaded from disk) or builds one from the documents
+        self.text_index = index if index is not None else TextIndex(self)
+        return self
+
+    def build_sketches(self, sketches=None):
+        # Keeps sketches built elsewhere (e.g. loaded from disk) or builds them from the documents, as of this version
+        self.sketches = sketches if sketches is not None else TeamSketches(self)
+        self.sketches.version = self.version
+        return self
+
+    def access_path(self, field, operator, value):
+        # Returns (positions, kind) for the cheapest way to answer `field operator value` without a scan: a hash index,
+        # then a sorted index, then a column. Returns (None, 'scan') when the documents have to be scanned.
+        if operator == '==' and field in self.hash_indexes:
+            positions = self.hash_indexes[field].lookup(value)
+            if positions is not None:
+                return positions, 'hash index'
+        if field in self.sorted_indexes:
+            positions = self.sorted_indexes[field].range(operator, value)
+            if positions is not None:
+                return positions, 'sorted index'
+        if field in self.columns:
+            positions = self.columns[field].select(operator, value)
+            if positions is not None:
+                return positions, 'column'
+        return None, 'scan'
+
+    def position_of(self, business_id):
+        # Returns the position of the document with this id, or None
+        index = self.hash_indexes.get('id')
+        if index is not None:
+            positions = index.lookup(business_id)
+            if positions is not None:
+                return positions[0] if positions else None
+        for position, document in enumerate(self):
+            if document.get('id') == business_id:
+                return position
+        return None
+
+    def _unindex(self, position, document):
+        for index in self.hash_indexes.values():
+            index.remove(position, document)
+        for index in self.sorted_indexes.values():
+            index.remove(position, document)
+        if self.text_index is not None:
+            self.text_index.remove(position, document)
+
+    def _index(self, position, document):
+        # Adds a document at a position to every index and column. An index or column the new value does not fit
+        # (e.g. a string rating in a number index) is dropped, and its field is scanned from then on.
+        for index in self.hash_indexes.values():
+            index.add(position, document)
+        for field, index in list(self.sorted_indexes.items()):
+            if not index.add(position, document):
+                del self.sorted_indexes[field]
+        for field, column in list(self.columns.items()):
+            if not column.set(position, document):
+                del self.columns[field]
+        if self.text_index is not None:
+            self.text_index.add(position, document)
+
+    # The write methods below update the indexes and columns in place instead of rebuilding them
+
+    def insert_document(self, document):
+        # Appends a document and returns its position
+        position = len(self)
+        self.append(document)
+        self._index(position, document)
+        self.version = new_version()
+        return position
+
+    def replace_document(self, position, document):
+        # Puts a new document in place of the one at a position
+        self._unindex(position, self[position])
+        self[position] = document
+        self._index(position, document)
+        self.version = new_version()
+
+    def remove_document(self, position):
+        # Removes the document at a position and returns it. The last document moves into its place, so only that
+        # one document changes position instead of every document after it.
+        document = self[position]
+        last = len(self) - 1
+        self._unindex(position, document)
+        if position != last:
+            moved = self[last]
+            self._unindex(last, moved)
+            self[position] = moved
+            self._index(position, moved)
+        list.pop(self)
+        for column in self.columns.values():
+            column.pop()
+        self.version = new_version()
+        return document
+
+def find_business(data, position, business_id):
+    # The business a search found at a position of a team, or None when it was deleted since. A write can move a
+    # business to another position (see remove_document), so when the one there has another id it is found by its id.
+    if position < len(data):
+        document = data[position]
+        if document.get('id') == business_id:
+            return document
+    if isinstance(data, Collection):
+        position = data.position_of(business_id)
+        if position is not None:
+            return data[position]
+    return None
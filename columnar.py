@@ -0,0 +1,191 @@
+# DSCI 551 Final Project - Darren Parry
+
+import operator as op
+from array import array
+from itertools import compress
+
+# Comparison operators the columns can evaluate, matching the ones functions.filter accepts
+COMPARISONS = {
+    '==': op.eq,
+    '!=': op.ne,
+    '<': op.lt,
+    '<=': op.le,
+    '>': op.gt,
+    '>=': op.ge,
+}
+
+class NumericColumn:
+    # A numeric field stored as a typed array ('q' for ints, 'd' for floats) plus a validity mask that marks which
+    # documents have the field. Only built when every value of the field has the same type, so the results are
+    # exactly what the row-by-row functions return.
+    def __init__(self, field, typecode, values, valid):
+        self.field = field
+        self.typecode = typecode
+        self.values = values
+        self.valid = valid
+        self.count = sum(valid)
+
+    def valid_values(self):
+        # The values of the documents that have the field, skipping the mask when every document has it
+        if self.count == len(self.values):
+            return self.values
+        return compress(self.values, self.valid)
+
+    def sum(self):
+        return sum(self.valid_values())
+
+    def avg(self):
+        return self.sum() / self.count if self.count > 0 else 0
+
+    def min(self):
+        return min(self.valid_values()) if self.count > 0 else None
+
+    def max(self):
+        return max(self.valid_values()) if self.count > 0 else None
+
+    def _entry(self, document):
+        # The (value, valid) pair stored for a document, or None when its value does not fit the column's type
+        if self.field not in document:
+            return 0, 0
+        value = document[self.field]
+        if type(value) is not (int if self.typecode == 'q' else float):
+            return None
+        return value, 1
+
+    def set(self, position, document):
+        # Stores a document's value at a position, appending when the position is one past the end. Returns False when
+        # the value does not fit the column, after which the column can no longer be used.
+        entry = self._entry(document)
+        if entry is None:
+            return False
+        try:
+            if position == len(self.values):
+                self.values.append(entry[0])
+                self.valid.append(entry[1])
+            else:
+                self.count -= self.valid[position]
+                self.values[position] = entry[0]
+                self.valid[position] = entry[1]
+        except OverflowError:
+            return False
+        self.count += entry[1]
+        return True
+
+    def pop(self):
+        # Removes the value of the last document
+        self.values.pop()
+        self.count -= self.valid.pop()
+
+    def select(self, operator, value):
+        # Returns the positions of the documents matching `field operator value`, or None when the value is not a number
+        # (a scan might raise TypeError for it, so the caller scans instead)
+        if operator not in COMPARISONS or not isinstance(value, (int, float)):
+            return None
+        compare = COMPARISONS[operator]
+        if self.count == len(self.values):
+            return [position for position, item in enumerate(self.values) if compare(item, value)]
+        return [position for position, item in enumerate(self.values) if compare(item, value) and self.valid[position]]
+
+class StringColumn:
+    # A string field stored dictionary-encoded: each distinct string is kept once and every document holds its code
+    # (-1 when the document does not have the field)
+    def __init__(self, field, codes, dictionary):
+        self.field = field
+        self.codes = codes
+        self.dictionary = dictionary
+        self.count = len(codes) - codes.count(-1)
+        # Code of each string, only built once documents are written (see set)
+        self.lookup = None
+
+    # Strings are never numbers, so the numeric aggregates behave as they do on rows with no numeric values
+    def sum(self):
+        return 0
+
+    def avg(self):
+        return 0
+
+    def min(self):
+        return None
+
+    def max(self):
+        return None
+
+    def set(self, position, document):
+        # Stores a document's code at a position like NumericColumn.set, adding new strings to the dictionary
+        if self.field in document:
+            value = document[self.field]
+            if type(value) is not str:
+                return False
+            if self.lookup is None:
+                self.lookup = {item: code for code, item in enumerate(self.dictionary)}
+            code = self.lookup.get(value)
+            if code is None:
+                code = self.lookup[value] = len(self.dictionary)
+                self.dictionary.append(value)
+        else:
+            code = -1
+        if position == len(self.codes):
+            self.codes.append(code)
+        else:
+            self.count -= self.codes[position] != -1
+            self.codes[position] = code
+        self.count += code != -1
+        return True
+
+    def pop(self):
+        # Removes the code of the last document; its string stays in the dictionary
+        self.count -= self.codes.pop() != -1
+
+    def select(self, operator, value):
+        # Evaluates the comparison once per distinct string, then picks the documents whose code matched
+        if operator not in COMPARISONS or not isinstance(value, str):
+            return None
+        compare = COMPARISONS[operator]
+        matching_codes = {code for code, item in enumerate(self.dictionary) if compare(item, value)}
+        return [position for position, code in enumerate(self.codes) if code in matching_codes]
+
+def build_column(field, data):
+    # Builds the column for one field, or returns None when its values are of mixed or unsupported types
+    value_types = set()
+    for document in data:
+        if field in document:
+            value_types.add(type(document[field]))
+            if len(value_types) > 1:
+                return None
+
+    if value_types == {int}:
+        typecode = 'q'
+    elif value_types == {float}:
+        typecode = 'd'
+    elif value_types == {str}:
+        codes = array('i')
+        dictionary = []
+        lookup = {}
+        for document in data:
+            if field in document:
+                value = document[field]
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(dictionary)
+                    dictionary.append(value)
+                codes.append(code)
+            else:
+                codes.append(-1)
+        return StringColumn(field, codes, dictionary)
+    else:
+        return None
+
+    values = array(typecode)
+    valid = bytearray()
+    try:
+        for document in data:
+            if field in document:
+                values.append(document[field])
+                valid.append(1)
+            else:
+                values.append(0)
+                valid.append(0)
+    except OverflowError:
+        # An int too large for a 64-bit column
+        return None
+    return NumericColumn(field, typecode, values, valid)
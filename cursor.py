@@ -0,0 +1,92 @@
+# DSCI 551 Final Project - Darren Parry
+
+import threading
+from collections.abc import Sequence
+
+from paths import flatten
+from profiling import profiled
+
+# Rows shown per page in the app
+DEFAULT_PAGE_SIZE = 25
+
+class ResultCursor:
+    # A lazy view over a query's results for showing them a page at a time. Rows are pulled from the source only as
+    # far as the pages asked for so far and kept, so going back to a page never runs the query again. total may be
+    # a number or a function computing it (e.g. Query.count) so the row count is known without producing every row.
+    # notes holds anything else worth showing with the rows, e.g. the counters of Query.execute. A cursor can be
+    # shared by several app sessions through the query cache, so rows are produced under a lock.
+    def __init__(self, rows, total=None, notes=None):
+        self.notes = notes if notes is not None else {}
+        self._lock = threading.RLock()
+        if isinstance(rows, Sequence):
+            self.rows = rows
+            self.source = None
+            self._total = len(rows)
+        else:
+            self.rows = []
+            self.source = iter(rows)
+            self._total = total
+
+    def _fill(self, end):
+        # Pulls rows from the source until `end` rows are kept (all of them when end is None) or it runs out
+        if self.source is None:
+            return
+        while end is None or len(self.rows) < end:
+            try:
+                self.rows.append(next(self.source))
+            except StopIteration:
+                self.source = None
+                self._total = len(self.rows)
+                return
+
+    def total(self):
+        # Number of rows in the whole result
+        with self._lock:
+            if callable(self._total):
+                self._total = self._total()
+            if self._total is None:
+                self._fill(None)
+            return self._total
+
+    @profiled('ResultCursor.page', data_arg=None)
+    def page(self, number, size=DEFAULT_PAGE_SIZE):
+        # The rows of one page, counting pages from 0
+        start = number * size
+        with self._lock:
+            self._fill(start + size)
+            return self.rows[start:start + size]
+
+    def page_count(self, size=DEFAULT_PAGE_SIZE):
+        # Number of pages, at least 1 so an empty result still has a page to show
+        return max(1, -(-self.total() // size))
+
+    def produced(self):
+        # How many rows have been produced so far
+        return len(self.rows)
+
+def _kind(value):
+    # The kind of a table cell: booleans, numbers and strings each make a clean column, anything else is shown as text
+    if type(value) is bool:
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    return 'other'
+
+def table_rows(rows):
+    # Flattens rows for st.dataframe (see paths.flatten). A column whose values are of more than one kind is turned
+    # into text, so the table never fails on mixed types.
+    flat_rows = [flatten(row) for row in rows]
+    kinds = {}
+    for row in flat_rows:
+        for name, value in row.items():
+            if value is not None:
+                kinds.setdefault(name, set()).add(_kind(value))
+    mixed = {name for name, seen in kinds.items() if len(seen) > 1 or 'other' in seen}
+    if mixed:
+        for row in flat_rows:
+            for name in mixed:
+                if row.get(name) is not None:
+                    row[name] = str(row[name])
+    return flat_rows
@@ -0,0 +1,127 @@
+# DSCI 551 Final Project - Darren Parry
+
+import os
+import threading
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from loader import list_team_files, load_team_data
+
+# Fields added to the rows of an all-teams query, taken from each team file's header
+TAG_FIELDS = ('team', 'stadium')
+
+# Worker pools kept for the life of the process by number of workers, so each query does not start new processes
+_pools = {}
+_pools_lock = threading.Lock()
+
+def worker_pool(workers):
+    # The long-lived pool of `workers` processes, started the first time it is needed
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return pool
+
+def _drop_pool(workers, pool):
+    # Forgets a pool whose worker died, so the next query starts a new one
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False)
+
+def team_tags(data, filename):
+    # The tag values of one team: its name and stadium from the header, falling back to the file name
+    header = getattr(data, 'header', None) or {}
+    return {'team': header.get('team', filename), 'stadium': header.get('stadium')}
+
+def tag_rows(rows, tags):
+    # Copies of the rows with the team tags in front
+    return [{**tags, **row} for row in rows]
+
+def run_team(plan, data, filename, by_team):
+    # Runs one team's share of an all-teams query and returns (kind, payload, filtered).
+    # by_team runs the whole plan on the team; otherwise only the part that can be combined with the other teams
+    # runs here (see Query.run_partial). Rows are tagged with the team and stadium either way.
+    if not isinstance(data, Sequence):
+        # A file without a businesses list has nothing to query
+        return 'rows', [], 0
+    tags = team_tags(data, filename)
+    if by_team:
+        counters = {}
+        rows = plan.execute(data, counters)
+        return 'rows', tag_rows(rows, tags), counters['filtered']
+    kind, payload, filtered = plan.run_partial(data)
+    if kind == 'rows':
+        payload = tag_rows(payload, tags)
+    return kind, payload, filtered
+
+def _load_and_run(plan, file_path, cache, by_team):
+    # Worker process entry point: loads one team file (from the snapshot cache when it is fresh) and runs its share.
+    # The team is scanned once and dropped, so it is loaded without indexes, text index or sketches.
+    # Returns (share, error) so a bad file is reported instead of stopping the other teams.
+    data, error = load_team_data(file_path, cache, indexed=False)
+    if error is not None:
+        return None, error
+    return run_team(plan, data, os.path.basename(file_path), by_team), None
+
+def run_all_teams(plan, directory, by_team=False, workers=None, cache=None, loaded=None, min_parallel_files=4, counters=None, on_error=None):
+    # Runs a Query over every team file in a directory at once and returns the rows, each tagged with its team and
+    # stadium when it comes from one team.
+    #   - by_team=False answers league-wide: the teams are combined as if they were one dataset, with group
+    #     aggregates merged from each team's partial accumulators, so an avg is the league's sum over its count
+    #   - by_team=True runs the whole plan on each team and lists every team's rows one after another
+    # The teams in `loaded` (a mapping from file name to data), when it is given, run in this process on that data.
+    # The other files are spread across a long-lived pool of `workers` processes (default: one per CPU) that each load
+    # them; with one worker, or fewer than min_parallel_files such files, they are loaded here too. A counters dict
+    # receives 'filtered' like Query.execute, summed over every team, and errors loading a file are passed to on_error.
+    filenames = list_team_files(directory)
+    file_paths = [os.path.join(directory, filename) for filename in filenames]
+    local = [loaded is not None and loaded.get(filename) is not None for filename in filenames]
+    to_load = [file_path for file_path, is_local in zip(file_paths, local) if not is_local]
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(to_load))
+
+    pending = None
+    if workers > 1 and len(to_load) >= min_parallel_files:
+        pool = worker_pool(workers)
+        count = len(to_load)
+        try:
+            pending = pool.map(_load_and_run, [plan] * count, to_load, [cache] * count, [by_team] * count)
+        except BrokenProcessPool:
+            _drop_pool(workers, pool)
+            raise
+
+    # The loaded teams run here, while the workers load the rest
+    results = []
+    for filename, file_path, is_local in zip(filenames, file_paths, local):
+        if is_local:
+            results.append((run_team(plan, loaded[filename], filename, by_team), None))
+        elif pending is None:
+            results.append(_load_and_run(plan, file_path, cache, by_team))
+        else:
+            results.append(None)
+    if pending is not None:
+        try:
+            worker_results = iter(list(pending))
+        except BrokenProcessPool:
+            _drop_pool(workers, pool)
+            raise
+        results = [result if is_local else next(worker_results) for result, is_local in zip(results, local)]
+
+    shares = []
+    filtered = 0
+    for share, error in results:
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            continue
+        kind, payload, team_filtered = share
+        shares.append((kind, payload))
+        filtered += team_filtered
+    if counters is not None:
+        counters['filtered'] = filtered
+
+    if by_team:
+        return [row for _, rows in shares for row in rows]
+    return plan.combine_partials(shares, TAG_FIELDS)
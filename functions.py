@@ -1,44 +1,118 @@
 # DSCI 551 Final Project - Darren Parry
 
+import heapq
+from itertools import islice
+
+import joins
+import oplog
+import paths
+import predicates
+from columnar import COMPARISONS
+from collection import Collection
+from parser import dumps
+from profiling import profiled
+from textindex import TextIndex
+from sketches import TeamSketches, HyperLogLog, QuantileSketch, z_score, estimate_total, estimate_mean
+
+@profiled('filter')
 def filter(data, field, operator, value):
     # Function that takes an empty result and filters the list into the given operator
+    # data can be a list or any iterable of documents, e.g. a SimpleJSONParser.iterparse stream
+    # A loaded team Collection answers the filter from its hash or sorted index when it has one for the field,
+    # and otherwise from its column for the field
+    # A dotted path such as 'location.zip_code' or 'categories[].alias' (see paths.py) matches when any of its values does
+    # A value that cannot be compared with `value` (e.g. rating >= 'x') does not match instead of raising, the same as
+    # in filter_where and Query
+    if isinstance(data, Collection):
+        positions, _ = data.access_path(field, operator, value)
+        if positions is not None:
+            return [data[position] for position in positions]
+
+    if paths.is_path(field):
+        compare = COMPARISONS.get(operator)
+        if compare is None:
+            return []
+
+        def matches(doc_value):
+            try:
+                return compare(doc_value, value)
+            except TypeError:
+                return False
+        getter = paths.compile_getter(field)
+        if getter is not None:
+            missing = paths.MISSING
+            results = []
+            for document in data:
+                doc_value = getter(document)
+                if doc_value is not missing and matches(doc_value):
+                    results.append(document)
+            return results
+        accessor = paths.compile_path(field)
+        return [document for document in data if any(matches(doc_value) for doc_value in accessor(document))]
+
     results = []
     for document in data:
         if field not in document:
             continue
         if field in document:
             doc_value = document[field]
-            if operator == '==':
-                if doc_value == value:
-                    results.append(document)
-            elif operator == '!=':
-                if doc_value != value:
-                    results.append(document)
-            elif operator == '<':
-                if doc_value < value:
-                    results.append(document)
-            elif operator == '<=':
-                if doc_value <= value:
-                    results.append(document)
-            elif operator == '>':
-                if doc_value > value:
-                    results.append(document)
-            elif operator == '>=':
-                if doc_value >= value:
-                    results.append(document)
+            try:
+                if operator == '==':
+                    if doc_value == value:
+                        results.append(document)
+                elif operator == '!=':
+                    if doc_value != value:
+                        results.append(document)
+                elif operator == '<':
+                    if doc_value < value:
+                        results.append(document)
+                elif operator == '<=':
+                    if doc_value <= value:
+                        results.append(document)
+                elif operator == '>':
+                    if doc_value > value:
+                        results.append(document)
+                elif operator == '>=':
+                    if doc_value >= value:
+                        results.append(document)
+            except TypeError:
+                continue
     return results
 
+@profiled('filter_where')
+def filter_where(data, condition):
+    # Function that filters on a compound condition in one pass, e.g.
+    # ('and', ('rating', '>=', 4.5), ('price', '==', '$$'), ('review_count', '>', 500))
+    # The condition (see predicates.py) is compiled once, with its clauses ordered by estimated selectivity
+    return predicates.select(data, condition)
+
+@profiled('projection')
 def projection(data, fields):
     # Function that takes an empty list and projects only said data
+    # Like filter, data can also be a SimpleJSONParser.iterparse stream
+    # Paths like 'location.city' keep their nesting in the output, e.g. {'location': {'city': 'Milwaukee'}}
+    if any(paths.is_path(field) for field in fields):
+        projector = paths.compile_projection(fields)
+        return [projector(document) for document in data]
     results = []
     for document in data:
         projected_doc = {field: document[field] for field in fields if field in document}
         results.append(projected_doc)
     return results
 
+@profiled('group_by')
 def group_by(data, field):
     # Function that groups like data with data fields
+    # Grouping on an array path like 'categories[].alias' puts a document in the group of each of its values
     grouped_data = {}
+    if paths.is_path(field):
+        keys = paths.key_function(field)
+        for document in data:
+            for key in keys(document):
+                if key not in grouped_data:
+                    grouped_data[key] = []
+                grouped_data[key].append(document)
+        return grouped_data
     for document in data:
         key = document.get(field)
         if key not in grouped_data:
@@ -46,16 +120,165 @@ def group_by(data, field):
         grouped_data[key].append(document)
     return grouped_data
 
+# Aggregate functions group_aggregate can compute
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+
+@profiled('group_aggregate')
+def group_aggregate(data, keys, specs):
+    # Function that groups and aggregates in one pass without building the per-group document lists.
+    # keys is a field name or a list of field names (a composite key), which may be paths like 'location.city'.
+    # specs is a list of (function, field) pairs, named f"{function}_{field}" in the output, or a dict mapping output
+    # names to (function, field) pairs.
+    # Gives the same values as group_by followed by the aggregate_* functions, with groups in first-seen order.
+    return finish_partials(group_partials(data, keys, specs))
+
+@profiled('group_partials')
+def group_partials(data, keys, specs):
+    # The first half of group_aggregate: groups the data and returns the running accumulators of every group instead of
+    # the final rows. Partials of different datasets (e.g. every team) can be combined with merge_partials, and
+    # finish_partials turns them into rows, so an avg is the merged sum over the merged count.
+    key_fields = [keys] if isinstance(keys, str) else list(keys)
+    named_specs = _named_specs(specs)
+
+    # Every field a spec reads gets four running accumulators per group, stored flat after the document count:
+    # total, numeric count, min and max. min and max are only tracked when a spec asks for them.
+    plan = []
+    for _, (function, field) in named_specs:
+        if function == 'count':
+            continue
+        for entry in plan:
+            if entry[0] == field:
+                break
+        else:
+            entry = [field, 1 + 4 * len(plan), False, False]
+            plan.append(entry)
+        entry[2] = entry[2] or function == 'min'
+        entry[3] = entry[3] or function == 'max'
+    empty_state = [0] + [0, 0, None, None] * len(plan)
+    single_key = key_fields[0] if len(key_fields) == 1 else None
+
+    # Keys given as paths can give a document several keys, like group_by; it is counted once in each of their groups
+    key_functions = None
+    if any(paths.is_path(field) for field in key_fields):
+        key_functions = [paths.key_function(field) for field in key_fields]
+
+    groups = {}
+    for document in data:
+        if key_functions is not None:
+            document_keys = _path_keys(document, key_functions, single_key is not None)
+        elif single_key is not None:
+            document_keys = (document.get(single_key),)
+        else:
+            document_keys = (tuple(document.get(field) for field in key_fields),)
+        for key in document_keys:
+            state = groups.get(key)
+            if state is None:
+                state = groups[key] = empty_state.copy()
+            state[0] += 1
+            for field, base, track_min, track_max in plan:
+                value = document.get(field)
+                if isinstance(value, (int, float)):
+                    state[base] += value
+                    state[base + 1] += 1
+                    if track_min and (state[base + 2] is None or value < state[base + 2]):
+                        state[base + 2] = value
+                    if track_max and (state[base + 3] is None or value > state[base + 3]):
+                        state[base + 3] = value
+
+    return {'keys': key_fields, 'specs': named_specs, 'plan': plan, 'groups': groups}
+
+@profiled('merge_partials')
+def merge_partials(partials):
+    # Combines the group_partials of several datasets grouped the same way, as if they were one dataset: counts,
+    # totals and numeric counts are added, and min and max keep the smaller and larger value
+    partials = list(partials)
+    merged = {}
+    plan = partials[0]['plan']
+    for partial in partials:
+        for key, state in partial['groups'].items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = state.copy()
+                continue
+            current[0] += state[0]
+            for _, base, track_min, track_max in plan:
+                current[base] += state[base]
+                current[base + 1] += state[base + 1]
+                if track_min and state[base + 2] is not None and (current[base + 2] is None or state[base + 2] < current[base + 2]):
+                    current[base + 2] = state[base + 2]
+                if track_max and state[base + 3] is not None and (current[base + 3] is None or state[base + 3] > current[base + 3]):
+                    current[base + 3] = state[base + 3]
+    return {'keys': partials[0]['keys'], 'specs': partials[0]['specs'], 'plan': plan, 'groups': merged}
+
+@profiled('finish_partials', data_arg=None)
+def finish_partials(partial):
+    # The second half of group_aggregate: turns group accumulators into one output row per group
+    key_fields = partial['keys']
+    slots = {field: base for field, base, _, _ in partial['plan']}
+    results = []
+    for key, state in partial['groups'].items():
+        row = {key_fields[0]: key} if len(key_fields) == 1 else dict(zip(key_fields, key))
+        for name, (function, field) in partial['specs']:
+            if function == 'count':
+                row[name] = state[0]
+                continue
+            base = slots[field]
+            total, count, min_value, max_value = state[base:base + 4]
+            if function == 'sum':
+                row[name] = total
+            elif function == 'avg':
+                row[name] = total / count if count > 0 else 0
+            elif function == 'min':
+                row[name] = min_value
+            else:
+                row[name] = max_value
+        results.append(row)
+    return results
+
+def _named_specs(specs):
+    # The (output name, (function, field)) pairs of group_aggregate's specs, checking every function is known
+    if isinstance(specs, dict):
+        named_specs = list(specs.items())
+    else:
+        named_specs = [(f"{function}_{field}", (function, field)) for function, field in specs]
+    for _, (function, _) in named_specs:
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unknown aggregate function: {function}")
+    return named_specs
+
+def _path_keys(document, key_functions, single):
+    # Every combination of a document's values for the key fields, as the group keys it belongs to
+    if single:
+        return key_functions[0](document)
+    combinations = [()]
+    for keys in key_functions:
+        combinations = [combination + (key,) for combination in combinations for key in keys(document)]
+    return combinations
+
+def _column(data, field):
+    # Returns the column a loaded team Collection keeps for the field, or None so the caller walks the documents
+    if isinstance(data, Collection):
+        return data.columns.get(field)
+    return None
+
+@profiled('aggregate_sum')
 def aggregate_sum(data, field):
     # Function that adds up the given field
+    column = _column(data, field)
+    if column is not None:
+        return column.sum()
     total = 0
     for document in data:
         if field in document and isinstance(document[field], (int, float)):
             total += document[field]
     return total
 
+@profiled('aggregate_avg')
 def aggregate_avg(data, field):
     # Function that averages out the given field
+    column = _column(data, field)
+    if column is not None:
+        return column.avg()
     total = 0
     count = 0
     for document in data:
@@ -64,12 +287,17 @@ def aggregate_avg(data, field):
             count += 1
     return total / count if count > 0 else 0
 
+@profiled('aggregate_count')
 def aggregate_count(data):
     # Function that counts the amount of data
     return len(data)
 
+@profiled('aggregate_max')
 def aggregate_max(data, field):
     # Function that gets the max of the given data field
+    column = _column(data, field)
+    if column is not None:
+        return column.max()
     max_value = None
     for document in data:
         if field in document and isinstance(document[field], (int, float)):
@@ -77,8 +305,12 @@ def aggregate_max(data, field):
                 max_value = document[field]
     return max_value
 
+@profiled('aggregate_min')
 def aggregate_min(data, field):
     # Function that gets the min of the given data field
+    column = _column(data, field)
+    if column is not None:
+        return column.min()
     min_value = None
     for document in data:
         if field in document and isinstance(document[field], (int, float)):
@@ -86,20 +318,287 @@ def aggregate_min(data, field):
                 min_value = document[field]
     return min_value
 
-def join(data1, data1_key, data2, data2_key):
-    # Function that performs a nested loop join and handles key collisions by renaming keys from the second dataset.
+@profiled('distinct_count')
+def distinct_count(data, field):
+    # Function that counts the distinct values of a field or path (each element of an array path counts), leaving out
+    # missing and null values
+    seen = set()
+    for document in data:
+        for value in paths.values(document, field):
+            if value is None:
+                continue
+            try:
+                seen.add(value)
+            except TypeError:
+                # Unhashable values (objects and arrays) are told apart by their text
+                seen.add(repr(value))
+    return len(seen)
+
+@profiled('quantiles')
+def quantiles(data, field, fractions):
+    # Function that returns the value at each fraction (0.5 is the median) of a numeric field's sorted values, taking
+    # the value at rank fraction * (count - 1) rounded down, or None when no business has a number there
+    numbers = sorted(value for document in data for value in paths.values(document, field) if isinstance(value, (int, float)) and not isinstance(value, bool))
+    return [numbers[int(fraction * (len(numbers) - 1))] if numbers else None for fraction in fractions]
+
+def _team_sketches(data):
+    # The sketches of a team (see sketches.py). A Collection keeps its own and builds them again after a write; other
+    # data is sketched on every call.
+    if isinstance(data, Collection):
+        if data.sketches is None or data.sketches.version != data.version:
+            data.build_sketches()
+        return data.sketches
+    return TeamSketches(data)
+
+@profiled('approximate_distinct')
+def approximate_distinct(data, field):
+    # Function that estimates distinct_count from the team's HyperLogLog sketch, returning (estimate, relative standard
+    # error). A field without a prebuilt sketch is sketched on the spot.
+    sketch = _team_sketches(data).distinct.get(field)
+    if sketch is None:
+        sketch = HyperLogLog()
+        for document in data:
+            for value in paths.values(document, field):
+                if value is not None:
+                    sketch.add(value)
+    return round(sketch.count()), sketch.relative_error()
+
+@profiled('approximate_quantiles')
+def approximate_quantiles(data, field, fractions):
+    # Function that estimates quantiles from the team's quantile sketch; every value is within the sketch's accuracy
+    # (1%) of the exact one. A field without a prebuilt sketch is sketched on the spot.
+    sketch = _team_sketches(data).quantiles.get(field)
+    if sketch is None:
+        sketch = QuantileSketch()
+        for document in data:
+            for value in paths.values(document, field):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    sketch.add(value)
+    return [sketch.quantile(fraction) for fraction in fractions]
+
+@profiled('approximate_aggregate')
+def approximate_aggregate(data, keys, specs, confidence=0.95, filters=(), counters=None):
+    # Function that estimates group_aggregate from the team's reservoir sample instead of every business. filters are
+    # (field, operator, value) conditions applied first, like filter. Every count, sum and avg gets a f"{name}_margin"
+    # column, the half-width of its confidence interval at the given level; min and max are the sample's (margin None).
+    # Groups no sampled business falls in are missing. counters, when given, gets the estimated 'filtered' count and
+    # the 'sample' and 'population' sizes.
+    sketches = _team_sketches(data)
+    population = sketches.population
+    sample = [data[position] for position in sketches.sample]
+    sample_size = len(sample)
+    for field, operator, value in filters:
+        sample = filter(sample, field, operator, value)
+
+    key_fields = [keys] if isinstance(keys, str) else list(keys)
+    named_specs = _named_specs(specs)
+    numeric_fields = list(dict.fromkeys(field for _, (function, field) in named_specs if function != 'count'))
+    key_functions = [paths.key_function(field) for field in key_fields]
+    single = len(key_fields) == 1
+
+    # Per group: documents, then per numeric field its count, total, sum of squares, min and max in the sample
+    groups = {}
+    for document in sample:
+        for key in _path_keys(document, key_functions, single):
+            state = groups.get(key)
+            if state is None:
+                state = groups[key] = [0, {field: [0, 0, 0, None, None] for field in numeric_fields}]
+            state[0] += 1
+            for field, stats in state[1].items():
+                value = document.get(field)
+                if isinstance(value, (int, float)):
+                    stats[0] += 1
+                    stats[1] += value
+                    stats[2] += value * value
+                    if stats[3] is None or value < stats[3]:
+                        stats[3] = value
+                    if stats[4] is None or value > stats[4]:
+                        stats[4] = value
+
+    z = z_score(confidence)
     results = []
-    for doc1 in data1:
-        for doc2 in data2:
-            if data1_key in doc1 and data2_key in doc2 and doc1[data1_key] == doc2[data2_key]:
-                merged_doc = doc1.copy()
-                for key, value in doc2.items():                    
-                    if key == data2_key:
-                        continue                        
-                    if key in merged_doc:
-                        merged_doc[f"{key}_2"] = value
-                    else:
-                        merged_doc[key] = value
-                        
-                results.append(merged_doc)  
-    return results
\ No newline at end of file
+    for key, (count, stats) in groups.items():
+        row = {key_fields[0]: key} if single else dict(zip(key_fields, key))
+        for name, (function, field) in named_specs:
+            if function == 'count':
+                estimate, margin = estimate_total(population, sample_size, count, count, z)
+                estimate = round(estimate)
+            elif function == 'sum':
+                estimate, margin = estimate_total(population, sample_size, stats[field][1], stats[field][2], z)
+            elif function == 'avg':
+                estimate, margin = estimate_mean(population, sample_size, stats[field][1], stats[field][2], stats[field][0], z)
+            else:
+                estimate, margin = stats[field][3 if function == 'min' else 4], None
+            row[name] = estimate
+            row[f"{name}_margin"] = margin
+        results.append(row)
+    if counters is not None:
+        counters['filtered'] = round(population * len(sample) / sample_size) if sample_size else 0
+        counters['sample'] = sample_size
+        counters['population'] = population
+    return results
+
+def _sort_value(value):
+    # Orders values of any type without raising: numbers, then strings, then everything else by its text
+    if isinstance(value, (int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return (2, repr(value))
+
+class _Descending:
+    # Wraps a sort value so it orders in reverse, for descending fields whose values cannot be negated
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def _sort_key_function(fields, descending):
+    # Builds the sort key of a document for the given fields (which may be paths, using their first value).
+    # Documents missing a field, or holding None in it, sort after every other document in both directions.
+    directions = list(descending) if isinstance(descending, (list, tuple)) else [descending] * len(fields)
+    if len(directions) != len(fields):
+        raise ValueError("descending needs one value per sort field")
+    parts = []
+    for field, reverse in zip(fields, directions):
+        getter = None
+        if paths.is_path(field):
+            getter = paths.compile_getter(field)
+            if getter is None:
+                accessor = paths.compile_path(field)
+                getter = lambda document, accessor=accessor: next(iter(accessor(document)), paths.MISSING)
+        parts.append((field, getter, reverse))
+
+    def sort_key(document):
+        key = []
+        for field, getter, reverse in parts:
+            if getter is None:
+                value = document[field] if field in document else paths.MISSING
+            else:
+                value = getter(document)
+            if value is paths.MISSING or value is None:
+                key.append((1,))
+                continue
+            kind, value = _sort_value(value)
+            if reverse:
+                value = -value if kind == 0 else _Descending(value)
+            key.append((0, kind, value))
+        return key
+    return sort_key
+
+def _indexed_order(data, fields, descending, k):
+    # Returns the first k positions (all when k is None) of a Collection in sort order from its sorted index on a
+    # single field, or None when there is no usable index. Documents missing the field follow in position order.
+    if not isinstance(data, Collection) or len(fields) != 1 or isinstance(descending, (list, tuple)):
+        return None
+    index = data.sorted_indexes.get(fields[0])
+    if index is None:
+        return None
+    positions = list(islice(index.ordered_positions(descending), k))
+    if (k is None or len(positions) < k) and len(index) < len(data):
+        present = set(index.row_positions)
+        missing = (position for position in range(len(data)) if position not in present)
+        positions.extend(islice(missing, None if k is None else k - len(positions)))
+    return positions
+
+@profiled('order_by')
+def order_by(data, fields, descending=False):
+    # Function that sorts the data on one or more fields (a field name or a list of them; paths are allowed).
+    # descending is one bool for every field or a list with one per field. Ties keep their original order and
+    # documents missing a field (or holding None) go last, so the output is always the same for the same data.
+    fields = [fields] if isinstance(fields, str) else list(fields)
+    positions = _indexed_order(data, fields, descending, None)
+    if positions is not None:
+        return [data[position] for position in positions]
+    return sorted(data, key=_sort_key_function(fields, descending))
+
+@profiled('top_k')
+def top_k(data, fields, k, descending=True):
+    # Function that returns the first k documents of order_by(data, fields, descending) without sorting everything:
+    # a bounded heap keeps the best k seen so far, so it costs O(n log k). With no fields it returns the first k
+    # documents in their original order.
+    if k <= 0:
+        return []
+    fields = [fields] if isinstance(fields, str) else list(fields)
+    if not fields:
+        return list(islice(data, k))
+    positions = _indexed_order(data, fields, descending, k)
+    if positions is not None:
+        return [data[position] for position in positions]
+    # heapq.nsmallest is stable, so ties keep their original order like order_by
+    return heapq.nsmallest(k, data, key=_sort_key_function(fields, descending))
+
+@profiled('text_search')
+def text_search(data, text, mode='words', rank_by=None, descending=True, k=None):
+    # Function that returns the businesses whose name, alias or category titles match every word of `text`, with mode
+    # 'words' (whole words), 'prefix' or 'substring'. Results keep their original order, or are ranked by rating or
+    # review_count with the best k first. A Collection answers from its text index; other data is indexed first.
+    index = getattr(data, 'text_index', None)
+    if index is None:
+        index = TextIndex(data)
+    positions = index.ranked(index.search(text, mode), rank_by, descending, k)
+    return [data[position] for position in positions]
+
+@profiled('join')
+def join(data1, data1_key, data2, data2_key, how='inner'):
+    # Function that joins two datasets and handles key collisions by renaming keys from the second dataset.
+    # joins.py picks a hash join or sort-merge join for the data (nested loop only for unhashable keys); how is 'inner', 'left' or 'anti'.
+    return joins.join(data1, data1_key, data2, data2_key, how)
+
+def _check_write(data, record):
+    # Raises ValueError for a write that cannot be applied, before anything is logged
+    kind = record[0]
+    if kind == 'insert':
+        document = record[1]
+        if not isinstance(document, dict) or not document.get('id'):
+            raise ValueError("A business needs an 'id' field")
+        if data.position_of(document['id']) is not None:
+            raise ValueError(f"A business with id {document['id']} already exists")
+        dumps(document)
+        return
+    if data.position_of(record[1]) is None:
+        raise ValueError(f"No business with id {record[1]}")
+    if kind == 'update':
+        changes = record[2]
+        if 'id' in changes and changes['id'] != record[1]:
+            raise ValueError("The id of a business cannot be changed")
+        dumps(changes)
+
+def _write(data, record):
+    # Applies one write to a loaded team. A team loaded from a file logs the write first (see oplog.py), so it is kept
+    # across restarts, and the log is folded into the file in the background once it has compact_after records.
+    if not isinstance(data, Collection):
+        raise TypeError("Writes need a loaded team Collection")
+    log = data.log
+    if log is None:
+        _check_write(data, record)
+        return oplog.apply_record(data, record)
+    with log.lock:
+        _check_write(data, record)
+        log.append(record)
+        position = oplog.apply_record(data, record)
+    if log.records >= log.compact_after:
+        oplog.compact_in_background(data)
+    return position
+
+@profiled('insert', result_rows=None)
+def insert(data, document):
+    # Function that adds a business to a team and returns its position. Its indexes and columns are updated in place,
+    # so the business can be queried right away.
+    return _write(data, ('insert', document))
+
+@profiled('update', result_rows=None)
+def update(data, business_id, changes):
+    # Function that sets the given top-level fields of the business with this id and returns its position
+    return _write(data, ('update', business_id, dict(changes)))
+
+@profiled('delete', result_rows=None)
+def delete(data, business_id):
+    # Function that removes the business with this id. The team's last business takes its position.
+    return _write(data, ('delete', business_id))
@@ -0,0 +1,226 @@
+# DSCI 551 Final Project - Darren Parry
+
+import math
+from collections.abc import Mapping
+
+EARTH_RADIUS_METERS = 6371008.8
+# Meters in one degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_METERS / 180
+# Farthest apart two points on the Earth can be (half way around it); a search this wide covers everything
+MAX_DISTANCE_METERS = math.pi * EARTH_RADIUS_METERS
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    # Great-circle distance in meters between two points given in degrees
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+def business_coordinates(document):
+    # Returns the (latitude, longitude) of a business, or None when it has no usable coordinates
+    coordinates = document.get('coordinates')
+    if not isinstance(coordinates, Mapping):
+        return None
+    latitude = coordinates.get('latitude')
+    longitude = coordinates.get('longitude')
+    if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
+        return None
+    return latitude, longitude
+
+def stadium_coordinates(header):
+    # Returns the (latitude, longitude) of a team's stadium from its header fields, or None when they are missing
+    latitude = header.get('stadium latitude')
+    longitude = header.get('stadium longitude')
+    if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
+        return None
+    return latitude, longitude
+
+class GeoIndex:
+    # Grid index over business coordinates for every team. The map is cut into square cells of cell_degrees, and each
+    # cell lists the (team, position, id) of the businesses inside it, so a query only looks at the cells near the
+    # point. Documents are not kept here; callers look them up in their team data by team and position, and by id when
+    # a write moved the business since (see find_business). Columns wrap around the antimeridian, so cell_degrees must
+    # divide 180 evenly.
+    def __init__(self, cell_degrees=0.01):
+        self.cell_degrees = cell_degrees
+        # Cell columns around the whole world; stored columns run from -columns/2 to columns/2 - 1
+        self.columns = round(360 / cell_degrees)
+        if self.columns % 2 or abs(self.columns * cell_degrees - 360) > 1e-9:
+            raise ValueError(f"cell_degrees must divide 180 evenly, got {cell_degrees}")
+        self.cells = {}
+        self.stadiums = {}
+        self.size = 0
+        # Version of the team data each team was indexed from (see Collection.version)
+        self.versions = {}
+        # Smallest and largest (row, col) of any non-empty cell
+        self.low_cell = None
+        self.high_cell = None
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def _wrap(self, col):
+        # The stored column for a column index that may have gone past 180 degrees either way
+        half = self.columns // 2
+        return (col + half) % self.columns - half
+
+    def add_team(self, team, data, header=None):
+        # Adds every business of one team, and the team's stadium when the header has its coordinates
+        if header:
+            stadium = stadium_coordinates(header)
+            if stadium is not None:
+                self.stadiums[team] = stadium
+        self.versions[team] = getattr(data, 'version', None)
+        for position, document in enumerate(data):
+            point = business_coordinates(document)
+            if point is None:
+                continue
+            row, col = self._cell(*point)
+            # Longitude 180 is the same meridian as -180, so it goes in the first column
+            cell = (row, self._wrap(col))
+            self.cells.setdefault(cell, []).append((point[0], point[1], team, position, document.get('id')))
+            self.size += 1
+            if self.low_cell is None:
+                self.low_cell = self.high_cell = cell
+            else:
+                self.low_cell = (min(self.low_cell[0], cell[0]), min(self.low_cell[1], cell[1]))
+                self.high_cell = (max(self.high_cell[0], cell[0]), max(self.high_cell[1], cell[1]))
+        return self
+
+    def _ring(self, center, radius):
+        # Yields the cells at exactly `radius` cells away from the center cell (the border of a square), each once.
+        # Columns wrap around the antimeridian, so once the square is as wide as the world its rows cover every column.
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        half = self.columns // 2
+        if radius < half:
+            row_columns = range(col - radius, col + radius + 1)
+            side_columns = (col - radius, col + radius)
+        else:
+            row_columns = range(col - half, col + half)
+            side_columns = (col + half,) if radius == half else ()
+        for c in row_columns:
+            c = self._wrap(c)
+            yield (row - radius, c)
+            yield (row + radius, c)
+        for r in range(row - radius + 1, row + radius):
+            for c in side_columns:
+                yield (r, self._wrap(c))
+
+    def _column_distance(self, col1, col2):
+        # Columns between two stored columns, going whichever way around the world is shorter
+        distance = abs(col1 - col2)
+        return min(distance, self.columns - distance)
+
+    def _column_ranges(self, longitude, lon_span):
+        # The (low, high) cell columns covering longitude +- lon_span, split in two where the box reaches the
+        # antimeridian (180 degrees, whose businesses are in the first column) and never wider than the whole world
+        if lon_span >= 180:
+            spans = [(-180.0, 180.0)]
+        else:
+            west, east = longitude - lon_span, longitude + lon_span
+            if west < -180:
+                spans = [(-180.0, east), (west + 360, 180.0)]
+            elif east >= 180:
+                spans = [(west, 180.0), (-180.0, east - 360)]
+            else:
+                spans = [(west, east)]
+        return [(self._cell(0, west)[1], self._cell(0, east)[1]) for west, east in spans]
+
+    def within(self, latitude, longitude, meters):
+        # Returns (distance, team, position, id) for every business within `meters` of the point, nearest first
+        lat_span = meters / METERS_PER_DEGREE
+        if abs(latitude) + lat_span >= 90:
+            # The circle holds a pole, so it reaches every longitude
+            lon_span = 180.0
+        else:
+            # Widest longitude the circle reaches, which is away from its center latitude when the circle is large
+            lon_span = math.degrees(math.asin(min(1.0, math.sin(math.radians(lat_span)) / math.cos(math.radians(latitude)))))
+        # The box never needs to reach past the poles
+        low_row = self._cell(max(-90.0, latitude - lat_span), 0)[0]
+        high_row = self._cell(min(90.0, latitude + lat_span), 0)[0]
+        columns = self._column_ranges(longitude, lon_span)
+
+        box_cells = (high_row - low_row + 1) * sum(high - low + 1 for low, high in columns)
+        if box_cells > len(self.cells):
+            # A box with more cells than there are non-empty ones: checking every non-empty cell is cheaper
+            cells = [cell for cell in self.cells if low_row <= cell[0] <= high_row and any(low <= cell[1] <= high for low, high in columns)]
+        else:
+            cells = [(row, col) for row in range(low_row, high_row + 1) for low, high in columns for col in range(low, high + 1)]
+
+        results = []
+        for cell in cells:
+            for point_lat, point_lon, team, position, business_id in self.cells.get(cell, ()):
+                distance = haversine_meters(latitude, longitude, point_lat, point_lon)
+                if distance <= meters:
+                    results.append((distance, team, position, business_id))
+        results.sort()
+        return results
+
+    def nearest(self, latitude, longitude, k):
+        # Returns (distance, team, position, id) for the k businesses closest to the point, nearest first, with team and
+        # position breaking ties. Rings of cells are searched outward until no unsearched cell can hold anything closer.
+        if k <= 0 or not self.cells:
+            return []
+        row, col = self._cell(latitude, longitude)
+        center = (row, self._wrap(col))
+        # No cell is farther than half way around the world in longitude
+        col_radius = min(self.columns // 2, max(abs(center[1] - self.low_cell[1]), abs(center[1] - self.high_cell[1])))
+        max_radius = max(abs(center[0] - self.low_cell[0]), abs(center[0] - self.high_cell[0]), col_radius)
+
+        def unsearched_bound(radius):
+            # A point in this ring or beyond is at least (radius - 1) whole cells away in latitude or in longitude.
+            # A cell is narrowest in longitude at the highest latitude the band could reach, so that width is used.
+            band_latitude = min(90.0, abs(latitude) + self.cell_degrees * (radius + 1))
+            return (radius - 1) * self.cell_degrees * METERS_PER_DEGREE * math.cos(math.radians(band_latitude))
+
+        def add_cell(cell):
+            for point_lat, point_lon, team, position, business_id in self.cells.get(cell, ()):
+                candidates.append((haversine_meters(latitude, longitude, point_lat, point_lon), team, position, business_id))
+
+        candidates = []
+        for radius in range(max_radius + 1):
+            if len(candidates) >= k:
+                candidates.sort()
+                del candidates[k:]
+                # Everything in this ring or beyond is at least (radius - 1) whole cells away from the point
+                if unsearched_bound(radius) > candidates[-1][0]:
+                    break
+            if 8 * radius > len(self.cells):
+                # Past this point walking mostly empty rings costs more than visiting every remaining non-empty cell
+                for cell in self.cells:
+                    if max(abs(cell[0] - center[0]), self._column_distance(cell[1], center[1])) >= radius:
+                        add_cell(cell)
+                break
+            for cell in self._ring(center, radius):
+                add_cell(cell)
+
+        candidates.sort()
+        return candidates[:k]
+
+    def remove_team(self, team):
+        # Removes every business of one team. The bounds of the non-empty cells are kept, which only widens a search.
+        for cell in list(self.cells):
+            kept = [entry for entry in self.cells[cell] if entry[2] != team]
+            self.size -= len(self.cells[cell]) - len(kept)
+            if kept:
+                self.cells[cell] = kept
+            else:
+                del self.cells[cell]
+        self.versions.pop(team, None)
+
+    def refresh_team(self, team, data, header=None):
+        # Indexes a team again when its data changed since it was added, since writes move businesses to new positions.
+        # Returns True when it did.
+        if team in self.versions and self.versions[team] == getattr(data, 'version', None):
+            return False
+        self.remove_team(team)
+        self.add_team(team, data, header)
+        return True
+
+    def __len__(self):
+        return self.size
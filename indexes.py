@@ -0,0 +1,202 @@
+# DSCI 551 Final Project - Darren Parry
+
+from bisect import bisect_left, bisect_right, insort
+
+from paths import is_path, compile_path
+
+# Operators a sorted index can answer
+RANGE_OPERATORS = ('==', '<', '<=', '>', '>=')
+
+class HashIndex:
+    # Equality index: maps every hashable value of a field to the positions of the documents holding it, in ascending order.
+    # The field may be a path (see paths.py); a document is then listed under each distinct value the path reaches.
+    def __init__(self, field, data):
+        self.field = field
+        self.positions = {}
+        if is_path(field):
+            self._add_path_values(field, data)
+            return
+        for position, document in enumerate(data):
+            if field not in document:
+                continue
+            try:
+                bucket = self.positions.get(document[field])
+            except TypeError:
+                # Unhashable values (lists, dicts) can never equal a hashable query value, so they are simply left out
+                continue
+            if bucket is None:
+                self.positions[document[field]] = [position]
+            else:
+                bucket.append(position)
+
+    def _add_path_values(self, field, data):
+        accessor = compile_path(field)
+        for position, document in enumerate(data):
+            for value in accessor(document):
+                try:
+                    bucket = self.positions.get(value)
+                except TypeError:
+                    continue
+                if bucket is None:
+                    self.positions[value] = [position]
+                elif bucket[-1] != position:
+                    bucket.append(position)
+
+    def _document_values(self, document):
+        # The distinct hashable values a document is listed under
+        if is_path(self.field):
+            found = compile_path(self.field)(document)
+        else:
+            found = [document[self.field]] if self.field in document else []
+        distinct = []
+        for value in found:
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            if value not in distinct:
+                distinct.append(value)
+        return distinct
+
+    def add(self, position, document):
+        # Lists one document under its values, keeping every bucket in ascending position order
+        for value in self._document_values(document):
+            bucket = self.positions.get(value)
+            if bucket is None:
+                self.positions[value] = [position]
+            elif bucket[-1] < position:
+                bucket.append(position)
+            else:
+                insort(bucket, position)
+
+    def remove(self, position, document):
+        # Takes one document out of the buckets of its values
+        for value in self._document_values(document):
+            bucket = self.positions.get(value)
+            if bucket is None:
+                continue
+            i = bisect_left(bucket, position)
+            if i < len(bucket) and bucket[i] == position:
+                del bucket[i]
+                if not bucket:
+                    del self.positions[value]
+
+    def lookup(self, value):
+        # Returns the positions of the documents whose field == value, or None when the value cannot be looked up
+        try:
+            return self.positions.get(value, [])
+        except TypeError:
+            return None
+
+    def __len__(self):
+        return len(self.positions)
+
+def _value_kind(value):
+    # Groups values into the kinds a sorted index can order against each other
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    return None
+
+class SortedIndex:
+    # Range index: the (value, position) pairs of a field sorted by value, searched with bisect.
+    # It is only usable when every value of the field is of one kind (all numbers or all strings).
+    def __init__(self, field, data):
+        self.field = field
+        self.kind = None
+        pairs = []
+        kinds = set()
+        for position, document in enumerate(data):
+            if field in document:
+                value = document[field]
+                kinds.add(_value_kind(value))
+                pairs.append((value, position))
+
+        if len(kinds) == 1 and None not in kinds:
+            self.kind = kinds.pop()
+            pairs.sort()
+        else:
+            pairs = []
+        self.values = [value for value, _ in pairs]
+        self.row_positions = [position for _, position in pairs]
+
+    @property
+    def usable(self):
+        return self.kind is not None
+
+    def _bounds(self, operator, value):
+        # Returns the (start, end) slice of the sorted values matching `field operator value`, or None when this
+        # index cannot answer it, e.g. for a string compared to a number index where a scan would raise TypeError
+        if not self.usable or operator not in RANGE_OPERATORS or _value_kind(value) != self.kind:
+            return None
+        values = self.values
+        if operator == '==':
+            return bisect_left(values, value), bisect_right(values, value)
+        elif operator == '<':
+            return 0, bisect_left(values, value)
+        elif operator == '<=':
+            return 0, bisect_right(values, value)
+        elif operator == '>':
+            return bisect_right(values, value), len(values)
+        return bisect_left(values, value), len(values)
+
+    def range(self, operator, value):
+        # Returns the positions (in ascending order) of the documents matching `field operator value`, or None when
+        # this index cannot answer it
+        bounds = self._bounds(operator, value)
+        if bounds is None:
+            return None
+        selected = self.row_positions[bounds[0]:bounds[1]]
+        selected.sort()
+        return selected
+
+    def ordered_positions(self, descending=False):
+        # Yields the positions of the indexed documents in value order. Equal values keep ascending position order in
+        # both directions, so the order is the same as a stable sort of the documents.
+        values, positions = self.values, self.row_positions
+        if not descending:
+            yield from positions
+            return
+        end = len(values)
+        while end > 0:
+            start = bisect_left(values, values[end - 1], 0, end)
+            yield from positions[start:end]
+            end = start
+
+    def add(self, position, document):
+        # Adds one document, after its equal values so ties stay in ascending position order. Returns False when the
+        # value is of another kind than the index holds, after which the index can no longer be used.
+        if self.field not in document:
+            return True
+        value = document[self.field]
+        if _value_kind(value) != self.kind:
+            return False
+        start = bisect_left(self.values, value)
+        end = bisect_right(self.values, value, start)
+        i = bisect_left(self.row_positions, position, start, end)
+        self.values.insert(i, value)
+        self.row_positions.insert(i, position)
+        return True
+
+    def remove(self, position, document):
+        # Removes one document, found by its value and then its position among the equal values
+        if self.field not in document:
+            return
+        value = document[self.field]
+        if _value_kind(value) != self.kind:
+            return
+        start = bisect_left(self.values, value)
+        end = bisect_right(self.values, value, start)
+        i = bisect_left(self.row_positions, position, start, end)
+        if i < end and self.row_positions[i] == position:
+            del self.values[i]
+            del self.row_positions[i]
+
+    def count(self, operator, value):
+        # Returns how many documents match `field operator value` without collecting them, or None like range()
+        bounds = self._bounds(operator, value)
+        return None if bounds is None else bounds[1] - bounds[0]
+
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,193 @@
+# DSCI 551 Final Project - Darren Parry
+
+from collections.abc import Sequence
+
+from paths import is_path, compile_path
+
+# Join types and join algorithms supported by join()
+JOIN_TYPES = ('inner', 'left', 'anti')
+JOIN_METHODS = ('hash', 'merge', 'nested')
+
+def merge_documents(doc1, doc2, data2_key):
+    # Merges a matching pair of documents, renaming keys from the second document that collide with the first
+    merged_doc = doc1.copy()
+    for key, value in doc2.items():
+        if key == data2_key:
+            continue
+        if key in merged_doc:
+            merged_doc[f"{key}_2"] = value
+        else:
+            merged_doc[key] = value
+    return merged_doc
+
+def _emit(results, doc1, matches, data2_key, how):
+    # Adds the output rows for one document of the first dataset given its matches in the second dataset. Every row is
+    # a new dict (a merge or a copy of doc1), so changing a result never changes the loaded data.
+    if how == 'anti':
+        if not matches:
+            results.append(doc1.copy())
+    elif matches:
+        for doc2 in matches:
+            results.append(merge_documents(doc1, doc2, data2_key))
+    elif how == 'left':
+        results.append(doc1.copy())
+
+def nested_loop_join(data1, data1_key, data2, data2_key, how='inner'):
+    # Compares every document of the first dataset with every document of the second. Works for any key type.
+    results = []
+    keyed2 = [doc2 for doc2 in data2 if data2_key in doc2]
+    for doc1 in data1:
+        matches = []
+        if data1_key in doc1:
+            value = doc1[data1_key]
+            matches = [doc2 for doc2 in keyed2 if value == doc2[data2_key]]
+        _emit(results, doc1, matches, data2_key, how)
+    return results
+
+def hash_join(data1, data1_key, data2, data2_key, how='inner'):
+    # Builds a hash table on the second dataset's key and probes it once per document of the first. Keys must be hashable.
+    table = {}
+    for doc2 in data2:
+        if data2_key in doc2:
+            bucket = table.get(doc2[data2_key])
+            if bucket is None:
+                table[doc2[data2_key]] = [doc2]
+            else:
+                bucket.append(doc2)
+
+    results = []
+    for doc1 in data1:
+        matches = None
+        if data1_key in doc1:
+            try:
+                matches = table.get(doc1[data1_key])
+            except TypeError:
+                # An unhashable probe value cannot equal any hashable key in the table
+                matches = None
+        _emit(results, doc1, matches, data2_key, how)
+    return results
+
+def sort_merge_join(data1, data1_key, data2, data2_key, how='inner'):
+    # Walks both datasets in key order at the same time. Both must already be sorted on their key (see is_sorted_on).
+    keyed2 = [doc2 for doc2 in data2 if data2_key in doc2]
+    results = []
+    position = 0
+    for doc1 in data1:
+        matches = []
+        if data1_key in doc1:
+            value = doc1[data1_key]
+            while position < len(keyed2) and keyed2[position][data2_key] < value:
+                position += 1
+            # The run is not consumed because the next document of the first dataset may have the same key
+            end = position
+            while end < len(keyed2) and keyed2[end][data2_key] == value:
+                end += 1
+            matches = keyed2[position:end]
+        _emit(results, doc1, matches, data2_key, how)
+    return results
+
+def path_join(data1, data1_key, data2, data2_key, how='inner'):
+    # Hash join for keys given as paths (see paths.py), e.g. 'location.zip_code' or 'categories[].alias'. A path can
+    # hold several values, and two documents match when any value of one equals any value of the other; each matching
+    # pair is output once, in the order of the second dataset.
+    key1 = compile_path(data1_key) if is_path(data1_key) else lambda document: [document[data1_key]] if data1_key in document else []
+    key2 = compile_path(data2_key) if is_path(data2_key) else lambda document: [document[data2_key]] if data2_key in document else []
+    table = {}
+    unhashable = []
+    for position, doc2 in enumerate(data2):
+        for value in key2(doc2):
+            try:
+                bucket = table.get(value)
+            except TypeError:
+                unhashable.append((value, position))
+                continue
+            if bucket is None:
+                table[value] = [position]
+            elif bucket[-1] != position:
+                bucket.append(position)
+
+    results = []
+    for doc1 in data1:
+        found = set()
+        for value in key1(doc1):
+            try:
+                found.update(table.get(value, ()))
+            except TypeError:
+                found.update(position for other, position in unhashable if other == value)
+        _emit(results, doc1, [data2[position] for position in sorted(found)], data2_key, how)
+    return results
+
+def is_sorted_on(data, key):
+    # Returns True if the documents that have the key are in ascending key order
+    previous = None
+    first = True
+    try:
+        for document in data:
+            if key not in document:
+                continue
+            value = document[key]
+            if not first and value < previous:
+                return False
+            previous = value
+            first = False
+    except TypeError:
+        # Keys of types that cannot be ordered against each other
+        return False
+    return True
+
+def is_hashable_on(data, key):
+    # Returns True if every document's key value can be used in a hash table
+    try:
+        for document in data:
+            if key in document:
+                hash(document[key])
+    except TypeError:
+        return False
+    return True
+
+def _first_key(data, key):
+    # Returns the first value of the key in the data, or None when no document has it
+    for document in data:
+        if key in document:
+            return document[key]
+    return None
+
+def _keys_comparable(data1, data1_key, data2, data2_key):
+    # Sorted datasets have keys of one orderable type each, so comparing one key from each side shows whether the two types mix
+    try:
+        _first_key(data1, data1_key) < _first_key(data2, data2_key)
+    except TypeError:
+        return False
+    return True
+
+def choose_join_method(data1, data1_key, data2, data2_key):
+    # Picks sort-merge when both datasets are already sorted on their keys, hash when the keys are hashable, and nested loop otherwise
+    if is_sorted_on(data1, data1_key) and is_sorted_on(data2, data2_key) and _keys_comparable(data1, data1_key, data2, data2_key):
+        return 'merge'
+    if is_hashable_on(data2, data2_key):
+        return 'hash'
+    return 'nested'
+
+def join(data1, data1_key, data2, data2_key, how='inner', method=None):
+    # Joins two datasets on data1_key == data2_key. how is 'inner', 'left' (unmatched documents of the first dataset
+    # are kept) or 'anti' (only unmatched documents of the first dataset are kept). method picks the algorithm,
+    # or None to choose one from the data. Keys given as paths always use path_join.
+    if how not in JOIN_TYPES:
+        raise ValueError(f"Unknown join type: {how}")
+    # Choosing a method reads the inputs more than once, so streams are materialized first
+    if not isinstance(data1, Sequence):
+        data1 = list(data1)
+    if not isinstance(data2, Sequence):
+        data2 = list(data2)
+    if is_path(data1_key) or is_path(data2_key):
+        return path_join(data1, data1_key, data2, data2_key, how)
+    if method is None:
+        method = choose_join_method(data1, data1_key, data2, data2_key)
+
+    if method == 'hash':
+        return hash_join(data1, data1_key, data2, data2_key, how)
+    elif method == 'merge':
+        return sort_merge_join(data1, data1_key, data2, data2_key, how)
+    elif method == 'nested':
+        return nested_loop_join(data1, data1_key, data2, data2_key, how)
+    raise ValueError(f"Unknown join method: {method}")
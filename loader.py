@@ -0,0 +1,274 @@
+# DSCI 551 Final Project - Darren Parry
+
+import argparse
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from parser import SimpleJSONParser
+from snapshot import SnapshotCache
+from collection import Collection
+from profiling import profiled
+from oplog import open_log, replay, compact, log_path
+from textindex import load_text_index, INDEX_EXTENSION
+from records import compact_documents
+from sketches import load_team_sketches, SKETCH_EXTENSION
+
+@profiled('read_team_file', data_arg=None, result_rows=lambda result: len(result[1] or ()))
+def read_team_file(file_path):
+    # Streams a team file through our parser and returns (header, businesses). businesses is None when the file has no "businesses" array.
+    parser = SimpleJSONParser()
+    with open(file_path, 'r') as f:
+        businesses = list(parser.iterparse(f, 'businesses'))
+    return parser.header, (businesses if parser.path_found else None)
+
+@profiled('load_team_file', data_arg=None, result_rows=lambda result: len(result[1] or ()))
+def load_team_file(file_path, cache=None):
+    # Returns the (header, businesses) pair for a team file, loaded from the snapshot cache when the file is unchanged
+    if cache is None:
+        return read_team_file(file_path)
+    return cache.get_or_parse(file_path, read_team_file)
+
+def team_data(header, businesses, columnar=True, compact_records=False, indexed=True):
+    # The value the app works with: an indexed Collection of the businesses, or the whole document when there is no such list.
+    # With columnar, the numeric and price fields are also stored as columns for the aggregate and filter functions.
+    # With compact_records, the businesses are kept as compact records (see records.py), which take a fraction of the memory.
+    # Without indexed, the Collection has no indexes or columns, for a team that is queried once and then dropped.
+    if businesses is None:
+        return header
+    if compact_records:
+        businesses = compact_documents(businesses)
+    collection = Collection(businesses, header)
+    if indexed:
+        collection.build_indexes()
+        if columnar:
+            collection.build_columns()
+    return collection
+
+def list_team_files(directory):
+    # Returns the JSON file names in a data directory, in directory order
+    return [filename for filename in os.listdir(directory) if filename.endswith('.json')]
+
+def file_version(file_path):
+    # A version stamp of one team file and its operation log, which changes when the file is edited or written to
+    stamps = []
+    for path in (file_path, log_path(file_path)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stamps.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(stamps)
+
+def directory_version(directory):
+    # A version stamp of every team file in a directory and its operation log, which changes when any file is edited,
+    # added, removed or written to
+    stamps = ()
+    for filename in list_team_files(directory):
+        stamps += file_version(os.path.join(directory, filename))
+    return stamps
+
+@profiled('load_team_data', data_arg=None, result_rows=lambda result: len(result[0] or ()))
+def load_team_data(file_path, cache=None, compact_records=False, indexed=True):
+    # Loads the data for one team file and returns (data, error), with the writes in its operation log applied (see
+    # oplog.py). A team's text index is loaded with it, from disk when the file is unchanged (see textindex.py).
+    # Without indexed only the businesses are loaded, with no indexes, columns, text index or sketches, which is
+    # cheaper for a team that is only scanned once (see fanout.py).
+    # Errors are returned as the same messages the app shows instead of being raised, so this can run in a worker
+    # process.
+    try:
+        log = open_log(file_path, cache)
+        records = log.read()
+        stat = os.stat(file_path)
+        data = team_data(*load_team_file(file_path, cache), compact_records=compact_records, indexed=indexed)
+        if isinstance(data, Collection) and not indexed:
+            replay(data, records, log)
+        elif isinstance(data, Collection):
+            # Indexed as the file has it; replaying the log then updates the index like any other write
+            data.build_text_index(load_text_index(file_path, data, cache, stat))
+            replay(data, records, log)
+            # Sketches for approximate aggregates (see sketches.py), stored for the file as it is when it has no writes
+            data.build_sketches(load_team_sketches(file_path, data, cache, stat) if not records else None)
+        return data, None
+    except FileNotFoundError:
+        return None, f"ERROR: File not found at {file_path}"
+    except Exception as e:
+        return None, f"ERROR: Could not parse {file_path}. Reason: {e}"
+
+@profiled('load_directory', data_arg=None)
+def load_directory(directory, workers=None, cache=None, min_parallel_files=4, on_error=None, compact_records=False):
+    # Loads every team file in a directory and returns a dictionary mapping filenames to their data, in directory order.
+    # The files are spread across `workers` processes (default: one per CPU). With one worker, or fewer than
+    # min_parallel_files files, they are loaded serially because starting the pool would cost more than it saves.
+    # A file that fails maps to None and its error message is passed to on_error.
+    filenames = list_team_files(directory)
+    file_paths = [os.path.join(directory, filename) for filename in filenames]
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(file_paths))
+
+    if workers <= 1 or len(file_paths) < min_parallel_files:
+        results = [load_team_data(file_path, cache, compact_records) for file_path in file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(load_team_data, file_paths, [cache] * len(file_paths), [compact_records] * len(file_paths)))
+
+    all_data = {}
+    for filename, (data, error) in zip(filenames, results):
+        if error is not None and on_error is not None:
+            on_error(error)
+        all_data[filename] = data
+    return all_data
+
+class LazyTeamData(Mapping):
+    # A read-only mapping from filename to team data that parses a team only the first time it is accessed.
+    # At most max_teams parsed teams are kept in memory; the least recently used one is evicted to make room.
+    # on_evict, when given, is called with the filename of every team dropped from memory, so anything else holding on
+    # to that team (e.g. lazy query results, see querycache.py) can let it go too.
+    def __init__(self, directory, max_teams=8, cache=None, on_error=None, compact_records=False, on_evict=None):
+        if max_teams < 1:
+            raise ValueError("max_teams must be at least 1")
+        self.directory = directory
+        self.max_teams = max_teams
+        self.cache = cache
+        self.on_error = on_error
+        self.compact_records = compact_records
+        self.on_evict = on_evict
+        self.filenames = list_team_files(directory)
+        self._known = set(self.filenames)
+        self._loaded = OrderedDict()
+        # Streamlit serves every session from one shared instance, so loads and evictions are serialized
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, filename):
+        if filename not in self._known:
+            raise KeyError(filename)
+        evicted = None
+        with self._lock:
+            if filename in self._loaded:
+                self.hits += 1
+                self._loaded.move_to_end(filename)
+                return self._loaded[filename]
+
+            self.misses += 1
+            data, error = load_team_data(os.path.join(self.directory, filename), self.cache, self.compact_records)
+            if error is not None and self.on_error is not None:
+                self.on_error(error)
+
+            self._loaded[filename] = data
+            if len(self._loaded) > self.max_teams:
+                evicted, _ = self._loaded.popitem(last=False)
+                self.evictions += 1
+        if evicted is not None and self.on_evict is not None:
+            self.on_evict(evicted)
+        return data
+
+    def __iter__(self):
+        return iter(self.filenames)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __contains__(self, filename):
+        return filename in self._known
+
+    def invalidate(self, filename):
+        # Forgets a parsed team, e.g. after another process wrote to its file, so the next access loads it again
+        with self._lock:
+            dropped = filename in self._loaded
+            self._loaded.pop(filename, None)
+        if dropped and self.on_evict is not None:
+            self.on_evict(filename)
+
+    def loaded_teams(self):
+        # Returns the filenames currently held in memory, least recently used first
+        return list(self._loaded)
+
+    def stats(self):
+        # Returns the hit, miss and eviction counters along with how many teams are in memory
+        return {
+            'loaded': len(self._loaded),
+            'max_teams': self.max_teams,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+def warm_cache(directory, cache):
+    # Parses every team file that has no fresh snapshot and stores it, so the next app start only has to load snapshots
+    for filename in list_team_files(directory):
+        file_path = os.path.join(directory, filename)
+        start = time.perf_counter()
+        if cache.load(file_path) is None:
+            cache.store(file_path, read_team_file(file_path))
+            status = 'parsed'
+        else:
+            status = 'fresh'
+        print(f"{filename:<45}{status:>8}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+
+def clear_cache(directory, cache):
+    # Deletes the snapshots, stored text indexes and stored sketches of every team file in a data directory
+    index_cache = SnapshotCache(cache.cache_dir, INDEX_EXTENSION)
+    sketch_cache = SnapshotCache(cache.cache_dir, SKETCH_EXTENSION)
+    for filename in list_team_files(directory):
+        cache.invalidate(os.path.join(directory, filename))
+        index_cache.invalidate(os.path.join(directory, filename))
+        sketch_cache.invalidate(os.path.join(directory, filename))
+
+def compact_directory(directory, cache):
+    # Folds the operation log of every team file that has one into the file and its snapshot
+    for filename in list_team_files(directory):
+        file_path = os.path.join(directory, filename)
+        if not os.path.exists(log_path(file_path)):
+            continue
+        start = time.perf_counter()
+        data, error = load_team_data(file_path, cache)
+        if error is not None:
+            print(error)
+            continue
+        records = compact(data)
+        print(f"{filename:<45}{records:>8} ops{(time.perf_counter() - start) * 1000:>10.1f} ms")
+
+def measure_memory(directory, cache):
+    # Loads every team file as dicts and then as compact records and prints the memory each takes
+    sizes = []
+    for compact_records in (False, True):
+        tracemalloc.start()
+        start = time.perf_counter()
+        all_data = load_directory(directory, workers=1, cache=cache, compact_records=compact_records)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        businesses = sum(len(data) for data in all_data.values() if isinstance(data, Collection))
+        label = 'compact records' if compact_records else 'dicts'
+        print(f"{label:<20}{businesses:>8} businesses{size / (1024 * 1024):>10.1f} MB{(time.perf_counter() - start) * 1000:>10.1f} ms")
+        sizes.append(size)
+        del all_data
+    print(f"Compact records take {sizes[0] / sizes[1]:.1f}x less memory")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Loading tools for the MLB restaurant data")
+    arg_parser.add_argument('--data', default='data', help="Directory containing the team JSON files")
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('warm', help="Parse the team files and store their snapshots")
+    subparsers.add_parser('clear', help="Delete the stored snapshots")
+    subparsers.add_parser('compact', help="Fold the operation logs of written teams into their files")
+    subparsers.add_parser('memory', help="Show the memory the teams take as dicts and as compact records")
+
+    args = arg_parser.parse_args()
+    cache = SnapshotCache()
+    if args.command == 'warm':
+        warm_cache(args.data, cache)
+    elif args.command == 'clear':
+        clear_cache(args.data, cache)
+    elif args.command == 'compact':
+        compact_directory(args.data, cache)
+    elif args.command == 'memory':
+        measure_memory(args.data, cache)
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,76 @@
 # DSCI 551 Final Project - Darren Parry
 
 import os
+from collections.abc import Mapping, Sequence
 import streamlit as st
+from loader import load_team_data, load_directory, directory_version, LazyTeamData
+from snapshot import SnapshotCache
+from geo import GeoIndex, MAX_DISTANCE_METERS
+from textindex import LeagueTextIndex
+from functions import join, insert, update, delete, text_search, approximate_aggregate, approximate_distinct, approximate_quantiles, distinct_count, quantiles
+from query import Query
+from paths import available_paths
+from cursor import ResultCursor, table_rows, DEFAULT_PAGE_SIZE
+from querycache import QueryCache, data_version
+from fanout import run_all_teams
+from client import QueryClient, QueryServerError
 from parser import SimpleJSONParser
-from functions import (filter, projection, group_by, join, aggregate_max, aggregate_sum, aggregate_avg, aggregate_count, aggregate_min)
+from collection import Collection, find_business
+from oplog import compact
+from recordstore import open_store
+from records import plain
+from sketches import QUANTILE_ACCURACY
+import profiling
+
+# Parsed team files are kept on disk between app restarts and only re-parsed when the JSON file changes
+snapshot_cache = SnapshotCache()
+# Number of processes used to load the team files, None uses one per CPU
+load_workers = None
+# Teams are parsed the first time a page uses them and at most this many stay in memory. Set lazy_loading to False to load every team at startup.
+lazy_loading = True
+max_loaded_teams = 8
+# Set record_store to True to serve the teams from one memory-mapped file instead (see recordstore.py): it opens almost
+# instantly and decodes businesses only as they are read, but queries scan without indexes and teams cannot be edited.
+record_store = False
+# Set compact_records to True to keep the loaded teams as compact records (see records.py): the businesses take about a
+# third of the memory, at the cost of a slower first load of each team
+compact_records = False
+# Rows shown per page of results
+results_page_size = DEFAULT_PAGE_SIZE
+# Query results kept for repeated runs, shared by every session
+max_cached_queries = 64
+max_cached_megabytes = 64
+# Confidence level of the intervals shown with approximate answers
+approximate_confidence = 0.95
+# Percentiles shown for a field on the Group By & Aggregate page
+percentile_fractions = (0.25, 0.5, 0.75, 0.9, 0.99)
+# Page runs kept for the Performance panel's JSON lines export
+performance_history_size = 20
+# Processes used by "All teams" queries, None uses one per CPU
+fanout_workers = None
+# Set the MLB_QUERY_SERVER environment variable to the address of a running query server (see server.py), e.g.
+# MLB_QUERY_SERVER=http://127.0.0.1:8551 streamlit run main.py, to send the query pages' queries there instead of
+# running them in the app. The teams are then loaded once in the server for every user, and the app loads none itself,
+# so the pages that need the businesses in the app (Join, Nearby Search, Text Search and Edit Data) are not offered.
+query_server_url = os.environ.get("MLB_QUERY_SERVER")
 
 @st.cache_data
 def load_data(file_path):
     # Reads a file from disk, parses it with parser.py and returns the list of businesses in a format that we can use functions.py
-    try:
-        with open(file_path, 'r') as f:
-            json_string = f.read()
-        
-        # Our custom parser
-        parser = SimpleJSONParser()
-        data = parser.parse(json_string)
-        
-        # The list of restaurants is inside the "businesses" key
-        if 'businesses' in data:
-            return data['businesses']
-        else:
-            return data
-            
-    except FileNotFoundError:
-        st.error(f"ERROR: File not found at {file_path}")
-        return None
-    except Exception as e:
-        st.error(f"ERROR: Could not parse {file_path}. Reason: {e}")
-        return None
+    # Our custom parser streams the file in chunks, unless the snapshot cache already has a fresh copy
+    data, error = load_team_data(file_path, snapshot_cache, compact_records)
+    if error is not None:
+        st.error(error)
+    return data
 
-@st.cache_data
+@st.cache_resource
 def load_all_data(directory):
     # Loads and parses all JSON files in a given directory and returns a dictionary mapping filenames to parsed data.
+    # The teams are shared by every session instead of copied for each run, so the Edit Data page writes to them in place.
     all_data = {}
     try:
-        for filename in os.listdir(directory):
-            if filename.endswith('.json'):
-                file_path = os.path.join(directory, filename)
-                data = load_data(file_path)
-                all_data[filename] = data
+        # The files are parsed in parallel worker processes, and any per-file errors are reported here
+        all_data = load_directory(directory, workers=load_workers, cache=snapshot_cache, on_error=st.error, compact_records=compact_records)
     except FileNotFoundError:
         st.error(f"ERROR: Directory not found at {directory}")
         return {}
@@ -46,12 +78,73 @@ def load_all_data(directory):
         st.error(f"ERROR: Could not load data from {directory}. Reason: {e}")
     return all_data
 
+@st.cache_resource
+def load_lazy_data(directory):
+    # Returns a mapping that loads each team on first access. It is shared by every session, so parsed teams are reused.
+    # Cached results of a team are dropped with it, since some of them still read the team as their pages are shown.
+    try:
+        return LazyTeamData(directory, max_loaded_teams, snapshot_cache, on_error=st.error, compact_records=compact_records, on_evict=load_query_cache().drop_team)
+    except FileNotFoundError:
+        st.error(f"ERROR: Directory not found at {directory}")
+        return {}
+
+@st.cache_resource
+def load_record_store(directory):
+    # Opens the record store of the data directory, building it first when the team files changed since it was built
+    try:
+        return open_store(directory, snapshot_cache, on_error=st.error)
+    except FileNotFoundError:
+        st.error(f"ERROR: Directory not found at {directory}")
+        return {}
+
+def load_teams(directory):
+    # The team data every page reads, from whichever loader the settings above pick
+    if record_store:
+        return load_record_store(directory)
+    return load_lazy_data(directory) if lazy_loading else load_all_data(directory)
+
+@st.cache_resource
+def load_query_cache():
+    # One result cache for every session, so a query anyone already ran comes back immediately
+    return QueryCache(max_cached_queries, max_cached_megabytes * 1024 * 1024)
+
+@st.cache_resource
+def load_query_client(url):
+    return QueryClient(url)
+
+@st.cache_resource
+def load_geo_index(directory):
+    # Builds the spatial index over every team's businesses once. It only keeps coordinates with (team, position, id),
+    # so lazily loaded teams can still be evicted and the documents are looked up again when results are shown.
+    team_data = load_teams(directory)
+    geo_index = GeoIndex()
+    for team_key in team_data:
+        data = team_data[team_key]
+        if isinstance(data, Sequence):
+            geo_index.add_team(team_key, data, getattr(data, 'header', None))
+    return geo_index
+
+@st.cache_resource
+def load_text_search(directory):
+    # Collects every team's text index once for searches across all teams. Like the spatial index it keeps
+    # (team, position, id) instead of documents, so lazily loaded teams can still be evicted.
+    team_data = load_teams(directory)
+    league_index = LeagueTextIndex()
+    for team_key in team_data:
+        data = team_data[team_key]
+        if isinstance(data, Sequence):
+            league_index.add_team(team_key, data)
+    return league_index
+
 # Start of front-end code for streamlit
 st.title("⚾ MLB Restaurant Finder 🌭🍔🍕🌮")
 st.write("This web app uses a custom-built JSON parser and NoSQL-like functions to project certain outputs. The MLB restaurant dataset has the following fields that you can sort through: 'id', 'alias', 'name', 'image_url', 'is_closed', 'url', 'review_count', 'categories', 'rating', 'coordinates', 'transactions', 'price', 'location', 'phone', 'display_phone', 'distance'")
 
 data_folder = "data"
-all_team_data = load_all_data(data_folder)
+query_client = load_query_client(query_server_url) if query_server_url else None
+# With a query server the teams are only loaded there
+all_team_data = load_teams(data_folder) if query_client is None else {}
+query_cache = load_query_cache()
 
 # Operation pages
 st.sidebar.title("Select Function")
@@ -65,356 +158,806 @@ def clean_team_name(team_keys):
         .replace('.json', '') \
         .strip()  
 
-team_keys = list(all_team_data.keys()) 
+# Helper function that shows the optimized plan of a query under its results
+def show_plan(plan, data, team_key=None):
+    with st.expander("Query plan"):
+        if query_client is not None:
+            st.caption(f"Runs on the query server at {query_client.url}.")
+            data = None
+        elif team_key == ALL_TEAMS:
+            st.caption("Runs on every team in parallel worker processes, and the teams' partial results are merged.")
+            data = None
+        st.code(plan.explain(data))
+
+# Optional sorting shared by the Filter and Query pages; only the top k rows are produced when k is set
+def sort_inputs(page, label="Sort by (comma-separated, e.g., rating, review_count)"):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort_text = st.text_input(label, "", key=f"{page}_sort_fields")
+    with col2:
+        descending = st.checkbox("Descending", value=True, key=f"{page}_sort_descending")
+    with col3:
+        k = st.number_input("Show top k (0 = all)", min_value=0, value=0, step=1, key=f"{page}_top_k")
+    sort_fields = [field.strip() for field in sort_text.split(",") if field.strip()]
+    return sort_fields, descending, int(k)
+
+def add_sort(plan, sort_fields, descending, k):
+    if sort_fields:
+        return plan.order_by(sort_fields, descending, k or None)
+    if k:
+        return plan.top_k([], k)
+    return plan
+
+# Results are kept per page in session_state with the inputs that made them, so switching result pages shows the
+# same cursor again instead of re-running the query
+def remember_results(page, result_key, cursor):
+    st.session_state[f"{page}_results"] = (result_key, cursor)
+    st.session_state[f"{page}_page"] = 1
+
+def remembered_results(page, result_key):
+    # Returns the cursor from the page's last run when its inputs are unchanged, otherwise None
+    stored = st.session_state.get(f"{page}_results")
+    if stored is None or stored[0] != result_key:
+        return None
+    return stored[1]
+
+def show_page(page, cursor):
+    # Shows one page of results as a flat table; only the rows of that page are produced and sent to the browser
+    pages = cursor.page_count(results_page_size)
+    number = 1
+    if pages > 1:
+        number = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"{page}_page")
+    try:
+        rows = cursor.page(number - 1, results_page_size)
+    except QueryServerError as e:
+        # A later page from the query server failed, e.g. because the team was written to since the first page.
+        # The result is forgotten so the next run asks for it again.
+        st.error(str(e))
+        st.session_state.pop(f"{page}_results", None)
+        return
+    with profiling.timed("render page", len(rows)):
+        st.dataframe(table_rows(rows), hide_index=True)
+        if rows:
+            first = (number - 1) * results_page_size + 1
+            st.caption(f"Rows {first}-{first + len(rows) - 1} of {cursor.total()}")
+    # The cursor may have produced more rows for this page, which the cache counts against its memory limit
+    query_cache.trim()
+
+def run_counted(plan, data):
+    # Runs a plan with counters and keeps them with the rows, for pages that report how many records the filter kept
+    counters = {}
+    rows = plan.execute(data, counters)
+    return ResultCursor(rows, notes=counters)
+
+def show_performance(profile):
+    # The Performance panel: every instrumented call of this page run with its time, rows and peak memory, and an
+    # export of the last runs as JSON lines
+    history = st.session_state.setdefault("performance_history", [])
+    if profile.records:
+        history.append(profile)
+        del history[:-performance_history_size]
+    with st.expander("Performance", expanded=True):
+        if profile.memory_busy:
+            st.caption("Peak memory was not tracked on this run: another session is tracking it.")
+        if not profile.records:
+            st.caption("Nothing was computed on this run; shown results came from the query cache or an earlier run.")
+        else:
+            st.dataframe([{
+                'operator': '    ' * record['depth'] + record['operator'],
+                'ms': round(record['seconds'] * 1000, 3),
+                'rows in': record['rows_in'],
+                'rows out': record['rows_out'],
+                'peak KB': None if record['peak_bytes'] is None else round(record['peak_bytes'] / 1024, 1),
+            } for record in profile.records], hide_index=True)
+            total = sum(record['seconds'] for record in profile.records if record['depth'] == 0)
+            st.caption(f"{len(profile.records)} calls, {total * 1000:.1f} ms in total. Indented calls are part of the call above them.")
+        if history:
+            st.download_button("Export JSON lines", ''.join(run.to_jsonl() for run in history), file_name="performance.jsonl", mime="application/jsonl")
+
+# The Filter and Query pages can also run on every team at once (see fanout.py)
+ALL_TEAMS = "All teams"
+
+def team_label(team_key):
+    return team_key if team_key == ALL_TEAMS else clean_team_name(team_key)
+
+def team_sample(team_key):
+    # The data used to list fields and check the page has something to query; the first team stands in for all teams.
+    # With a query server only the team's first business is fetched from it.
+    team_key = team_keys[0] if team_key == ALL_TEAMS else team_key
+    if query_client is not None:
+        try:
+            return query_client.query(team_key, Query().top_k([], 1))['rows']
+        except QueryServerError as e:
+            st.error(str(e))
+            return []
+    return all_team_data[team_key]
+
+def all_teams_mode(team_key):
+    # Asks whether an all-teams query answers for the league as a whole or lists each team's own results
+    if team_key != ALL_TEAMS:
+        return False
+    mode = st.sidebar.radio("Combine teams", ("League-wide", "Per team"), help="League-wide: the teams are queried as one dataset. Per team: every team's own results, tagged with its team.")
+    return mode == "Per team"
+
+def run_all(plan, by_team):
+    # Runs a plan on every team file; teams already in memory are reused when the query runs in this process
+    counters = {}
+    if isinstance(all_team_data, LazyTeamData):
+        loaded = {team_key: all_team_data[team_key] for team_key in all_team_data.loaded_teams()}
+    else:
+        loaded = all_team_data
+    rows = run_all_teams(plan, data_folder, by_team, workers=fanout_workers, cache=snapshot_cache, loaded=loaded, counters=counters, on_error=st.error)
+    return ResultCursor(rows, notes=counters)
+
+def answer_mode(team_key):
+    # Asks whether a group/aggregate page reads every business or estimates from the team's sample and sketches (see
+    # sketches.py). Estimates need the team in this app, so there is no choice for all teams or with a query server.
+    if query_client is not None or team_key == ALL_TEAMS:
+        return False
+    mode = st.sidebar.radio("Answers", ("Exact", "Approximate"), help="Exact reads every business. Approximate estimates from a sample and sketches of the team made when it was loaded, with confidence intervals, and answers at once however large the team is.")
+    return mode == "Approximate"
+
+def approximate_results(data, keys, specs, filters=(), sort_fields=(), descending=True, k=0):
+    # Estimates a group/aggregate from the team's sample and sorts the estimated groups like add_sort would
+    counters = {}
+    rows = approximate_aggregate(data, keys, specs, approximate_confidence, filters, counters)
+    rows = add_sort(Query(), sort_fields, descending, k).execute(rows)
+    return ResultCursor(rows, notes=counters)
+
+def show_estimate_note(cursor):
+    # Explains the estimates shown under approximate results
+    notes = cursor.notes
+    st.caption(f"Estimated from a sample of {notes['sample']} of {notes['population']} businesses. Each '_margin' column is the ± half-width of a {approximate_confidence:.0%} confidence interval; groups with only a few sampled businesses get wide or unreliable ones, min and max are the sample's, and groups no sampled business falls in are missing.")
+
+def query_results(team_key, data, plan, by_team=False, counted=False):
+    # Returns the cursor of a plan through the query cache. All-teams results are cached until any team file changes.
+    # With a query server the plan runs there, and its rows are fetched a page at a time as they are shown.
+    if query_client is not None:
+        return query_client.cursor(team_key, plan, by_team, results_page_size)
+    if team_key == ALL_TEAMS:
+        return query_cache.get_or_run(ALL_TEAMS, directory_version(data_folder), ('all teams', by_team, plan.normalized_key()), lambda: run_all(plan, by_team))
+    if counted:
+        return query_cache.get_or_run(team_key, data_version(data), ('counted', plan.normalized_key()), lambda: run_counted(plan, data))
+    return query_cache.cursor(team_key, data, plan)
+
+def parse_object(text):
+    # Parses a JSON object typed on the Edit Data page with our parser
+    value = SimpleJSONParser().parse(text)
+    if not isinstance(value, dict):
+        raise ValueError("Expected a JSON object")
+    return value
+
+if query_client is not None:
+    try:
+        team_keys = query_client.teams()
+    except QueryServerError as e:
+        st.error(str(e))
+        team_keys = []
+else:
+    team_keys = list(all_team_data.keys())
 
 # Decides which function we want to run showing up as an option on the side of the screen
 if not team_keys:
     st.error("No data files found in the data directory.")
 else: 
-    operation = st.sidebar.radio(
-        "Choose a function:",
-        ("Filter", "Projection", "Group By & Aggregate", "Join", "Query with Filter, Projection", "Query with Filter, Group, Aggregate", "Query with Filter, Group, Aggregate, Project")
-    )
-
-    if operation == "Filter":
-        # Chooses which team you want to run the functions on
-        st.sidebar.title("Select Team")
-        selected_team_key = st.sidebar.selectbox(
-        "Choose a team:",
-        team_keys,
-        format_func=clean_team_name
-        )
-        data_to_use = all_team_data[selected_team_key]
-
-        st.header(f"Filter data for: {clean_team_name(selected_team_key)}")
-
-        field = st.text_input("Field to filter on (e.g., rating, name, price, location)", "rating")
-        op = st.selectbox("Operator", (">=", ">", "==", "<", "<="))
-        value = st.text_input("Value to compare (e.g., 4.0)", "4.0")
-        try:
-            value = float(value)
-        except ValueError:
-            pass 
-
-        # Runs our filter function
-        if st.button("Run Filter"):
-            results = filter(data_to_use, field, op, value)
-            st.success(f"Found {len(results)} results.")
-            st.write(results)
-
-    elif operation == "Projection":
-        # Chooses which team you want to run the functions on
-        st.sidebar.title("Select Team")
-        selected_team_key = st.sidebar.selectbox(
-            "Choose a team:", 
-            team_keys,
-            format_func=clean_team_name
-        )
-        data_to_use = all_team_data[selected_team_key]
+    operations = ("Filter", "Projection", "Group By & Aggregate", "Join", "Query with Filter, Projection", "Query with Filter, Group, Aggregate", "Query with Filter, Group, Aggregate, Project", "Nearby Search", "Text Search", "Edit Data")
+    if query_client is not None:
+        # These pages read the businesses in the app, which has none loaded with a query server
+        operations = tuple(page for page in operations if page not in ("Join", "Nearby Search", "Text Search", "Edit Data"))
+    operation = st.sidebar.radio("Choose a function:", operations)
+
+    # Records the time, rows and memory of the parser, loaders and operators while this page runs (see profiling.py)
+    # Each run of a session may be on a new thread, so its Profiles are kept under a key stored in the session
+    profile_owner = st.session_state.setdefault("profile_owner", object())
+    profiling.clear(profile_owner)
+    performance_panel = st.sidebar.checkbox("Performance panel", help="Shows how long each operator took on this page")
+    track_memory = performance_panel and st.sidebar.checkbox("Track peak memory (slower)")
+    page_profile = profiling.start(operation, track_memory, profile_owner) if performance_panel else None
+
+    # Stopped however the page run ends (an error, st.stop or a rerun), so memory tracking never stays on
+    try:
+        if operation == "Filter":
+            # Chooses which team you want to run the functions on
+            st.sidebar.title("Select Team")
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys + [ALL_TEAMS],
+            format_func=team_label
+            )
+            data_to_use = team_sample(selected_team_key)
+            by_team = all_teams_mode(selected_team_key)
+
+            st.header(f"Filter data for: {team_label(selected_team_key)}")
+
+            # Extra conditions are combined with AND or OR into one compound condition (see predicates.py)
+            condition_count = st.number_input("Number of conditions", min_value=1, max_value=5, value=1)
+            combine_with = st.radio("Combine conditions with", ("AND", "OR"), horizontal=True)
+
+            conditions = []
+            for i in range(int(condition_count)):
+                suffix = "" if i == 0 else f" {i + 1}"
+                field = st.text_input(f"Field to filter on{suffix} (e.g., rating, name, price, location.city, categories[].alias)", "rating", key=f"filter_field_{i}")
+                op = st.selectbox(f"Operator{suffix}", (">=", ">", "==", "<", "<=", "!=", "in", "contains", "exists"), key=f"filter_op_{i}")
+                value = st.text_input(f"Value to compare{suffix} (e.g., 4.0; comma-separated for in; true/false for exists)", "4.0", key=f"filter_value_{i}")
+                if op == "exists":
+                    value = value.strip().lower() not in ("false", "no", "0")
+                elif op == "in":
+                    members = []
+                    for member in value.split(","):
+                        member = member.strip()
+                        try:
+                            members.append(float(member))
+                        except ValueError:
+                            members.append(member)
+                    value = members
+                else:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                conditions.append((field, op, value))
+
+            sort_fields, descending, k = sort_inputs("filter")
+
+            if len(conditions) == 1:
+                plan = Query().filter(*conditions[0])
+            else:
+                plan = Query().where((combine_with.lower(),) + tuple(conditions))
+            plan = add_sort(plan, sort_fields, descending, k)
+            result_key = (selected_team_key, by_team, plan.key())
+
+            # Runs our filter function
+            if st.button("Run Filter"):
+                try:
+                    remember_results("filter", result_key, query_results(selected_team_key, data_to_use, plan, by_team))
+                except QueryServerError as e:
+                    st.error(str(e))
+            cursor = remembered_results("filter", result_key)
+            if cursor is not None:
+                st.success(f"Found {cursor.total()} results.")
+                show_page("filter", cursor)
+                show_plan(plan, data_to_use, selected_team_key)
+
+        elif operation == "Projection":
+            # Chooses which team you want to run the functions on
+            st.sidebar.title("Select Team")
+            selected_team_key = st.sidebar.selectbox(
+                "Choose a team:", 
+                team_keys,
+                format_func=clean_team_name
+            )
+            data_to_use = team_sample(selected_team_key)
         
-        st.header(f"Project data for: {clean_team_name(selected_team_key)}")
+            st.header(f"Project data for: {clean_team_name(selected_team_key)}")
 
-        # Gets the list of all of the keys and puts them in a dropdown menu
-        if data_to_use:
-            sample_record = data_to_use[0]
-            all_available_fields = list(sample_record.keys())
-            default_cols = [col for col in ["name", "rating", "price"] if col in all_available_fields]
+            # Gets the list of all of the keys and puts them in a dropdown menu
+            if data_to_use:
+                sample_record = data_to_use[0]
+                all_available_fields = available_paths(sample_record)
+                default_cols = [col for col in ["name", "rating", "price"] if col in all_available_fields]
             
-            fields_list = st.multiselect(
-                "Choose fields to display:", 
-                options=all_available_fields,
-                default=default_cols
-            )
+                fields_list = st.multiselect(
+                    "Choose fields to display:", 
+                    options=all_available_fields,
+                    default=default_cols
+                )
+
+                plan = Query().project(fields_list)
+                result_key = (selected_team_key, plan.key())
+
+                # Runs our projection function
+                if st.button("Run Projection"):
+                    if not fields_list:
+                        st.error("Please select at least one field.")
+                    else:
+                        try:
+                            remember_results("projection", result_key, query_results(selected_team_key, data_to_use, plan))
+                        except QueryServerError as e:
+                            st.error(str(e))
+                cursor = remembered_results("projection", result_key)
+                if cursor is not None and fields_list:
+                    st.success(f"Showing {cursor.total()} records.")
+                    show_page("projection", cursor)
+                    show_plan(plan, data_to_use)
+            else:
+                st.warning("This dataset appears to be empty.")
 
-            # Runs our projection function
-            if st.button("Run Projection"):
-                if not fields_list:
-                    st.error("Please select at least one field.")
-                else:
-                    results = projection(data_to_use, fields_list)
-                    st.success(f"Showing {len(results)} records.")
-                    st.write(results) 
-        else:
-            st.warning("This dataset appears to be empty.")
-
-    elif operation == "Group By & Aggregate":
-        # Chooses which team you want to run the functions on
-        st.sidebar.title("Select Team")
-        selected_team_key = st.sidebar.selectbox(
-        "Choose a team:",
-        team_keys,
-        format_func=clean_team_name
-        )
-        data_to_use = all_team_data[selected_team_key]
+        elif operation == "Group By & Aggregate":
+            # Chooses which team you want to run the functions on
+            st.sidebar.title("Select Team")
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys,
+            format_func=clean_team_name
+            )
+            data_to_use = team_sample(selected_team_key)
+            approximate = answer_mode(selected_team_key)
         
-        st.header(f"Group/Aggregate data for: {clean_team_name(selected_team_key)}")
+            st.header(f"Group/Aggregate data for: {clean_team_name(selected_team_key)}")
         
-        group_field = st.text_input("Field to group by (e.g., price, id, rating)", "price")
-        agg_field = st.text_input("Field to aggregate (e.g., rating, review_count, transactions)", "rating")
-        agg_func = st.selectbox("Function", ("max", "avg", "count", "sum", "min"))
+            group_field = st.text_input("Field to group by (e.g., price, rating, location.city, categories[].alias)", "price")
+            agg_field = st.text_input("Field to aggregate (e.g., rating, review_count, transactions)", "rating")
+            agg_func = st.selectbox("Function", ("max", "avg", "count", "sum", "min"))
         
-        # Runs our group by & aggreagtion function
-        if st.button("Run Aggregation"):
-            grouped_data = group_by(data_to_use, group_field)
-            results = []
-            for group_name, documents in grouped_data.items():
-                if agg_func == 'max':
-                    agg_value = aggregate_max(documents, agg_field)
-                elif agg_func == 'avg':
-                    agg_value = aggregate_avg(documents, agg_field)
-                elif agg_func == 'count':
-                    agg_value = aggregate_count(documents)
-                elif agg_func == 'sum':
-                    agg_value = aggregate_sum(documents, agg_field)
-                elif agg_func == 'min':
-                    agg_value = aggregate_min(documents, agg_field)
-                else:
-                    agg_value = "Function not implemented"
-                
-                results.append({
-                    group_field: group_name,
-                    f"{agg_func}_{agg_field}": agg_value
-                })
-            
-            st.write(results)
+            plan = Query().group_aggregate(group_field, [(agg_func, agg_field)])
+            result_key = (selected_team_key, approximate, plan.key())
 
-    elif operation == "Join":
-        st.header("Join Data")
-        st.write("Find matching restaurants between two teams.")
+            # Runs our group by & aggreagtion function in a single pass over the data, or estimates it from the team's sample
+            if st.button("Run Aggregation"):
+                try:
+                    if approximate:
+                        remember_results("group", result_key, approximate_results(data_to_use, group_field, [(agg_func, agg_field)]))
+                    else:
+                        remember_results("group", result_key, query_results(selected_team_key, data_to_use, plan))
+                except QueryServerError as e:
+                    st.error(str(e))
+            cursor = remembered_results("group", result_key)
+            if cursor is not None:
+                show_page("group", cursor)
+                if approximate:
+                    show_estimate_note(cursor)
+                else:
+                    show_plan(plan, data_to_use)
+
+            # Distinct values and percentiles of one field, counted exactly or read from the team's sketches
+            if query_client is None:
+                st.subheader("Distinct values and percentiles")
+                stats_field = st.text_input("Field (e.g., categories[].alias, location.zip_code, rating, review_count)", "rating")
+                stats_key = (selected_team_key, approximate, stats_field)
+                if st.button("Describe Field"):
+                    if approximate:
+                        distinct, distinct_error = approximate_distinct(data_to_use, stats_field)
+                        percentiles = approximate_quantiles(data_to_use, stats_field, percentile_fractions)
+                    else:
+                        distinct, distinct_error = distinct_count(data_to_use, stats_field), None
+                        percentiles = quantiles(data_to_use, stats_field, percentile_fractions)
+                    row = {'field': stats_field, 'distinct values': distinct}
+                    row.update({f"p{round(fraction * 100)}": value for fraction, value in zip(percentile_fractions, percentiles)})
+                    st.session_state["group_stats"] = (stats_key, row, distinct_error)
+                stored = st.session_state.get("group_stats")
+                if stored is not None and stored[0] == stats_key:
+                    _, row, distinct_error = stored
+                    st.dataframe([row], hide_index=True)
+                    if distinct_error is not None:
+                        st.caption(f"The distinct count has a standard error of {distinct_error:.1%} and every percentile is within {QUANTILE_ACCURACY:.0%} of the exact value.")
+
+        elif operation == "Join":
+            st.header("Join Data")
+            st.write("Find matching restaurants between two teams.")
         
-        col1, col2 = st.columns(2)
+            col1, col2 = st.columns(2)
         
-        with col1:
-            # Chooses the first team you want to run the join function on
-            selected_team1_key = st.selectbox(
-            "Choose Team 1:",
-            team_keys, 
-            format_func=clean_team_name  
-            )
-            key1 = st.text_input("Join Key for Team 1 (e.g., name)", "name")
-            data1 = all_team_data[selected_team1_key]
+            with col1:
+                # Chooses the first team you want to run the join function on
+                selected_team1_key = st.selectbox(
+                "Choose Team 1:",
+                team_keys, 
+                format_func=clean_team_name  
+                )
+                key1 = st.text_input("Join Key for Team 1 (e.g., name, location.zip_code)", "name")
+                data1 = all_team_data[selected_team1_key]
             
-        with col2:
-            # Chooses the second team you want to run the join function on
-            selected_team2_key = st.selectbox(
-            "Choose Team 2:",
-            team_keys, 
-            format_func=clean_team_name
-            )
-            key2 = st.text_input("Join Key for Team 2 (e.g., name)", "name")
-            data2 = all_team_data[selected_team2_key]
+            with col2:
+                # Chooses the second team you want to run the join function on
+                selected_team2_key = st.selectbox(
+                "Choose Team 2:",
+                team_keys, 
+                format_func=clean_team_name
+                )
+                key2 = st.text_input("Join Key for Team 2 (e.g., name, location.zip_code)", "name")
+                data2 = all_team_data[selected_team2_key]
         
-        # Runs our join function
-        if st.button("Run Join"):
-            if data1 is None or data2 is None:
-                st.error("One or both datasets could not be loaded.")
-            else:
-                results = join(data1, key1, data2, key2)
-                st.success(f"Found {len(results)} matching restaurants.")
-                st.write(results)
-
-    elif operation == "Query with Filter, Projection":
-        # Chooses which team you want to run the functions on
-        selected_team_key = st.sidebar.selectbox(
-        "Choose a team:",
-        team_keys,
-        format_func=clean_team_name
-        )
-        data_to_use = all_team_data[selected_team_key]
-        st.header(f"Querying: **{clean_team_name(selected_team_key)}**")
-
-        if data_to_use:
-            # Uses our filter function first
-            st.subheader("First, filter the data:")
-            filter_field = st.text_input("Filter field (e.g., rating, name, price, location)", "rating")
-            filter_op = st.selectbox("Operator", (">=", ">", "==", "<", "<="))
-            filter_value = st.text_input("Value (e.g., 4.5)", "4.5")
-            
-            # Then, we use our project function
-            st.subheader("Second, project the results:")
-            # Uses the same function we used earlier to get a dropdown of all of the options
-            sample_record = data_to_use[0]
-            all_available_fields = list(sample_record.keys())
-            default_cols = [col for col in ["name", "rating", "price"] if col in all_available_fields]
-            fields_list = st.multiselect(
-                "Choose fields to display:", 
-                options=all_available_fields,
-                default=default_cols
+            join_type = st.selectbox("Join type", ("inner", "left", "anti"), help="inner: matching pairs, left: also keeps Team 1 restaurants without a match, anti: only Team 1 restaurants without a match")
+
+            # Runs our join function
+            result_key = (selected_team1_key, key1, selected_team2_key, key2, join_type)
+            if st.button("Run Join"):
+                if data1 is None or data2 is None:
+                    st.error("One or both datasets could not be loaded.")
+                else:
+                    # The join is cached for this pair of loaded teams, and dropped when either of them is reloaded
+                    versions = (data_version(data1), data_version(data2))
+                    cursor = query_cache.get_or_run(
+                        (selected_team1_key, selected_team2_key),
+                        None if None in versions else versions,
+                        ('join', key1, key2, join_type),
+                        lambda: join(data1, key1, data2, key2, join_type)
+                    )
+                    remember_results("join", result_key, cursor)
+            cursor = remembered_results("join", result_key)
+            if cursor is not None:
+                st.success(f"Found {cursor.total()} {'matching' if join_type == 'inner' else 'resulting'} restaurants.")
+                show_page("join", cursor)
+
+        elif operation == "Query with Filter, Projection":
+            # Chooses which team you want to run the functions on
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys + [ALL_TEAMS],
+            format_func=team_label
             )
+            data_to_use = team_sample(selected_team_key)
+            by_team = all_teams_mode(selected_team_key)
+            st.header(f"Querying: **{team_label(selected_team_key)}**")
+
+            if data_to_use:
+                # Uses our filter function first
+                st.subheader("First, filter the data:")
+                filter_field = st.text_input("Filter field (e.g., rating, name, price, location.city)", "rating")
+                filter_op = st.selectbox("Operator", (">=", ">", "==", "<", "<="))
+                filter_value = st.text_input("Value (e.g., 4.5)", "4.5")
             
-            # Uses both functions to run the query
-            if st.button("Run Query"):
+                # Then, we use our project function
+                st.subheader("Second, project the results:")
+                # Uses the same function we used earlier to get a dropdown of all of the options
+                sample_record = data_to_use[0]
+                all_available_fields = available_paths(sample_record)
+                default_cols = [col for col in ["name", "rating", "price"] if col in all_available_fields]
+                fields_list = st.multiselect(
+                    "Choose fields to display:", 
+                    options=all_available_fields,
+                    default=default_cols
+                )
+                sort_fields, descending, k = sort_inputs("filter_projection")
                 try:
+                    filter_value = float(filter_value)
+                except ValueError:
+                    pass
+
+                # Plans our filter then our projection, which the optimizer runs as one fused pass
+                # Sorting comes before the projection so a top k only projects the rows it keeps
+                plan = add_sort(Query().filter(filter_field, filter_op, filter_value), sort_fields, descending, k).project(fields_list)
+                result_key = (selected_team_key, by_team, plan.key())
+            
+                # Uses both functions to run the query
+                if st.button("Run Query"):
                     try:
-                        filter_value = float(filter_value)
-                    except ValueError:
-                        pass
-
-                    # First runs our filter function
-                    filtered_results = filter(data_to_use, filter_field, filter_op, filter_value)
-                    
-                    # Then, runs our projection function
-                    final_results = projection(filtered_results, fields_list)
-                    
-                    st.success(f"Found {len(final_results)} final results.")
-                    st.write(final_results)
+                        remember_results("filter_projection", result_key, query_results(selected_team_key, data_to_use, plan, by_team))
+                    except QueryServerError as e:
+                        st.error(str(e))
+                cursor = remembered_results("filter_projection", result_key)
+                if cursor is not None:
+                    try:
+                        st.success(f"Found {cursor.total()} final results.")
+                        show_page("filter_projection", cursor)
+                        show_plan(plan, data_to_use, selected_team_key)
                 
-                except Exception as e:
-                    st.error(f"An error occurred during the query: {e}")
-
-    elif operation == "Query with Filter, Group, Aggregate":
-        # Chooses which team you want to run the functions on
-        selected_team_key = st.sidebar.selectbox(
-        "Choose a team:",
-        team_keys,
-        format_func=clean_team_name
-        )
-        data_to_use = all_team_data[selected_team_key]
-        st.header(f"Querying: **{clean_team_name(selected_team_key)}**")
-
-        if data_to_use:
-            # First, we get our filter inputs for our filter function
-            st.subheader("First, filter the data:")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                filter_field = st.text_input("Filter field (e.g., rating, name, price)", "rating")
-            with col2:
-                filter_op = st.selectbox("Operator", (">=", ">", "==", "<", "<=", "!="))
-            with col3:
-                filter_value = st.text_input("Value (e.g., 4.0)", "4.0")
+                    except Exception as e:
+                        st.error(f"An error occurred during the query: {e}")
+
+        elif operation == "Query with Filter, Group, Aggregate":
+            # Chooses which team you want to run the functions on
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys + [ALL_TEAMS],
+            format_func=team_label
+            )
+            data_to_use = team_sample(selected_team_key)
+            by_team = all_teams_mode(selected_team_key)
+            approximate = answer_mode(selected_team_key)
+            st.header(f"Querying: **{team_label(selected_team_key)}**")
+
+            if data_to_use:
+                # First, we get our filter inputs for our filter function
+                st.subheader("First, filter the data:")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    filter_field = st.text_input("Filter field (e.g., rating, name, price)", "rating")
+                with col2:
+                    filter_op = st.selectbox("Operator", (">=", ">", "==", "<", "<=", "!="))
+                with col3:
+                    filter_value = st.text_input("Value (e.g., 4.0)", "4.0")
             
-            st.markdown("---")
-
-            # Second, we get our group by & aggregate inputs for our group by & aggregate function
-            st.subheader("Second, group & aggregate the filtered results:")
-            col4, col5, col6 = st.columns(3)
-            with col4:
-                group_field = st.text_input("Group by (e.g., price, id, rating)", "price")
-            with col5:
-                agg_field = st.text_input("Aggregate field (e.g., rating, transactions)", "rating")
-            with col6:
-                agg_func = st.selectbox("Function", ("count", "max", "min", "avg", "sum"))
+                st.markdown("---")
+
+                # Second, we get our group by & aggregate inputs for our group by & aggregate function
+                st.subheader("Second, group & aggregate the filtered results:")
+                col4, col5, col6 = st.columns(3)
+                with col4:
+                    group_field = st.text_input("Group by (e.g., price, rating, location.city)", "price")
+                with col5:
+                    agg_field = st.text_input("Aggregate field (e.g., rating, transactions)", "rating")
+                with col6:
+                    agg_func = st.selectbox("Function", ("count", "max", "min", "avg", "sum"))
+                sort_fields, descending, k = sort_inputs("filter_group", f"Sort groups by (e.g., {agg_func}_{agg_field})")
             
-            # Run the query using our two functions 
-            if st.button("Run Query"):
                 try:
-                    try:
-                        filter_value = float(filter_value)
-                    except ValueError:
-                        pass 
+                    filter_value = float(filter_value)
+                except ValueError:
+                    pass 
 
-                    # Run our filter function
-                    filtered_results = filter(data_to_use, filter_field, filter_op, filter_value)
-                    st.info(f"Step 1 (Filter) kept {len(filtered_results)} records.")
+                # Plans our filter then our group by & aggregate function, which streams the filtered records into the aggregates
+                plan = Query().filter(filter_field, filter_op, filter_value).group_aggregate(group_field, [(agg_func, agg_field)])
+                plan = add_sort(plan, sort_fields, descending, k)
+                result_key = (selected_team_key, by_team, approximate, plan.key())
 
-                    if not filtered_results:
+                # Run the query using our two functions, or estimate it from the team's sample
+                if st.button("Run Query"):
+                    try:
+                        if approximate:
+                            cursor = approximate_results(data_to_use, group_field, [(agg_func, agg_field)], [(filter_field, filter_op, filter_value)], sort_fields, descending, k)
+                        else:
+                            cursor = query_results(selected_team_key, data_to_use, plan, by_team, counted=True)
+                        remember_results("filter_group", result_key, cursor)
+                    except Exception as e:
+                        st.error(f"An error occurred: {e}")
+                cursor = remembered_results("filter_group", result_key)
+                if cursor is not None:
+                    counters = cursor.notes
+                    st.info(f"Step 1 (Filter) kept {'about ' if approximate else ''}{counters['filtered']} records.")
+
+                    if not counters['filtered']:
                         st.warning("Filter removed all data. Cannot group.")
                     else:
-                        # Run our group by function
-                        grouped_data = group_by(filtered_results, group_field)
-                        
-                        # Run our aggregate function
-                        final_results = []
-                        for group_name, documents in grouped_data.items():
-                            if agg_func == 'max':
-                                val = aggregate_max(documents, agg_field)
-                            elif agg_func == 'min':
-                                val = aggregate_min(documents, agg_field)
-                            elif agg_func == 'avg':
-                                val = aggregate_avg(documents, agg_field)
-                            elif agg_func == 'sum':
-                                val = aggregate_sum(documents, agg_field)
-                            elif agg_func == 'count':
-                                val = aggregate_count(documents)
-                            else:
-                                val = "Error"
-
-                            final_results.append({
-                                group_field: group_name,
-                                f"{agg_func}_{agg_field}": val
-                            })
-                        
                         # Display final results
                         st.success("Chain Completed Successfully!")
-                        st.write(final_results)
-                
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
-
-    elif operation == "Query with Filter, Group, Aggregate, Project":
-        # Chooses which team you want to run the functions on
-        selected_team_key = st.sidebar.selectbox(
-        "Choose a team:",
-        team_keys,
-        format_func=clean_team_name
-        )
-        data_to_use = all_team_data[selected_team_key]
-        st.header(f"Querying: **{clean_team_name(selected_team_key)}**")        
-        if data_to_use:
-            # Get our filter inputs for our filter function
-            st.subheader("First, filter the data:")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                filter_field = st.text_input("Filter field (e.g., rating, name, price)", "rating")
-            with col2:
-                filter_op = st.selectbox("Operator", (">=", ">", "==", "<", "<=", "!="))
-            with col3:
-                filter_value = st.text_input("Value (e.g., 3.5)", "3.5")
+                        show_page("filter_group", cursor)
+                    if approximate:
+                        show_estimate_note(cursor)
+                    else:
+                        show_plan(plan, data_to_use, selected_team_key)
+
+        elif operation == "Query with Filter, Group, Aggregate, Project":
+            # Chooses which team you want to run the functions on
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys + [ALL_TEAMS],
+            format_func=team_label
+            )
+            data_to_use = team_sample(selected_team_key)
+            by_team = all_teams_mode(selected_team_key)
+            st.header(f"Querying: **{team_label(selected_team_key)}**")        
+            if data_to_use:
+                # Get our filter inputs for our filter function
+                st.subheader("First, filter the data:")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    filter_field = st.text_input("Filter field (e.g., rating, name, price)", "rating")
+                with col2:
+                    filter_op = st.selectbox("Operator", (">=", ">", "==", "<", "<=", "!="))
+                with col3:
+                    filter_value = st.text_input("Value (e.g., 3.5)", "3.5")
             
-            st.markdown("---") 
+                st.markdown("---") 
 
-            # Get our group by inputs for our group by function
-            st.subheader("Second, group the filtered data:")
-            group_field = st.text_input("Group by field (e.g., price, id, rating)", "price")
-            agg_target_field = st.text_input("Field to calculate stats on (e.g., rating, transactions)", "rating")
+                # Get our group by inputs for our group by function
+                st.subheader("Second, group the filtered data:")
+                group_field = st.text_input("Group by field (e.g., price, rating, location.city)", "price")
+                agg_target_field = st.text_input("Field to calculate stats on (e.g., rating, transactions)", "rating")
 
-            st.markdown("---") 
+                st.markdown("---") 
 
-            # Get our projection inputs for our projection inputs
-            st.subheader("Third, project the grouped and filtered data:")
-            options = [group_field, 'Count', f'Max_{agg_target_field}', f'Avg_{agg_target_field}']
-            selected_columns = st.multiselect("Choose columns to display:", options, default=options)
+                # Get our projection inputs for our projection inputs
+                st.subheader("Third, project the grouped and filtered data:")
+                options = [group_field, 'Count', f'Max_{agg_target_field}', f'Avg_{agg_target_field}']
+                selected_columns = st.multiselect("Choose columns to display:", options, default=options)
+                sort_fields, descending, k = sort_inputs("filter_group_project", f"Sort groups by (e.g., Count, Avg_{agg_target_field})")
             
-            # Run query wiht our three functions
-            if st.button("Run Query"):
                 try:
-                    try:
-                        filter_value = float(filter_value)
-                    except ValueError:
-                        pass 
+                    filter_value = float(filter_value)
+                except ValueError:
+                    pass 
+
+                # Plans our filter, group by & aggregation (all three aggregates in one pass) and projection functions
+                plan = Query().filter(filter_field, filter_op, filter_value).group_aggregate(group_field, {
+                    'Count': ('count', None),
+                    f'Max_{agg_target_field}': ('max', agg_target_field),
+                    f'Avg_{agg_target_field}': ('avg', agg_target_field)
+                })
+                plan = add_sort(plan, sort_fields, descending, k).project(selected_columns)
+                result_key = (selected_team_key, by_team, plan.key())
 
-                    # Use our filter function
-                    filtered_results = filter(data_to_use, filter_field, filter_op, filter_value)
-                    
-                    if not filtered_results:
+                # Run query wiht our three functions
+                if st.button("Run Query"):
+                    try:
+                        cursor = query_results(selected_team_key, data_to_use, plan, by_team, counted=True)
+                        remember_results("filter_group_project", result_key, cursor)
+                    except Exception as e:
+                        st.error(f"An error occurred: {e}")
+                cursor = remembered_results("filter_group_project", result_key)
+                if cursor is not None:
+                    counters = cursor.notes
+                    if not counters['filtered']:
                         st.warning("Filter removed all data. Stopping.")
                     else:
-                        st.info(f"Filter kept {len(filtered_results)} records.")
-
-                        # Use our group by function
-                        grouped_data = group_by(filtered_results, group_field)
-                        
-                        # Use our aggreagtion function
-                        aggregated_results = []
-                        for group_name, documents in grouped_data.items():
-                            
-                            count_val = aggregate_count(documents)
-                            max_val = aggregate_max(documents, agg_target_field)
-                            avg_val = aggregate_avg(documents, agg_target_field)
-                            
-                            summary_doc = {
-                                group_field: group_name,
-                                'Count': count_val,
-                                f'Max_{agg_target_field}': max_val,
-                                f'Avg_{agg_target_field}': avg_val
-                            }
-                            aggregated_results.append(summary_doc)
-
-                        # Use our projection function
-                        final_output = projection(aggregated_results, selected_columns)
-                        
+                        st.info(f"Filter kept {counters['filtered']} records.")
                         st.success("Pipeline Complete!")
-                        st.write(final_output)
-                
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
\ No newline at end of file
+                        show_page("filter_group_project", cursor)
+                    show_plan(plan, data_to_use, selected_team_key)
+
+        elif operation == "Nearby Search":
+            # Chooses which stadium (or a custom point) to search around
+            geo_index = load_geo_index(data_folder)
+            st.sidebar.title("Search Around")
+            center_options = [team_key for team_key in team_keys if team_key in geo_index.stadiums] + ["Custom point"]
+            center_key = st.sidebar.selectbox(
+            "Choose a stadium:",
+            center_options,
+            format_func=lambda key: key if key == "Custom point" else clean_team_name(key)
+            )
+
+            if center_key == "Custom point":
+                st.header("Restaurants near a custom point")
+                col1, col2 = st.columns(2)
+                with col1:
+                    latitude = st.number_input("Latitude", value=34.0739, format="%.6f")
+                with col2:
+                    longitude = st.number_input("Longitude", value=-118.2400, format="%.6f")
+            else:
+                latitude, longitude = geo_index.stadiums[center_key]
+                st.header(f"Restaurants near the {clean_team_name(center_key)} stadium")
+
+            st.write(f"The spatial index covers {len(geo_index)} restaurants across every team's data.")
+            search_type = st.radio("Search type", ("Within distance", "Nearest"), horizontal=True)
+            if search_type == "Within distance":
+                meters = st.number_input("Distance in meters", min_value=1, max_value=int(MAX_DISTANCE_METERS), value=500, step=100)
+            else:
+                k = st.number_input("Number of restaurants", min_value=1, value=10, step=1)
+
+            def nearby_rows(matches):
+                # Looks the matching restaurants up in their team's data as each row is shown, skipping any deleted since
+                for distance, team_key, position, business_id in matches:
+                    document = find_business(all_team_data[team_key], position, business_id)
+                    if document is None:
+                        continue
+                    yield {
+                        'name': document.get('name'),
+                        'rating': document.get('rating'),
+                        'price': document.get('price'),
+                        'meters_away': round(distance, 1),
+                        'team': clean_team_name(team_key),
+                        'address': ', '.join((document.get('location') or {}).get('display_address') or []),
+                    }
+
+            result_key = (center_key, latitude, longitude, search_type, meters if search_type == "Within distance" else k)
+            # Runs our spatial query; only the restaurants on the shown page are looked up
+            if st.button("Run Search"):
+                # Teams in memory that were written to since they were indexed are indexed again first
+                for team_key in (all_team_data.loaded_teams() if isinstance(all_team_data, LazyTeamData) else team_keys):
+                    team_data = all_team_data[team_key]
+                    if isinstance(team_data, Sequence):
+                        geo_index.refresh_team(team_key, team_data, team_data.header)
+                if search_type == "Within distance":
+                    matches = geo_index.within(latitude, longitude, meters)
+                else:
+                    matches = geo_index.nearest(latitude, longitude, int(k))
+                remember_results("nearby", result_key, ResultCursor(nearby_rows(matches), len(matches)))
+            cursor = remembered_results("nearby", result_key)
+            if cursor is not None:
+                st.success(f"Found {cursor.total()} restaurants.")
+                show_page("nearby", cursor)
+
+        elif operation == "Text Search":
+            # Chooses which team to search, or every team at once
+            st.sidebar.title("Select Team")
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys + [ALL_TEAMS],
+            format_func=team_label
+            )
+
+            st.header(f"Search restaurants for: {team_label(selected_team_key)}")
+            search_text = st.text_input("Search names, aliases and categories (every word has to match)", "")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                match_mode = st.radio("Match", ("Whole words", "Prefix", "Substring"), help="Prefix: 'burg' finds Burgers. Substring: 'urge' does too.")
+            with col2:
+                rank_by = st.selectbox("Rank by", ("None", "rating", "review_count"))
+                descending = st.checkbox("Highest first", value=True)
+            with col3:
+                k = st.number_input("Show top k (0 = all)", min_value=0, value=0, step=1, key="text_search_top_k")
+            mode = {"Whole words": 'words', "Prefix": 'prefix', "Substring": 'substring'}[match_mode]
+            rank_field = None if rank_by == "None" else rank_by
+
+            def text_rows(matches):
+                # Shows the matching restaurants, given as (team, business) pairs
+                for team_key, document in matches:
+                    yield {
+                        'name': document.get('name'),
+                        'rating': document.get('rating'),
+                        'review_count': document.get('review_count'),
+                        'price': document.get('price'),
+                        'categories': ', '.join(category.get('title', '') for category in document.get('categories') or [] if isinstance(category, Mapping)),
+                        'team': clean_team_name(team_key),
+                        'address': ', '.join((document.get('location') or {}).get('display_address') or []),
+                    }
+
+            result_key = (selected_team_key, search_text, mode, rank_field, descending, k)
+            # Runs our text search on the inverted indexes
+            if st.button("Run Search"):
+                if selected_team_key == ALL_TEAMS:
+                    league_index = load_text_search(data_folder)
+                    # Teams in memory that were loaded again or written to since they were collected are taken again first
+                    for team_key in (all_team_data.loaded_teams() if isinstance(all_team_data, LazyTeamData) else team_keys):
+                        team_data = all_team_data[team_key]
+                        if isinstance(team_data, Sequence):
+                            league_index.refresh_team(team_key, team_data)
+                    found = league_index.search(search_text, mode, rank_field, descending, k or None)
+                    # Only the restaurants on the shown page are looked up in their team's data, skipping any deleted since
+                    matches = ((team_key, find_business(all_team_data[team_key], position, business_id)) for team_key, position, business_id in found)
+                    matches = ((team_key, document) for team_key, document in matches if document is not None)
+                    remember_results("text_search", result_key, ResultCursor(text_rows(matches), len(found)))
+                else:
+                    data_to_use = all_team_data[selected_team_key]
+                    if isinstance(data_to_use, Sequence):
+                        documents = text_search(data_to_use, search_text, mode, rank_field, descending, k or None)
+                        remember_results("text_search", result_key, ResultCursor(list(text_rows((selected_team_key, document) for document in documents))))
+                    else:
+                        st.error("This team's file has no list of businesses to search.")
+            cursor = remembered_results("text_search", result_key)
+            if cursor is not None:
+                st.success(f"Found {cursor.total()} restaurants.")
+                show_page("text_search", cursor)
+
+        elif operation == "Edit Data":
+            # Chooses which team you want to write to
+            st.sidebar.title("Select Team")
+            selected_team_key = st.sidebar.selectbox(
+            "Choose a team:",
+            team_keys,
+            format_func=clean_team_name
+            )
+            data_to_use = all_team_data[selected_team_key]
+
+            st.header(f"Edit data for: {clean_team_name(selected_team_key)}")
+            st.write("Changes are saved to the team's operation log and can be queried right away. The log is folded back into the team file in the background.")
+
+            if isinstance(data_to_use, Collection) and data_to_use.log is not None:
+                edit_type = st.radio("Change", ("Insert", "Update", "Delete"), horizontal=True)
+                if edit_type == "Insert":
+                    document_text = st.text_area("Business as JSON (needs an id)", '{"id": "", "name": "", "rating": 4.0, "price": "$$", "review_count": 0}')
+                else:
+                    business_id = st.text_input("Business id", data_to_use[0]['id'] if data_to_use else "")
+                    if edit_type == "Update":
+                        changes_text = st.text_area("Fields to set as JSON", '{"rating": 4.5}')
+
+                # Runs our insert, update or delete function
+                if st.button(f"Run {edit_type}"):
+                    try:
+                        if edit_type == "Insert":
+                            document = parse_object(document_text)
+                            insert(data_to_use, document)
+                            st.success(f"Inserted {document['id']}.")
+                        elif edit_type == "Update":
+                            position = update(data_to_use, business_id, parse_object(changes_text))
+                            st.success(f"Updated {business_id}.")
+                            st.json(plain(data_to_use[position]))
+                        else:
+                            delete(data_to_use, business_id)
+                            st.success(f"Deleted {business_id}.")
+                    except (ValueError, OSError) as e:
+                        st.error(f"ERROR: {e}")
+
+                if st.button("Compact now"):
+                    try:
+                        st.success(f"Folded {compact(data_to_use)} changes into the team file.")
+                    except (ValueError, OSError) as e:
+                        st.error(f"ERROR: {e}")
+                log = data_to_use.log
+                st.caption(f"Operation log: {log.records} changes not yet in the team file · compactions: {log.compactions}{' · compacting now' if log.compacting else ''}")
+                if log.last_error:
+                    st.error(log.last_error)
+            else:
+                st.warning("This dataset cannot be edited." + (" Teams served from the record store are read-only." if record_store else ""))
+    finally:
+        if page_profile is not None:
+            profiling.stop(page_profile)
+
+    if page_profile is not None:
+        show_performance(page_profile)
+
+# Shows how the lazy team loader is doing, after this run's pages have used it
+if isinstance(all_team_data, LazyTeamData):
+    loader_stats = all_team_data.stats()
+    st.sidebar.caption(f"Teams in memory: {loader_stats['loaded']}/{loader_stats['max_teams']} · hits: {loader_stats['hits']} · misses: {loader_stats['misses']} · evictions: {loader_stats['evictions']}")
+
+# Shows how the query result cache is doing, the query server's when the queries run there
+cache_stats = query_cache.stats()
+cache_label = "Query cache"
+if query_client is not None:
+    try:
+        cache_stats = query_client.health()['cache']
+        cache_label = "Query server cache"
+    except QueryServerError:
+        pass
+st.sidebar.caption(f"{cache_label}: {cache_stats['entries']} results ({cache_stats['bytes'] / (1024 * 1024):.1f} MB) · hits: {cache_stats['hits']} · misses: {cache_stats['misses']} · evictions: {cache_stats['evictions']} · invalidated: {cache_stats['invalidations']}")
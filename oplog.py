@@ -0,0 +1,208 @@
+# DSCI 551 Final Project - Darren Parry
+
+import marshal
+import os
+import struct
+import threading
+
+from parser import dumps
+from records import plain
+
+# Every write to a team is appended to an operation log next to its file, e.g. data/Chicago_Cubs_restaurants.json.oplog,
+# before it is applied to the loaded Collection. Loading a team replays its log on top of the JSON file (or its
+# snapshot), and compaction folds the log back into the JSON file so it does not grow forever.
+# Each record is a marshal-encoded tuple with a 4-byte length in front:
+#   ('insert', document)
+#   ('update', business_id, changes)     changes is a dict of the top-level fields to set
+#   ('delete', business_id)
+# Records are applied so that replaying one twice gives the same documents (an insert of an id that exists replaces
+# it, an update or delete of a missing id does nothing), so a crash between rewriting the JSON file and trimming the
+# log never corrupts the team.
+LOG_SUFFIX = '.oplog'
+_LENGTH = struct.Struct('<I')
+# Records appended before the log is folded into the team file in the background
+DEFAULT_COMPACT_AFTER = 500
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def log_path(file_path):
+    return file_path + LOG_SUFFIX
+
+def open_log(file_path, cache=None):
+    # Returns the one OperationLog of a team file in this process, shared by every copy of the team loaded here
+    key = os.path.abspath(file_path)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = OperationLog(file_path, cache)
+        elif log.cache is None:
+            log.cache = cache
+    return log
+
+class OperationLog:
+    # The append-only log of one team file; use open_log to get it. lock serializes the writes to the team, so the
+    # order of the records is the order the writes were applied in.
+    def __init__(self, file_path, cache=None, compact_after=DEFAULT_COMPACT_AFTER):
+        self.file_path = file_path
+        self.path = log_path(file_path)
+        # The snapshot cache refreshed by compaction, so the compacted file is not parsed again
+        self.cache = cache
+        self.compact_after = compact_after
+        self.lock = threading.RLock()
+        self.compacting = False
+        self.compactions = 0
+        self.last_error = None
+        # Records in the log file, and the byte length of those records
+        self.records = 0
+        self.end = 0
+        self.read()
+
+    def __reduce__(self):
+        # Loaded teams are sent back from worker processes; they get this process's log for the file instead of a copy
+        return open_log, (self.file_path, self.cache)
+
+    def read(self):
+        # Returns every complete record in the log. A record cut off by a crash mid-append (or still being appended
+        # by the app while another process reads) is left out.
+        with self.lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                content = b''
+            records = []
+            end = 0
+            while end + _LENGTH.size <= len(content):
+                length, = _LENGTH.unpack_from(content, end)
+                start = end + _LENGTH.size
+                if start + length > len(content):
+                    break
+                try:
+                    records.append(marshal.loads(content[start:start + length]))
+                except (EOFError, ValueError, TypeError):
+                    break
+                end = start + length
+            self.records = len(records)
+            self.end = end
+            return records
+
+    def append(self, record):
+        # Writes one record and flushes it to disk before the write is applied in memory. A cut-off record left by a
+        # crash is cut away first, so every record starts where the one before it ends.
+        data = marshal.dumps(record)
+        with open(self.path, 'ab') as f:
+            if f.tell() != self.end:
+                f.truncate(self.end)
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.records += 1
+        self.end += _LENGTH.size + len(data)
+
+    def drop_through(self, end, records):
+        # Removes the first `records` records (the first `end` bytes) once they are in the team file, keeping any
+        # appended since
+        with open(self.path, 'rb') as f:
+            f.seek(end)
+            rest = f.read()
+        if not rest:
+            os.remove(self.path)
+        else:
+            temp_path = self.path + f'.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(rest)
+            os.replace(temp_path, self.path)
+        self.records -= records
+        self.end -= end
+
+def apply_record(collection, record):
+    # Applies one log record to a Collection and returns the position it changed, or None when there was nothing to change
+    kind = record[0]
+    if kind == 'insert':
+        document = record[1]
+        position = collection.position_of(document.get('id'))
+        if position is None:
+            return collection.insert_document(document)
+        collection.replace_document(position, document)
+        return position
+    position = collection.position_of(record[1])
+    if position is None:
+        return None
+    if kind == 'update':
+        # A new dict instead of changing the old one, which results already handed out may still hold
+        collection.replace_document(position, {**collection[position], **record[2]})
+    elif kind == 'delete':
+        collection.remove_document(position)
+    else:
+        raise ValueError(f"Unknown log record: {kind}")
+    return position
+
+def replay(collection, records, log=None):
+    # Applies a team file's log records to its freshly loaded Collection and keeps the log for later writes.
+    # The loader reads the records before the team file: compaction rewrites the file before it trims the log, so
+    # in that order no write is ever missed, and one that is already in the file is simply applied again.
+    for record in records:
+        apply_record(collection, record)
+    collection.log = log
+    return collection
+
+def write_team_file(file_path, header, businesses):
+    # Writes a team file in the layout of the originals (header fields and a "businesses" array), replacing the old
+    # file only once the new one is complete
+    temp_path = file_path + f'.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write('{')
+        for key, value in header.items():
+            f.write(f"{dumps(key)}: {dumps(value)}, ")
+        f.write('"businesses": [')
+        for i, document in enumerate(businesses):
+            if i:
+                f.write(', ')
+            f.write(dumps(document))
+        f.write(']}')
+    os.replace(temp_path, file_path)
+
+def compact(collection):
+    # Folds a team's log into its JSON file and snapshot. Writes keep going while the file is written; only the
+    # records that were folded are dropped from the log afterwards. Returns how many records were folded.
+    log = collection.log
+    with log.lock:
+        if log.records == 0 or log.compacting:
+            return 0
+        log.compacting = True
+        header = dict(collection.header)
+        # Compact records (see records.py) are stored as dicts, which marshal can write to the snapshot
+        documents = [plain(document) for document in collection]
+        end, records = log.end, log.records
+    try:
+        write_team_file(log.file_path, header, documents)
+        if log.cache is not None:
+            try:
+                log.cache.store(log.file_path, (header, documents))
+            except OSError:
+                pass
+        with log.lock:
+            log.drop_through(end, records)
+            log.compactions += 1
+    finally:
+        log.compacting = False
+    return records
+
+def compact_in_background(collection):
+    # Starts compacting a team in a daemon thread unless it already is, and returns the thread (or None)
+    log = collection.log
+    if log.compacting or log.records == 0:
+        return None
+
+    def run():
+        try:
+            compact(collection)
+            log.last_error = None
+        except Exception as e:
+            log.last_error = f"Compaction of {log.file_path} failed: {e}"
+
+    thread = threading.Thread(target=run, name=f"compact {os.path.basename(log.file_path)}", daemon=True)
+    thread.start()
+    return thread
@@ -1,17 +1,92 @@
 # DSCI 551 Final Project - Darren Parry
 
+import re
+from decimal import Decimal
+
+from profiling import profiled
+from records import OBJECT_TYPES, Interner
+
+# Parsing engines that SimpleJSONParser can run. The scanner is the fast path, classic is the original character-by-character parser.
+ENGINES = ('scanner', 'classic')
+
+# Precompiled patterns the scanner uses to jump over whitespace and numbers in one step
+_WHITESPACE = re.compile(r'\s*')
+_NUMBER = re.compile(r'[0-9.\-]+')
+_STRUCTURAL = re.compile(r'[\[\]{}"]')
+# Every character str.isspace() accepts, which is what the classic engine skips and what \s matches, so both engines
+# read the same whitespace (\x0b, \x0c and Unicode spaces are rare, but the classic engine accepts them between tokens).
+_WHITESPACE_CHARS = ' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+_NUMBER_START_CHARS = '0123456789-'
+
 class SimpleJSONParser:
     # A simple JSON parser that handles strings, numbers (int/float), booleans, and null values within a JSON object.
-    def __init__(self):
+    def __init__(self, engine='scanner'):
+            if engine not in ENGINES:
+                raise ValueError(f"Unknown parser engine: {engine}")
+            self.engine = engine
             self.json_string = None
             self.index = 0
 
+    @profiled('SimpleJSONParser.parse', data_arg=None, result_rows=None)
     def parse(self, json_string):
         # Method to start parsing
         self.json_string = json_string.strip()
         self.index = 0
+        if self.engine == 'scanner':
+            value, self.index = _scan_document(self.json_string, self.index)
+            return value
         return self._parse_value()
 
+    def iterparse(self, file_handle, path='businesses', chunk_size=65536, compact_records=False):
+        # Generator mode: reads the file handle in fixed-size chunks and yields each element of the top-level array
+        # stored under `path` as soon as that element is complete. Every other top-level field (the stadium header)
+        # is collected in self.header; fields that come after the array are there once the generator is exhausted.
+        # With compact_records, objects are yielded as compact records sharing their keys and repeated values (see records.py).
+        self.header = {}
+        self.path_found = False
+        reader = _ChunkReader(file_handle, chunk_size)
+        interner = Interner() if compact_records else None
+
+        if reader.peek() != '{':
+            raise ValueError("Expected a JSON object at the top level")
+        reader.index += 1
+
+        while True:
+            char = reader.peek()
+            if char == '}':
+                reader.index += 1
+                return
+            elif char == ',':
+                reader.index += 1
+                continue
+            elif char is None:
+                raise ValueError("Unexpected end of JSON input")
+            elif char != '"':
+                raise ValueError(f"Expected string key in JSON object, got: {char}")
+
+            key = reader.read_value()
+            if reader.peek() != ':':
+                raise ValueError("Expected ':' after key in JSON object")
+            reader.index += 1
+
+            if key == path and reader.peek() == '[':
+                self.path_found = True
+                reader.index += 1
+                while True:
+                    char = reader.peek()
+                    if char == ']':
+                        reader.index += 1
+                        break
+                    elif char == ',':
+                        reader.index += 1
+                        continue
+                    elif char is None:
+                        raise ValueError("Unexpected end of JSON input")
+                    value = reader.read_value()
+                    yield value if interner is None else interner.record(value)
+            else:
+                self.header[key] = reader.read_value()
+
     def _get_current_char(self):
         # Gets the character at the current index 
         if self.index < len(self.json_string):
@@ -126,3 +201,228 @@ class SimpleJSONParser:
             return self._parse_array()
         else:
             raise ValueError(f"Unexpected character: {char}")
+
+
+def _scan_document(s, idx=0):
+    # Single-pass scanner used by the 'scanner' engine. It returns the same objects as the classic methods above,
+    # but jumps through strings with str.find and through whitespace and numbers with the precompiled regexes.
+    find = s.find
+    startswith = s.startswith
+    match_whitespace = _WHITESPACE.match
+    match_number = _NUMBER.match
+
+    def scan_value(idx):
+        char = s[idx]
+        if char in _WHITESPACE_CHARS:
+            # Most separators are a single space, so only fall back to the regex for longer runs
+            idx += 1
+            char = s[idx]
+            if char in _WHITESPACE_CHARS:
+                idx = match_whitespace(s, idx).end()
+                char = s[idx]
+
+        if char == '"':
+            end = find('"', idx + 1)
+            if end == -1:
+                raise ValueError("Unterminated string")
+            return s[idx + 1:end], end + 1
+        elif char == '{':
+            return scan_object(idx + 1)
+        elif char == '[':
+            return scan_array(idx + 1)
+        elif char in _NUMBER_START_CHARS:
+            num_str = match_number(s, idx).group()
+            return (float(num_str) if '.' in num_str else int(num_str)), idx + len(num_str)
+        elif startswith('true', idx):
+            return True, idx + 4
+        elif startswith('false', idx):
+            return False, idx + 5
+        elif startswith('null', idx):
+            return None, idx + 4
+        else:
+            raise ValueError(f"Unexpected character: {char}")
+
+    def scan_object(idx):
+        obj = {}
+        while True:
+            char = s[idx]
+            if char in _WHITESPACE_CHARS:
+                idx += 1
+                char = s[idx]
+                if char in _WHITESPACE_CHARS:
+                    idx = match_whitespace(s, idx).end()
+                    char = s[idx]
+
+            if char == '}':
+                return obj, idx + 1
+            elif char == ',':
+                idx += 1
+                continue
+            elif char != '"':
+                raise ValueError(f"Expected string key in JSON object, got: {char}")
+
+            end = find('"', idx + 1)
+            if end == -1:
+                raise ValueError("Unterminated string")
+            key = s[idx + 1:end]
+
+            idx = end + 1
+            if s[idx] != ':':
+                idx = match_whitespace(s, idx).end()
+                if s[idx] != ':':
+                    raise ValueError("Expected ':' after key in JSON object")
+
+            obj[key], idx = scan_value(idx + 1)
+
+    def scan_array(idx):
+        arr = []
+        append = arr.append
+        while True:
+            char = s[idx]
+            if char in _WHITESPACE_CHARS:
+                idx += 1
+                char = s[idx]
+                if char in _WHITESPACE_CHARS:
+                    idx = match_whitespace(s, idx).end()
+                    char = s[idx]
+
+            if char == ']':
+                return arr, idx + 1
+            elif char == ',':
+                idx += 1
+                continue
+
+            value, idx = scan_value(idx)
+            append(value)
+
+    try:
+        return scan_value(idx)
+    except IndexError:
+        raise ValueError("Unexpected end of JSON input") from None
+
+
+def _find_value_end(s, idx):
+    # Returns the index just past the value starting at idx, or -1 when the buffer does not hold all of it yet
+    char = s[idx]
+    if char == '"':
+        end = s.find('"', idx + 1)
+        return end + 1 if end != -1 else -1
+    elif char == '{' or char == '[':
+        depth = 0
+        search = _STRUCTURAL.search
+        while True:
+            match = search(s, idx)
+            if match is None:
+                return -1
+            char = match.group()
+            if char == '"':
+                end = s.find('"', match.end())
+                if end == -1:
+                    return -1
+                idx = end + 1
+                continue
+            depth += 1 if char in '{[' else -1
+            idx = match.end()
+            if depth == 0:
+                return idx
+    elif char in _NUMBER_START_CHARS:
+        # A number touching the end of the buffer may continue in the next chunk
+        end = _NUMBER.match(s, idx).end()
+        return end if end < len(s) else -1
+    else:
+        for literal in ('true', 'false', 'null'):
+            if s.startswith(literal, idx):
+                return idx + len(literal)
+            if literal.startswith(s[idx:]):
+                return -1
+        raise ValueError(f"Unexpected character: {char}")
+
+class _ChunkReader:
+    # Holds the unread part of a file handle that is read in fixed-size chunks for SimpleJSONParser.iterparse
+    def __init__(self, file_handle, chunk_size):
+        self.file_handle = file_handle
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.index = 0
+
+    def fill(self):
+        # Drops the consumed part of the buffer and appends the next chunk, returns False at the end of the file
+        chunk = self.file_handle.read(self.chunk_size)
+        self.buffer = self.buffer[self.index:] + chunk
+        self.index = 0
+        return bool(chunk)
+
+    def peek(self):
+        # Skips whitespace and returns the next character without consuming it, or None at the end of the file
+        while True:
+            self.index = _WHITESPACE.match(self.buffer, self.index).end()
+            if self.index < len(self.buffer):
+                return self.buffer[self.index]
+            if not self.fill():
+                return None
+
+    def read_value(self):
+        # Parses the next value once the buffer holds all of it
+        if self.peek() is None:
+            raise ValueError("Unexpected end of JSON input")
+        while True:
+            end = _find_value_end(self.buffer, self.index)
+            if end != -1:
+                break
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON input")
+        value, self.index = _scan_document(self.buffer, self.index)
+        return value
+
+
+def _float_text(value):
+    # A float as text the number scanner reads back exactly: always with a '.', never in exponent form
+    text = repr(value)
+    if text in ('inf', '-inf', 'nan'):
+        raise ValueError(f"Cannot write {text} as JSON")
+    if 'e' in text:
+        text = format(Decimal(text), 'f')
+    if '.' not in text:
+        text += '.0'
+    return text
+
+def _dump(value, parts):
+    if value is None:
+        parts.append('null')
+    elif value is True:
+        parts.append('true')
+    elif value is False:
+        parts.append('false')
+    elif type(value) is int:
+        parts.append(str(value))
+    elif type(value) is float:
+        parts.append(_float_text(value))
+    elif type(value) is str:
+        if '"' in value:
+            raise ValueError(f"Cannot write a string containing '\"': {value!r}")
+        parts.append('"' + value + '"')
+    elif type(value) in OBJECT_TYPES:
+        parts.append('{')
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                parts.append(', ')
+            _dump(key if type(key) is str else str(key), parts)
+            parts.append(': ')
+            _dump(item, parts)
+        parts.append('}')
+    elif type(value) in (list, tuple):
+        parts.append('[')
+        for i, item in enumerate(value):
+            if i:
+                parts.append(', ')
+            _dump(item, parts)
+        parts.append(']')
+    else:
+        raise ValueError(f"Cannot write a {type(value).__name__} as JSON")
+
+def dumps(value):
+    # Writes a value as JSON text that SimpleJSONParser reads back into the same value. Strings are written exactly as
+    # they are stored, since the parser keeps whatever is between the quotes (escape sequences included) as it is.
+    parts = []
+    _dump(value, parts)
+    return ''.join(parts)
@@ -0,0 +1,274 @@
+# DSCI 551 Final Project - Darren Parry
+
+from functools import lru_cache
+
+from records import Record, OBJECT_TYPES
+
+# Paths reach into the nested objects and arrays of a business:
+#   'location.zip_code'      a field of a nested object
+#   'categories[].alias'     the field of every element of an array (the array is unwound)
+#   'categories[0].alias'    the field of one element of an array
+# A plain field name like 'rating' is not a path, and the functions keep their top-level code for it.
+# A path can resolve to several values (one per array element); a document matches a comparison on a path when
+# any of its values does, and group_by puts it in the group of each of its values.
+
+# Returned by a getter when the document does not have the path
+MISSING = object()
+
+# Compiled accessors, getters and projections kept for reuse. Fields come from what users type in the app and from
+# query server requests, so only the most recently used ones are kept.
+MAX_COMPILED = 256
+
+def is_path(field):
+    # True for a field name that reaches into nested objects or arrays
+    return isinstance(field, str) and ('.' in field or '[' in field)
+
+def parse_path(path):
+    # Splits a path into steps: ('key', name), ('each',) for [] and ('index', n) for [n]
+    steps = []
+    for part in path.split('.'):
+        name, bracket, rest = part.partition('[')
+        if not name:
+            raise ValueError(f"Invalid path: {path}")
+        steps.append(('key', name))
+        while bracket:
+            inside, closed, rest = rest.partition(']')
+            if not closed:
+                raise ValueError(f"Invalid path: {path}")
+            if inside == '':
+                steps.append(('each',))
+            elif inside.isdigit():
+                steps.append(('index', int(inside)))
+            else:
+                raise ValueError(f"Invalid path: {path}")
+            if rest and not rest.startswith('['):
+                raise ValueError(f"Invalid path: {path}")
+            bracket, rest = rest[:1], rest[1:]
+    return tuple(steps)
+
+def _chain(steps):
+    # Builds one function per step, each handing what it finds to the next one, so a path is only parsed once
+    def collect(value, found):
+        found.append(value)
+    visit = collect
+    for step in reversed(steps):
+        following = visit
+        if step[0] == 'key':
+            def visit(value, found, name=step[1], following=following):
+                if type(value) in OBJECT_TYPES and name in value:
+                    following(value[name], found)
+        elif step[0] == 'each':
+            def visit(value, found, following=following):
+                if type(value) is list:
+                    for item in value:
+                        following(item, found)
+        else:
+            def visit(value, found, index=step[1], following=following):
+                if type(value) is list and index < len(value):
+                    following(value[index], found)
+    return visit
+
+@lru_cache(maxsize=MAX_COMPILED)
+def compile_path(path):
+    # Returns a function of a document giving the list of values at the path ([] when it is missing).
+    # Accessors are compiled once per path and reused by every query.
+    # Rows made by group_by and group_aggregate hold a path key under its own name, e.g. {'location.city': ...}, so
+    # that name is checked first and later steps can still use the path on them
+    steps = parse_path(path)
+    if all(step[0] == 'key' for step in steps):
+        # Plain nested objects: walk the keys directly
+        names = tuple(step[1] for step in steps)
+        def accessor(document):
+            if path in document:
+                return [document[path]]
+            value = document
+            for name in names:
+                if type(value) not in OBJECT_TYPES or name not in value:
+                    return []
+                value = value[name]
+            return [value]
+    else:
+        visit = _chain(steps)
+        def accessor(document):
+            if path in document:
+                return [document[path]]
+            found = []
+            visit(document, found)
+            return found
+    return accessor
+
+@lru_cache(maxsize=MAX_COMPILED)
+def compile_getter(path):
+    # Returns a function of a document giving the single value at a path that does not go through arrays, or MISSING
+    # when the document does not have it. Returns None for paths through arrays, which use compile_path instead.
+    steps = parse_path(path)
+    if any(step[0] != 'key' for step in steps):
+        getter = None
+    elif len(steps) == 2:
+        # The common case, e.g. 'location.city', without the loop
+        first, second = steps[0][1], steps[1][1]
+        def getter(document):
+            if path in document:
+                return document[path]
+            inner = document.get(first)
+            if type(inner) in OBJECT_TYPES:
+                return inner.get(second, MISSING)
+            return MISSING
+    else:
+        names = tuple(step[1] for step in steps)
+        def getter(document):
+            if path in document:
+                return document[path]
+            value = document
+            for name in names:
+                if type(value) not in OBJECT_TYPES or name not in value:
+                    return MISSING
+                value = value[name]
+            return value
+    return getter
+
+def values(document, field):
+    # The values of a field or path in one document
+    if is_path(field):
+        return compile_path(field)(document)
+    return [document[field]] if field in document else []
+
+def _prune(steps):
+    # Builds a function returning (found, value) where value keeps only what the path reaches, in its original nesting
+    if not steps:
+        return lambda value: (True, value)
+    step, following = steps[0], _prune(steps[1:])
+    if step[0] == 'key':
+        name = step[1]
+        def prune(value):
+            if type(value) not in OBJECT_TYPES or name not in value:
+                return False, None
+            found, inner = following(value[name])
+            return (True, {name: inner}) if found else (False, None)
+    elif step[0] == 'each':
+        def prune(value):
+            if type(value) is not list:
+                return False, None
+            # Every nested object is kept, empty when it lacks the field, so several paths line up element by element
+            items = []
+            for item in value:
+                found, inner = following(item)
+                if found:
+                    items.append(inner)
+                elif type(item) in OBJECT_TYPES:
+                    items.append({})
+            return True, items
+    else:
+        index = step[1]
+        def prune(value):
+            if type(value) is not list or index >= len(value):
+                return False, None
+            found, inner = following(value[index])
+            return (True, [inner]) if found else (False, None)
+    return prune
+
+def _merge(target, source):
+    # Merges a pruned value into the projected document built so far
+    for key, value in source.items():
+        current = target.get(key)
+        if type(current) is Record and type(value) is dict:
+            # A nested object of a compact business is read-only, so the projection gets its own copy
+            current = target[key] = current.copy()
+        if type(current) is dict and type(value) is dict:
+            _merge(current, value)
+        elif type(current) is list and type(value) is list:
+            for i, item in enumerate(value):
+                if i < len(current) and type(current[i]) is dict and type(item) is dict:
+                    _merge(current[i], item)
+                elif i >= len(current):
+                    current.append(item)
+        else:
+            target[key] = value
+
+def compile_projection(fields):
+    # Returns a function of a document keeping only the given fields and paths. Paths keep their nesting, so
+    # projecting 'location.city' gives {'location': {'city': ...}} and later paths still resolve on the result.
+    return _compile_projection(tuple(fields))
+
+@lru_cache(maxsize=MAX_COMPILED)
+def _compile_projection(fields):
+    plain = [field for field in fields if not is_path(field)]
+    pruners = [(field, _prune(parse_path(field))) for field in fields if is_path(field)]
+    def projector(document):
+        projected = {field: document[field] for field in plain if field in document}
+        for field, prune in pruners:
+            if field in document:
+                projected[field] = document[field]
+                continue
+            found, value = prune(document)
+            if found:
+                _merge(projected, value)
+        return projected
+    return projector
+
+def key_function(field):
+    # Returns a function of a document giving its distinct group keys for a field or path: one per value, or [None]
+    # when it has none, matching group_by's None group for documents missing a top-level field
+    if not is_path(field):
+        return lambda document: [document.get(field)]
+    getter = compile_getter(field)
+    if getter is not None:
+        def single_key(document):
+            value = getter(document)
+            return [None] if value is MISSING else [value]
+        return single_key
+    accessor = compile_path(field)
+    def keys(document):
+        found = accessor(document)
+        if not found:
+            return [None]
+        if len(found) == 1:
+            return found
+        distinct = []
+        for value in found:
+            if value not in distinct:
+                distinct.append(value)
+        return distinct
+    return keys
+
+def available_paths(document):
+    # Lists a document's fields followed by the paths one level into its nested objects and arrays of objects,
+    # e.g. 'location.city' and 'categories[].alias', for choosing fields in the app
+    fields = list(document.keys())
+    nested = []
+    for field, value in document.items():
+        if type(value) in OBJECT_TYPES:
+            nested.extend(f"{field}.{name}" for name in value)
+        elif type(value) is list and value and type(value[0]) in OBJECT_TYPES:
+            nested.extend(f"{field}[].{name}" for name in value[0])
+    return fields + nested
+
+def _cell_text(value):
+    # Text for one value inside a joined list cell
+    if value is None:
+        return ''
+    if type(value) in OBJECT_TYPES:
+        return ', '.join(f"{key}: {_cell_text(item)}" for key, item in value.items())
+    return str(value)
+
+def flatten(document, prefix=''):
+    # Turns a nested document into one flat row for a table. Column names are the paths of the values, so nested
+    # objects become 'location.city' columns, lists of objects become 'categories[].alias' columns holding the
+    # element values joined with commas, and other lists are joined into one text cell.
+    row = {}
+    for key, value in document.items():
+        name = f"{prefix}{key}"
+        if type(value) in OBJECT_TYPES:
+            row.update(flatten(value, name + '.'))
+        elif type(value) is list:
+            if value and all(type(item) in OBJECT_TYPES for item in value):
+                names = []
+                for item in value:
+                    names.extend(sub for sub in item if sub not in names)
+                for sub in names:
+                    row[f"{name}[].{sub}"] = ', '.join(_cell_text(item[sub]) for item in value if sub in item)
+            else:
+                row[name] = ', '.join(_cell_text(item) for item in value)
+        else:
+            row[name] = value
+    return row
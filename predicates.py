@@ -0,0 +1,354 @@
+# DSCI 551 Final Project - Darren Parry
+
+import operator as op
+
+import paths
+from collection import Collection
+
+# A condition is a nested tuple:
+#   (field, operator, value)        a comparison, with operator one of OPERATORS
+#   ('and', condition, ...)         every condition holds
+#   ('or', condition, ...)          at least one condition holds
+#   ('not', condition)              the condition does not hold
+# e.g. ('and', ('rating', '>=', 4.5), ('price', '==', '$$'), ('review_count', '>', 500))
+# A field can also be a path like 'location.city' or 'categories[].alias' (see paths.py)
+COMPARISON_OPERATORS = ('==', '!=', '<', '<=', '>', '>=')
+OPERATORS = COMPARISON_OPERATORS + ('in', 'contains', 'exists')
+BOOLEAN_OPERATORS = ('and', 'or', 'not')
+ORDERING = {'<': op.lt, '<=': op.le, '>': op.gt, '>=': op.ge}
+
+# Guessed share of documents a comparison keeps when no index can tell us better
+DEFAULT_SELECTIVITY = {
+    '==': 0.1,
+    '!=': 0.9,
+    '<': 0.35,
+    '<=': 0.35,
+    '>': 0.35,
+    '>=': 0.35,
+    'in': 0.2,
+    'contains': 0.2,
+    'exists': 0.9,
+}
+
+def is_boolean(condition):
+    # True for and/or/not nodes, False for a (field, operator, value) comparison
+    return condition[0] in BOOLEAN_OPERATORS and all(isinstance(child, tuple) for child in condition[1:])
+
+def condition_fields(condition):
+    # Returns the set of fields a condition reads
+    if is_boolean(condition):
+        fields = set()
+        for child in condition[1:]:
+            fields |= condition_fields(child)
+        return fields
+    return {condition[0]}
+
+def normalize(condition):
+    # Validates a condition and flattens nested and/or nodes, e.g. ('and', a, ('and', b, c)) becomes ('and', a, b, c)
+    if not isinstance(condition, tuple) or len(condition) < 2:
+        raise ValueError(f"Invalid condition: {condition!r}")
+    if not is_boolean(condition):
+        if len(condition) != 3:
+            raise ValueError(f"Invalid condition: {condition!r}")
+        field, operator, value = condition
+        if operator not in OPERATORS:
+            raise ValueError(f"Unknown operator: {operator}")
+        if operator == 'in':
+            value = tuple(value)
+        return (field, operator, value)
+
+    tag = condition[0]
+    if tag == 'not':
+        if len(condition) != 2:
+            raise ValueError("'not' takes exactly one condition")
+        return ('not', normalize(condition[1]))
+    children = []
+    for child in condition[1:]:
+        child = normalize(child)
+        if child[0] == tag and is_boolean(child):
+            children.extend(child[1:])
+        else:
+            children.append(child)
+    return (tag,) + tuple(children) if len(children) > 1 else children[0]
+
+def canonical(condition):
+    # Rewrites a normalized condition into one form for every way of writing it: and/or children sorted and
+    # deduplicated, and 'in' members sorted. Used to recognize the same query, not to run it.
+    if not is_boolean(condition):
+        field, operator, value = condition
+        if operator == 'in':
+            members = {}
+            for member in value:
+                members.setdefault(repr(member), member)
+            value = tuple(members[text] for text in sorted(members))
+        return (field, operator, value)
+    if condition[0] == 'not':
+        return ('not', canonical(condition[1]))
+    children = {}
+    for child in condition[1:]:
+        child = canonical(child)
+        children.setdefault(repr(child), child)
+    if len(children) == 1:
+        return next(iter(children.values()))
+    return (condition[0],) + tuple(children[text] for text in sorted(children))
+
+def _index_positions(data, field, operator, value):
+    # Returns (positions, kind) answering one comparison from a Collection's indexes or columns, or (None, 'scan').
+    # Besides Collection.access_path this also answers 'in' from a hash index by merging the lookup of every member.
+    if not isinstance(data, Collection):
+        return None, 'scan'
+    if operator == 'in':
+        index = data.hash_indexes.get(field)
+        if index is None:
+            return None, 'scan'
+        positions = set()
+        for member in value:
+            found = index.lookup(member)
+            if found is None:
+                return None, 'scan'
+            positions.update(found)
+        return sorted(positions), 'hash index'
+    if operator in COMPARISON_OPERATORS:
+        return data.access_path(field, operator, value)
+    return None, 'scan'
+
+def _index_selectivity(data, field, operator, value):
+    # Uses a Collection's indexes to measure what share of documents a comparison keeps, or returns None
+    if not isinstance(data, Collection) or len(data) == 0:
+        return None
+    if operator == '==' and field in data.hash_indexes:
+        positions = data.hash_indexes[field].lookup(value)
+        if positions is not None:
+            return len(positions) / len(data)
+    if operator == 'in' and field in data.hash_indexes:
+        positions, _ = _index_positions(data, field, operator, value)
+        if positions is not None:
+            return len(positions) / len(data)
+    if field in data.sorted_indexes:
+        count = data.sorted_indexes[field].count(operator, value)
+        if count is not None:
+            return count / len(data)
+    return None
+
+def estimate_selectivity(condition, data=None):
+    # Estimates the share of documents a condition keeps, from the data's indexes when it has them and from defaults otherwise
+    if is_boolean(condition):
+        tag = condition[0]
+        if tag == 'not':
+            return 1 - estimate_selectivity(condition[1], data)
+        estimates = [estimate_selectivity(child, data) for child in condition[1:]]
+        if tag == 'and':
+            result = 1.0
+            for estimate in estimates:
+                result *= estimate
+            return result
+        result = 1.0
+        for estimate in estimates:
+            result *= 1 - estimate
+        return 1 - result
+
+    field, operator, value = condition
+    measured = _index_selectivity(data, field, operator, value)
+    if measured is not None:
+        return measured
+    if operator == 'in':
+        return min(1.0, DEFAULT_SELECTIVITY['=='] * max(len(value), 1))
+    return DEFAULT_SELECTIVITY.get(operator, 1.0)
+
+def order_by_selectivity(condition, data=None):
+    # Reorders and/or children so the cheapest way to decide the result is tried first: the clause most likely
+    # to fail goes first in an 'and', the clause most likely to pass goes first in an 'or'
+    if not is_boolean(condition):
+        return condition
+    tag = condition[0]
+    children = [order_by_selectivity(child, data) for child in condition[1:]]
+    if tag == 'not':
+        return ('not', children[0])
+    estimates = [estimate_selectivity(child, data) for child in children]
+    # sorted() is stable, so clauses with equal estimates keep the order they were written in
+    order = sorted(range(len(children)), key=lambda i: estimates[i] if tag == 'and' else -estimates[i])
+    return (tag,) + tuple(children[i] for i in order)
+
+def _compile_path_comparison(field, operator, value):
+    # Same as _compile_comparison for a path (see paths.py): the comparison holds when any value at the path matches
+    getter = paths.compile_getter(field)
+    accessor = paths.compile_path(field)
+    if operator == 'exists':
+        if value:
+            return lambda document: len(accessor(document)) > 0
+        return lambda document: not accessor(document)
+    if operator == '==':
+        test = lambda item: item == value
+    elif operator == '!=':
+        test = lambda item: item != value
+    elif operator in ORDERING:
+        compare = ORDERING[operator]
+        def test(item):
+            try:
+                return compare(item, value)
+            except TypeError:
+                return False
+    elif operator == 'in':
+        def test(item):
+            try:
+                return item in value
+            except TypeError:
+                return False
+    elif operator == 'contains':
+        def test(item):
+            try:
+                return value in item
+            except TypeError:
+                return False
+    else:
+        return lambda document: False
+    if getter is not None:
+        missing = paths.MISSING
+        def test_value(document):
+            item = getter(document)
+            return item is not missing and test(item)
+        return test_value
+    return lambda document: any(test(item) for item in accessor(document))
+
+def _compile_comparison(field, operator, value):
+    # Turns one comparison into a function of a document, deciding the operator only once
+    if paths.is_path(field):
+        return _compile_path_comparison(field, operator, value)
+    if operator == '==':
+        return lambda document: field in document and document[field] == value
+    elif operator == '!=':
+        return lambda document: field in document and document[field] != value
+    elif operator in ORDERING:
+        # Clauses may be reordered, so a value that cannot be ordered against `value` (e.g. None < '$') simply does
+        # not match instead of raising only under some orders
+        compare = ORDERING[operator]
+        def test_order(document):
+            if field not in document:
+                return False
+            try:
+                return compare(document[field], value)
+            except TypeError:
+                return False
+        return test_order
+    elif operator == 'in':
+        try:
+            members = frozenset(value)
+        except TypeError:
+            # Unhashable members (e.g. lists) are compared one by one
+            members = value
+        def test_in(document):
+            if field not in document:
+                return False
+            try:
+                return document[field] in members
+            except TypeError:
+                return document[field] in value
+        return test_in
+    elif operator == 'contains':
+        # Substring for strings, membership for lists; anything else contains nothing
+        def test_contains(document):
+            if field not in document:
+                return False
+            try:
+                return value in document[field]
+            except TypeError:
+                return False
+        return test_contains
+    elif operator == 'exists':
+        if value:
+            return lambda document: field in document
+        return lambda document: field not in document
+    # functions.filter matches nothing for an unknown operator
+    return lambda document: False
+
+def _compile(condition):
+    if not is_boolean(condition):
+        return _compile_comparison(*condition)
+    tag = condition[0]
+    tests = [_compile(child) for child in condition[1:]]
+    if tag == 'not':
+        test = tests[0]
+        return lambda document: not test(document)
+    if len(tests) == 2:
+        first, second = tests
+        if tag == 'and':
+            return lambda document: first(document) and second(document)
+        return lambda document: first(document) or second(document)
+    if tag == 'and':
+        return lambda document: all(test(document) for test in tests)
+    return lambda document: any(test(document) for test in tests)
+
+def compile_condition(condition, data=None):
+    # Compiles a condition once into a function of a document. Clauses are ordered by the selectivity estimated
+    # on data (see order_by_selectivity), so each document is decided with as few comparisons as possible.
+    return _compile(order_by_selectivity(normalize(condition), data))
+
+def conjuncts(condition):
+    # Returns the clauses that all have to hold: the children of a top-level 'and', or the condition itself
+    if is_boolean(condition) and condition[0] == 'and':
+        return list(condition[1:])
+    return [condition]
+
+def choose_access_path(data, condition):
+    # Picks how to read a Collection for a condition: among the top-level 'and' clauses, the comparison whose index
+    # lookup returns the fewest documents, else the first one a column can answer. Returns (positions, kind, residual,
+    # clause), where residual is what is left to check on those documents (None when nothing is) and clause is the
+    # comparison the positions answer. Without an access path, positions and clause are None, kind is 'scan' and
+    # residual is the whole condition.
+    clauses = conjuncts(condition)
+    best = None
+    if isinstance(data, Collection):
+        for i, clause in enumerate(clauses):
+            if is_boolean(clause):
+                continue
+            field, operator, _ = clause
+            if field not in data.hash_indexes and field not in data.sorted_indexes:
+                continue
+            positions, kind = _index_positions(data, *clause)
+            if kind.endswith('index') and (best is None or len(positions) < len(best[1])):
+                best = (i, positions, kind)
+        if best is None:
+            for i, clause in enumerate(clauses):
+                if not is_boolean(clause) and clause[0] in data.columns:
+                    positions, kind = _index_positions(data, *clause)
+                    if positions is not None:
+                        best = (i, positions, kind)
+                        break
+    if best is None:
+        return None, 'scan', condition, None
+
+    used, positions, kind = best
+    rest = clauses[:used] + clauses[used + 1:]
+    if not rest:
+        residual = None
+    elif len(rest) == 1:
+        residual = rest[0]
+    else:
+        residual = ('and',) + tuple(rest)
+    return positions, kind, residual, clauses[used]
+
+def select(data, condition):
+    # Returns the documents matching a condition in their original order, reading through an index or column when
+    # one applies and checking the rest of the condition with one compiled function
+    condition = normalize(condition)
+    positions, _, residual, _ = choose_access_path(data, condition)
+    source = data if positions is None else [data[position] for position in positions]
+    if residual is None:
+        return list(source)
+    test = compile_condition(residual, data)
+    return [document for document in source if test(document)]
+
+def format_condition(condition):
+    # Returns a condition as readable text, e.g. "rating >= 4.5 AND (price == '$' OR price == '$$')"
+    if not is_boolean(condition):
+        field, operator, value = condition
+        return f"{field} {operator} {value!r}"
+    if condition[0] == 'not':
+        child = condition[1]
+        text = format_condition(child)
+        return f"NOT ({text})" if is_boolean(child) else f"NOT {text}"
+    parts = []
+    for child in condition[1:]:
+        text = format_condition(child)
+        parts.append(f"({text})" if is_boolean(child) and child[0] != 'not' else text)
+    return f" {condition[0].upper()} ".join(parts)
@@ -0,0 +1,214 @@
+# DSCI 551 Final Project - Darren Parry
+
+import functools
+import threading
+import time
+import tracemalloc
+from collections.abc import Sized
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# The parser, the loaders, every operator in functions.py and Query record a call while a Profile is active:
+#   profile = start("Filter")      or      with profiling("Filter") as profile:
+#   ...                                         ...
+#   stop(profile)
+# Each call becomes one record: the operator, its wall time, the rows it was given and returned, and with memory=True
+# the peak bytes it allocated (measured with tracemalloc, which slows everything down while it is on).
+# The active Profile is kept in a ContextVar, so every app session records only its own calls. When no Profile is
+# active an instrumented function costs one ContextVar lookup per call. Running Profiles are also kept by the owner
+# passed to start (e.g. one app session), so clear(owner) reaches them from any thread.
+# tracemalloc is one for the whole process, so only one Profile at a time tracks memory; a Profile started with
+# memory=True while another one is tracking records times and rows only (its memory_busy is True).
+
+_active = ContextVar('profile', default=None)
+# Held by the Profile tracking memory
+_memory_lock = threading.Lock()
+# Profiles started and not yet stopped, as lists keyed by their owner
+_open = {}
+_open_lock = threading.Lock()
+
+def _size(value):
+    # The number of rows in a value, or None when it is not a collection of rows (a number, a stream, a string)
+    if isinstance(value, Sized) and not isinstance(value, (str, bytes)):
+        return len(value)
+    return None
+
+class Profile:
+    # The calls recorded for one query or page run, in the order they started. Nested calls (e.g. projection inside
+    # Query.execute) come right after their caller with a larger depth.
+    def __init__(self, label, memory=False):
+        self.label = label
+        self.memory = memory
+        self.records = []
+        self._stack = []
+        self.memory_busy = False
+        self._holds_memory = False
+        self._started_tracing = False
+        self._stopped = False
+
+    def enter(self, name, rows_in=None):
+        # Starts recording one call and returns what exit needs to finish it
+        record = {
+            'query': self.label,
+            'operator': name,
+            'depth': len(self._stack),
+            'seconds': None,
+            'rows_in': rows_in,
+            'rows_out': None,
+            'peak_bytes': None,
+        }
+        self.records.append(record)
+        frame = None
+        if self.memory:
+            # Every frame keeps [allocated bytes at its start, highest allocated bytes seen]. The peak is reset for
+            # each call, so the callers' peaks so far are saved into their frames first.
+            current, peak = tracemalloc.get_traced_memory()
+            for caller in self._stack:
+                if caller is not None:
+                    caller[1] = max(caller[1], peak)
+            tracemalloc.reset_peak()
+            frame = [current, current]
+        self._stack.append(frame)
+        return record, frame, time.perf_counter()
+
+    def exit(self, call, rows_out=None):
+        record, frame, started = call
+        record['seconds'] = time.perf_counter() - started
+        self._stack.pop()
+        if frame is not None:
+            frame[1] = max(frame[1], tracemalloc.get_traced_memory()[1])
+            for caller in self._stack:
+                if caller is not None:
+                    caller[1] = max(caller[1], frame[1])
+            record['peak_bytes'] = frame[1] - frame[0]
+        record['rows_out'] = rows_out
+
+    def call(self, name, function, args, kwargs, data_arg, result_rows):
+        # Runs one instrumented call and records it
+        rows_in = _size(args[data_arg]) if data_arg is not None and len(args) > data_arg else None
+        call = self.enter(name, rows_in)
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            self.exit(call)
+            raise
+        self.exit(call, result_rows(result) if result_rows is not None else None)
+        return result
+
+    def summary(self):
+        # One row per operator with its number of calls, total time and rows, most time first
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['operator'], {'operator': record['operator'], 'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0})
+            total['calls'] += 1
+            total['seconds'] += record['seconds'] or 0.0
+            total['rows_in'] += record['rows_in'] or 0
+            total['rows_out'] += record['rows_out'] or 0
+        return sorted(totals.values(), key=lambda total: -total['seconds'])
+
+    def to_jsonl(self):
+        # The records as JSON lines, one call per line. parser.py is instrumented itself, so it is imported here
+        # rather than at the top, which works whichever of the two modules is imported first.
+        from parser import dumps
+        return ''.join(dumps(record) + '\n' for record in self.records)
+
+def start(label, memory=False, owner=None):
+    # Makes a new Profile the active one for this session and returns it. owner is any hashable key clear() can
+    # stop it by later.
+    profile = Profile(label, memory)
+    if memory:
+        if _memory_lock.acquire(blocking=False):
+            profile._holds_memory = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                profile._started_tracing = True
+        else:
+            profile.memory = False
+            profile.memory_busy = True
+    profile._owner = owner
+    with _open_lock:
+        _open.setdefault(owner, []).append(profile)
+    profile._token = _active.set(profile)
+    return profile
+
+def _release_memory(profile):
+    # Stops tracemalloc if the Profile started it and lets another Profile track memory
+    if profile._holds_memory:
+        profile._holds_memory = False
+        if profile._started_tracing:
+            profile._started_tracing = False
+            tracemalloc.stop()
+        _memory_lock.release()
+
+def _close(profile):
+    # Marks a Profile stopped and forgets it, returning False when it was already stopped
+    with _open_lock:
+        if profile._stopped:
+            return False
+        profile._stopped = True
+        profiles = _open[profile._owner]
+        profiles.remove(profile)
+        if not profiles:
+            del _open[profile._owner]
+    _release_memory(profile)
+    return True
+
+def stop(profile):
+    # Ends a Profile started with start(), making the one before it active again. Stopping it again does nothing.
+    if _close(profile):
+        _active.reset(profile._token)
+    return profile
+
+@contextmanager
+def profiling(label, memory=False):
+    profile = start(label, memory)
+    try:
+        yield profile
+    finally:
+        stop(profile)
+
+def clear(owner=None):
+    # Stops every Profile of owner that is still running, whichever thread started it, e.g. when an app run ended
+    # before it could stop its Profile, and stops the memory tracking that Profile started
+    with _open_lock:
+        profiles = list(_open.get(owner, ()))
+    for profile in profiles:
+        _close(profile)
+    _active.set(None)
+
+def active():
+    # The Profile recording in this session, or None
+    return _active.get()
+
+def profiled(name, data_arg=0, result_rows=_size):
+    # Decorator recording every call of a function in the active Profile. data_arg is the position of the argument
+    # holding the input rows (None when there is none), and result_rows counts the rows of the return value (None
+    # when it is not rows).
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = _active.get()
+            if profile is None:
+                return function(*args, **kwargs)
+            return profile.call(name, function, args, kwargs, data_arg, result_rows)
+        return wrapper
+    return decorate
+
+@contextmanager
+def timed(name, rows=None):
+    # Records a block of code that is not one function, e.g. showing a page of results, with `rows` as its rows out
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    call = profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit(call, rows)
+
+def export_jsonl(profiles, path):
+    # Appends the records of several Profiles to a JSON lines file
+    with open(path, 'a') as f:
+        for profile in profiles:
+            f.write(profile.to_jsonl())
@@ -0,0 +1,347 @@
+# DSCI 551 Final Project - Darren Parry
+
+from functions import projection, group_aggregate, group_partials, merge_partials, finish_partials, order_by, top_k, AGGREGATE_FUNCTIONS
+import predicates
+from collection import Collection
+from cursor import ResultCursor
+from paths import compile_projection, is_path
+from profiling import profiled
+
+def _aggregate_fields(step):
+    # The fields a group_aggregate step reads: its keys and the fields of its non-count specs
+    _, keys, named_specs = step
+    return set(keys) | {field for _, function, field in named_specs if function != 'count'}
+
+def _step_condition(step):
+    # The condition a filter or where step keeps documents on
+    return step[1:] if step[0] == 'filter' else step[1]
+
+def _combine(conditions):
+    # Joins a stage's conditions with 'and', or returns None when there are none
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return predicates.normalize(conditions[0])
+    return predicates.normalize(('and',) + tuple(conditions))
+
+def _extends(path, field):
+    # True when a path reaches inside a field, e.g. 'location.city' inside 'location' or 'categories[].alias' inside
+    # 'categories'
+    return path.startswith(field + '.') or path.startswith(field + '[')
+
+def _merge_projections(earlier, later):
+    # The fields of one projection doing the same as projecting `earlier` and then `later`. Without paths that is the
+    # later fields the earlier one kept. With paths, a later field also survives when it reaches inside an earlier
+    # one ('location' then 'location.city'), and a later field an earlier path reaches inside keeps only that path
+    # ('location.city' then 'location').
+    if not any(is_path(field) for field in earlier + later):
+        return tuple(field for field in later if field in earlier)
+    fields = []
+    for field in later:
+        if field in earlier or any(_extends(field, kept) for kept in earlier):
+            fields.append(field)
+        else:
+            fields.extend(kept for kept in earlier if _extends(kept, field))
+    return tuple(dict.fromkeys(fields))
+
+def _new_stage():
+    return {'predicates': [], 'order': None, 'fields': None, 'aggregate': None}
+
+def _format_order(order, indexed_data):
+    # Describes an order_by step for explain(). indexed_data is the Collection the step reads directly, if any, to
+    # note when its sorted index gives the order without sorting.
+    fields, descending, limit = order
+    if not fields:
+        return f"first {limit}"
+    directions = descending if isinstance(descending, tuple) else (descending,) * len(fields)
+    keys = ", ".join(f"{field} {'desc' if reverse else 'asc'}" for field, reverse in zip(fields, directions))
+    text = f"order by {keys}" if limit is None else f"top {limit} by {keys}"
+    single_index = len(fields) == 1 and not isinstance(descending, tuple)
+    if isinstance(indexed_data, Collection) and single_index and fields[0] in indexed_data.sorted_indexes:
+        text += " (from sorted index)"
+    elif limit is not None:
+        text += " (bounded heap)"
+    return text
+
+class Query:
+    # A declarative pipeline over the functions.py operators. Each method returns a new Query with one more step, so a
+    # plan can be built once and run on any team. execute() first optimizes the steps:
+    #   - consecutive filters and a following projection run as one fused pass over the documents, with all the
+    #     filters compiled into one predicate whose clauses are ordered by selectivity (see predicates.py)
+    #   - projections are pushed down past filters on projected fields, so unused fields are never copied
+    #   - the filter clause an index or column answers best becomes the access path instead of a full scan
+    #   - a filter followed by group_aggregate streams the matching documents straight into the accumulators
+    #   - a top_k keeps only the best k rows in a bounded heap, and projections after it only copy those k rows
+    def __init__(self, steps=()):
+        self.steps = tuple(steps)
+
+    def filter(self, field, operator, value):
+        field, operator, value = predicates.normalize((field, operator, value))
+        return Query(self.steps + (('filter', field, operator, value),))
+
+    def where(self, condition):
+        # Filters on a compound condition such as ('and', ('rating', '>=', 4.5), ('price', '==', '$$'))
+        return Query(self.steps + (('where', predicates.normalize(condition)),))
+
+    def project(self, fields):
+        return Query(self.steps + (('project', tuple(fields)),))
+
+    def group_aggregate(self, keys, specs):
+        # Same arguments as functions.group_aggregate; the specs are stored as (name, function, field) triples
+        keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        if isinstance(specs, dict):
+            named_specs = tuple((name, function, field) for name, (function, field) in specs.items())
+        else:
+            named_specs = tuple((f"{function}_{field}", function, field) for function, field in specs)
+        for _, function, _ in named_specs:
+            if function not in AGGREGATE_FUNCTIONS:
+                raise ValueError(f"Unknown aggregate function: {function}")
+        return Query(self.steps + (('group_aggregate', keys, named_specs),))
+
+    def order_by(self, fields, descending=False, limit=None):
+        # Sorts on one or more fields like functions.order_by, keeping only the first `limit` rows when it is given
+        fields = (fields,) if isinstance(fields, str) else tuple(fields)
+        if isinstance(descending, (list, tuple)):
+            descending = tuple(descending)
+            if len(descending) != len(fields):
+                raise ValueError("descending needs one value per sort field")
+        return Query(self.steps + (('order_by', fields, descending, limit),))
+
+    def top_k(self, fields, k, descending=True):
+        # The first k rows by the given fields, like functions.top_k; with no fields, the first k rows
+        return self.order_by(fields, descending, k)
+
+    def key(self):
+        # A hashable description of the logical steps, equal for equal queries
+        return self.steps
+
+    def normalized_key(self):
+        # A hashable description of what the query computes, equal for queries that only differ in how they are
+        # written: the optimized stages, with each stage's filters combined into one canonical condition
+        stages = []
+        for stage in self.optimize():
+            condition = _combine(stage['predicates'])
+            if condition is not None:
+                condition = predicates.canonical(condition)
+            stages.append((condition, stage['order'], stage['fields'], stage['aggregate']))
+        return tuple(stages)
+
+    def __eq__(self, other):
+        return isinstance(other, Query) and self.steps == other.steps
+
+    def __hash__(self):
+        return hash(self.steps)
+
+    def __repr__(self):
+        return f"Query({list(self.steps)!r})"
+
+    def optimize(self):
+        # Rewrites the logical steps into stages. Each stage is a dict with the conditions it filters on, the fields it
+        # projects (None keeps whole documents) and an optional group_aggregate, all run in one pass.
+        steps = list(self.steps)
+
+        # Push projections down past filters on fields they keep, and merge projections that end up next to each other
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(steps) - 1):
+                step, following = steps[i], steps[i + 1]
+                if step[0] == 'project' and following[0] in ('filter', 'where') and predicates.condition_fields(_step_condition(following)) <= set(step[1]):
+                    steps[i], steps[i + 1] = following, step
+                    changed = True
+                elif step[0] == 'project' and following[0] == 'order_by' and set(following[1]) <= set(step[1]):
+                    # Sorting before the projection means a top_k only projects the rows it keeps
+                    steps[i], steps[i + 1] = following, step
+                    changed = True
+                elif step[0] == 'project' and following[0] == 'project':
+                    steps[i:i + 2] = [('project', _merge_projections(tuple(step[1]), tuple(following[1])))]
+                    changed = True
+                    break
+                elif step[0] == 'project' and following[0] == 'group_aggregate' and _aggregate_fields(following) <= set(step[1]):
+                    # The aggregate reads documents in place, so a projection that keeps every field it reads only costs copies
+                    del steps[i]
+                    changed = True
+                    break
+
+        stages = []
+        stage = _new_stage()
+        for step in steps:
+            # A stage ends with its projection or aggregate; anything after that runs on its output. Filters run before
+            # the stage's order_by, so a filter after a limited order_by, or a second order_by, also starts a new stage.
+            order = stage['order']
+            limited = order is not None and order[2] is not None
+            if stage['fields'] is not None or stage['aggregate'] is not None or (order is not None and step[0] == 'order_by') \
+                    or (limited and step[0] in ('filter', 'where')):
+                stages.append(stage)
+                stage = _new_stage()
+            if step[0] in ('filter', 'where'):
+                stage['predicates'].append(_step_condition(step))
+            elif step[0] == 'order_by':
+                stage['order'] = step[1:]
+            elif step[0] == 'project':
+                stage['fields'] = step[1]
+            else:
+                stage['aggregate'] = step[1:]
+        stages.append(stage)
+        return stages
+
+    def _read_stage(self, number, rows, condition):
+        # Decides how a stage reads its input: the first stage may use an index or column of a loaded team, later
+        # stages scan the previous output. Returns (positions or None, kind, residual condition, clause the positions
+        # answer or None).
+        if number == 0 and condition is not None:
+            return predicates.choose_access_path(rows, condition)
+        return None, 'scan', condition, None
+
+    def _matching(self, number, stage, rows):
+        # The documents of a stage's input that pass its filters, read through the stage's access path
+        positions, _, residual, _ = self._read_stage(number, rows, _combine(stage['predicates']))
+        source = rows if positions is None else [rows[position] for position in positions]
+        if residual is None:
+            return source
+        test = predicates.compile_condition(residual, rows)
+        return (document for document in source if test(document))
+
+    def _finish(self, stage, matching):
+        # Runs a stage's order_by and then its aggregate or projection on the matching documents, returning a list
+        if stage['order'] is not None:
+            fields, descending, limit = stage['order']
+            if limit is None:
+                matching = order_by(matching, fields, descending)
+            else:
+                matching = top_k(matching, fields, limit, descending)
+
+        if stage['aggregate'] is not None:
+            keys, named_specs = stage['aggregate']
+            return group_aggregate(matching, list(keys), {name: (function, field) for name, function, field in named_specs})
+        elif stage['fields'] is not None:
+            return projection(matching, stage['fields'])
+        return matching if type(matching) is list else list(matching)
+
+    @profiled('Query.execute', data_arg=1)
+    def execute(self, data, counters=None):
+        # Runs the optimized plan on the data and returns the final rows. When a counters dict is passed, it receives
+        # 'filtered': how many documents passed the first stage's filters.
+        rows = data
+        for number, stage in enumerate(self.optimize()):
+            matching = self._matching(number, stage, rows)
+            if counters is not None and number == 0:
+                if not isinstance(matching, list):
+                    matching = list(matching)
+                counters['filtered'] = len(matching)
+            rows = self._finish(stage, matching)
+        return rows
+
+    def _last_stage_input(self, data):
+        # Runs every stage but the last and returns (last stage number, last stage, its input rows)
+        stages = self.optimize()
+        rows = data
+        for number, stage in enumerate(stages[:-1]):
+            rows = self._finish(stage, self._matching(number, stage, rows))
+        return len(stages) - 1, stages[-1], rows
+
+    def iterate(self, data):
+        # Like execute, but returns an iterator that produces the final rows one at a time as they are read. Only a
+        # last stage that sorts or aggregates needs all of its input first; filtering and projecting are done per row.
+        number, stage, rows = self._last_stage_input(data)
+        if stage['order'] is not None or stage['aggregate'] is not None:
+            return iter(self._finish(stage, self._matching(number, stage, rows)))
+        matching = self._matching(number, stage, rows)
+        if stage['fields'] is None:
+            return iter(matching)
+        project = compile_projection(stage['fields'])
+        return (project(document) for document in matching)
+
+    @profiled('Query.count', data_arg=1, result_rows=None)
+    def count(self, data):
+        # Returns how many rows execute would return, without projecting or sorting the last stage's rows
+        number, stage, rows = self._last_stage_input(data)
+        if stage['aggregate'] is not None:
+            return len(self._finish(stage, self._matching(number, stage, rows)))
+        matching = self._matching(number, stage, rows)
+        total = len(matching) if isinstance(matching, list) else sum(1 for _ in matching)
+        if stage['order'] is not None and stage['order'][2] is not None:
+            total = min(total, stage['order'][2])
+        return total
+
+    def cursor(self, data):
+        # A ResultCursor over the rows, producing only the pages that are shown (see cursor.py)
+        return ResultCursor(self.iterate(data), lambda: self.count(data))
+
+    @profiled('Query.run_partial', data_arg=1, result_rows=lambda result: len(result[1]))
+    def run_partial(self, data):
+        # Runs one dataset's share of a fan-out over many datasets (see fanout.py): the first stage, stopped where the
+        # datasets' results still have to be combined. Returns (kind, payload, filtered), where kind is 'partials'
+        # with group accumulators when the stage aggregates, or 'rows' with the rows that can still be in the combined
+        # result (a top_k keeps its best k, which hold the combined best k), keeping the fields a final sort needs.
+        # filtered is how many documents passed the stage's filters.
+        stage = self.optimize()[0]
+        matching = self._matching(0, stage, data)
+        if not isinstance(matching, list):
+            matching = list(matching)
+        filtered = len(matching)
+
+        order = stage['order']
+        limited = order is not None and order[2] is not None
+        if stage['aggregate'] is not None and not limited:
+            keys, named_specs = stage['aggregate']
+            specs = {name: (function, field) for name, function, field in named_specs}
+            return 'partials', group_partials(matching, list(keys), specs), filtered
+        if limited:
+            matching = top_k(matching, order[0], order[2], order[1])
+        if stage['aggregate'] is None and stage['fields'] is not None:
+            sort_fields = order[0] if order is not None else ()
+            fields = stage['fields'] + tuple(field for field in sort_fields if field not in stage['fields'])
+            return 'rows', projection(matching, fields), filtered
+        return 'rows', list(matching), filtered
+
+    @profiled('Query.combine_partials', data_arg=1)
+    def combine_partials(self, shares, keep_fields=()):
+        # Finishes a fan-out from the (kind, payload) shares run_partial returned for every dataset: merges the group
+        # accumulators (so an avg is the total sum over the total count) or finishes the first stage on the combined
+        # rows, then runs the rest of the plan. keep_fields (e.g. the team tags fanout.py adds) survive the projection.
+        stages = self.optimize()
+        stage = stages[0]
+        partials = [payload for kind, payload in shares if kind == 'partials']
+        if partials:
+            rows = finish_partials(merge_partials(partials))
+        else:
+            rows = [row for _, payload in shares for row in payload]
+            fields = stage['fields']
+            if fields is not None and stage['aggregate'] is None:
+                fields = tuple(keep_fields) + tuple(field for field in fields if field not in keep_fields)
+            combined = {'predicates': [], 'order': stage['order'], 'fields': fields, 'aggregate': stage['aggregate']}
+            rows = self._finish(combined, rows)
+        for number, later in enumerate(stages[1:], 1):
+            rows = self._finish(later, self._matching(number, later, rows))
+        return rows
+
+    def explain(self, data=None):
+        # Returns a readable description of the optimized plan, including the access path chosen for the data and the
+        # order the filter clauses are checked in
+        lines = [f"Logical: {' -> '.join(step[0] for step in self.steps) or 'scan'}"]
+        for number, stage in enumerate(self.optimize()):
+            positions, kind, residual, used = self._read_stage(number, data, _combine(stage['predicates']))
+            if positions is not None:
+                lines.append(f"{number + 1}. {kind.capitalize()} lookup on {predicates.format_condition(used)} ({len(positions)} of {len(data)} documents)")
+            elif number == 0:
+                size = f" ({len(data)} documents)" if data is not None and hasattr(data, '__len__') else ""
+                lines.append(f"{number + 1}. Full scan{size}")
+            else:
+                lines.append(f"{number + 1}. Scan previous stage output")
+
+            operations = []
+            if residual is not None:
+                ordered = predicates.order_by_selectivity(residual, data if number == 0 else None)
+                operations.append(f"filter {predicates.format_condition(ordered)}")
+            if stage['order'] is not None:
+                reads_data = number == 0 and positions is None and residual is None
+                operations.append(_format_order(stage['order'], data if reads_data else None))
+            if stage['aggregate'] is not None:
+                keys, named_specs = stage['aggregate']
+                operations.append(f"group_aggregate by {', '.join(keys)}: " + ", ".join(f"{name}={function}({field or ''})" for name, function, field in named_specs))
+            elif stage['fields'] is not None:
+                operations.append(f"project {', '.join(stage['fields'])}")
+            if operations:
+                lines.append("   fused pass: " + " -> ".join(operations))
+        return "\n".join(lines)
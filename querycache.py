@@ -0,0 +1,146 @@
+# DSCI 551 Final Project - Darren Parry
+
+import sys
+import threading
+from collections import OrderedDict
+
+from cursor import ResultCursor
+from records import Record
+
+def estimate_size(value):
+    # Rough number of bytes a result row takes: the objects themselves plus everything nested in them
+    size = sys.getsizeof(value)
+    if type(value) is dict:
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    elif type(value) is Record:
+        # Its field names are shared with every record of the same shape
+        for item in value.values():
+            size += estimate_size(item)
+    elif type(value) in (list, tuple):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+def data_version(data):
+    # The version stamp of a loaded team (see Collection.version), or None for data that has none and is not cached
+    return getattr(data, 'version', None)
+
+class _Entry:
+    __slots__ = ('source', 'version', 'cursor', 'counted', 'size')
+
+    def __init__(self, source, version, cursor):
+        self.source = source
+        self.version = version
+        self.cursor = cursor
+        # Rows already added to size, so each row is only measured once as the cursor produces more of them
+        self.counted = 0
+        self.size = 0
+
+class QueryCache:
+    # Memoizes query results as ResultCursors, shared by every app session. An entry is keyed by its source (the team
+    # or teams it read) and a normalized description of the query (see Query.normalized_key), and remembers the
+    # version of the data it was computed from. When a team is loaded again its version changes, and every entry
+    # made from the old copy is dropped the next time that team is queried.
+    # A cached Query.cursor produces its rows from the team as pages are shown, so it keeps the team in memory. The
+    # lazy loader calls drop_team when it evicts a team (see LazyTeamData's on_evict), so the cache never keeps alive
+    # teams the loader let go of.
+    # The least recently used entries are evicted once there are more than max_entries or their rows take more than
+    # max_bytes. Rows are measured as the cursors produce them, so the accounting follows the pages actually shown.
+    def __init__(self, max_entries=64, max_bytes=64 * 1024 * 1024):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_run(self, source, version, query_key, run):
+        # Returns the cached cursor for the query on this version of the source, or runs it and caches the result.
+        # run returns a ResultCursor or a list of rows. Without a version the result is not cached.
+        if version is None:
+            result = run()
+            return result if isinstance(result, ResultCursor) else ResultCursor(result)
+
+        key = (source, query_key)
+        with self._lock:
+            self._drop_stale(source, version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.cursor
+            self.misses += 1
+
+        # Queries run outside the lock so one slow query does not hold up every other session
+        result = run()
+        cursor = result if isinstance(result, ResultCursor) else ResultCursor(result)
+        with self._lock:
+            self._entries[key] = _Entry(source, version, cursor)
+            self._entries.move_to_end(key)
+            self._trim()
+        return cursor
+
+    def cursor(self, source, data, plan):
+        # A cached Query.cursor for a plan run on one loaded team
+        return self.get_or_run(source, data_version(data), ('query', plan.normalized_key()), lambda: plan.cursor(data))
+
+    def _drop_stale(self, source, version):
+        # Removes the entries computed from another version of this source
+        stale = [key for key, entry in self._entries.items() if entry.source == source and entry.version != version]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+
+    def _entry_size(self, entry):
+        rows = entry.cursor.rows
+        if len(rows) > entry.counted:
+            entry.size += sum(estimate_size(row) for row in rows[entry.counted:])
+            entry.counted = len(rows)
+        return entry.size
+
+    def _trim(self):
+        # Evicts the least recently used entries until the cache is within both limits, always keeping the newest one
+        while len(self._entries) > 1:
+            too_many = len(self._entries) > self.max_entries
+            if not too_many and sum(self._entry_size(entry) for entry in self._entries.values()) <= self.max_bytes:
+                break
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def trim(self):
+        # Re-measures the entries after their cursors produced more rows, evicting any that no longer fit
+        with self._lock:
+            self._trim()
+
+    def invalidate(self, source=None):
+        # Drops the entries of one source, or every entry
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if source is None or entry.source == source]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def drop_team(self, team):
+        # Drops every entry that read one team, including the joins and other results of several teams it is part of
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.source == team or (isinstance(entry.source, tuple) and team in entry.source)]
+            for key in keys:
+                del self._entries[key]
+            self.evictions += len(keys)
+
+    def stats(self):
+        # Returns the hit, miss, eviction and invalidation counters along with the number of entries and their size
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(self._entry_size(entry) for entry in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
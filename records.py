@@ -0,0 +1,158 @@
+# DSCI 551 Final Project - Darren Parry
+
+import sys
+from collections.abc import Mapping
+
+# Compact records keep a team's businesses in far less memory than the dicts the parser makes. Every business has
+# nearly the same fields in the same order, so a Record holds only a tuple of values and shares one Shape (the field
+# names and where each one is in the tuple) with every object laid out the same way. The parser also makes a new
+# string for every key and value it reads, so a compacted team keeps one copy of each field name (sys.intern) and of
+# each repeated short value such as a city, a price or a category title, and identical nested objects and arrays of
+# strings, like {'alias': 'pizza', 'title': 'Pizza'} or ['delivery', 'pickup'], are one shared object.
+# Records are read-only mappings: every function in functions.py reads them like dicts (paths.py walks nested Records
+# like nested dicts), and writes replace a business with a new dict (see oplog.py) instead of changing it.
+
+# Longest string value that is shared between businesses; longer ones (urls, ids) are nearly always unique
+MAX_SHARED_LENGTH = 40
+
+# Field names -> Shape, shared by every team
+_shapes = {}
+
+class Shape:
+    # The field names of a record layout and the slot of each one in a Record's values
+    __slots__ = ('keys', 'slots')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.slots = {key: slot for slot, key in enumerate(keys)}
+
+def shape_of(keys):
+    # The shared Shape of a tuple of field names
+    shape = _shapes.get(keys)
+    if shape is None:
+        shape = _shapes.setdefault(keys, Shape(keys))
+    return shape
+
+class Record(Mapping):
+    # A read-only JSON object (a business or one of its nested objects): a Shape and a tuple of values. It supports the
+    # mapping access the functions use (record[key], get, in, keys, items, iteration, len, ==), and copy() returns a
+    # dict, so code that copies a business to change it keeps working.
+    __slots__ = ('_shape', '_values')
+
+    def __init__(self, shape, values):
+        self._shape = shape
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._shape.slots[key]]
+
+    def get(self, key, default=None):
+        slot = self._shape.slots.get(key)
+        return default if slot is None else self._values[slot]
+
+    def __contains__(self, key):
+        return key in self._shape.slots
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def copy(self):
+        return dict(zip(self._shape.keys, self._values))
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def __reduce__(self):
+        # Pickled (to and from worker processes) as its field names and values. Pickle writes an object used several
+        # times only once, so the shared names and values stay shared in the process that unpickles it.
+        return _restore, (self._shape.keys, self._values)
+
+def _restore(keys, values):
+    return Record(shape_of(keys), values)
+
+# The types a JSON object can be held in
+OBJECT_TYPES = (dict, Record)
+
+def plain(value):
+    # A value with its Records turned back into dicts, for marshal, which only takes the built-in types
+    kind = type(value)
+    if kind is Record or kind is dict:
+        return {key: plain(item) for key, item in value.items()}
+    if kind is list:
+        return [plain(item) for item in value]
+    return value
+
+class Interner:
+    # Turns parsed businesses into Records, sharing field names, repeated values and identical nested objects between
+    # them. The tables only live as long as the Interner, so one is used per team load and nothing is kept afterwards.
+    def __init__(self):
+        self.strings = {}
+        self.floats = {}
+        # Key -> the shared nested object or array, and the key of every shared one by id
+        self.shared = {}
+        self.keys = {}
+
+    def value(self, value):
+        kind = type(value)
+        if kind is str:
+            if len(value) > MAX_SHARED_LENGTH:
+                return value
+            return self.strings.setdefault(value, value)
+        if kind is float:
+            # 0.0 and -0.0 are equal but kept apart
+            if value == 0:
+                return value
+            return self.floats.setdefault(value, value)
+        if kind is dict or kind is list:
+            return self.nested(value)
+        return value
+
+    def _key(self, items):
+        # A hashable stand-in for values made only of strings, None and shared objects, or None for any other values
+        key = []
+        for item in items:
+            if item is None or type(item) is str:
+                key.append(item)
+            else:
+                shared_key = self.keys.get(id(item))
+                if shared_key is None:
+                    return None
+                key.append(shared_key)
+        return tuple(key)
+
+    def nested(self, value):
+        # A nested object as a Record, or an array as a list, shared with an identical one seen before when possible
+        if type(value) is dict:
+            keys = tuple(sys.intern(key) for key in value)
+            items = tuple(self.value(item) for item in value.values())
+            key = self._key(items)
+            if key is None:
+                return Record(shape_of(keys), items)
+            key = ('object', keys, key)
+        else:
+            items = [self.value(item) for item in value]
+            key = self._key(items)
+            if key is None:
+                return items
+            key = ('array', key)
+        shared = self.shared.get(key)
+        if shared is None:
+            shared = Record(shape_of(key[1]), items) if key[0] == 'object' else items
+            self.shared[key] = shared
+            self.keys[id(shared)] = key
+        return shared
+
+    def record(self, document):
+        # A business as a Record; anything that is not a dict is returned as it is
+        if type(document) is not dict:
+            return document
+        shape = shape_of(tuple(sys.intern(key) for key in document))
+        return Record(shape, tuple(self.value(item) for item in document.values()))
+
+def compact_documents(documents):
+    # The businesses of one team as Records
+    interner = Interner()
+    return [interner.record(document) for document in documents]
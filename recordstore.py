@@ -0,0 +1,209 @@
+# DSCI 551 Final Project - Darren Parry
+
+import argparse
+import marshal
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections.abc import Mapping, Sequence
+
+from collection import new_version
+from loader import list_team_files, load_team_data, directory_version
+from snapshot import SnapshotCache
+from profiling import profiled
+
+# A record store keeps every business of a data directory in one file that is opened with mmap, so a team's businesses
+# are only decoded when they are read and the operating system pages the file in and out instead of Python holding
+# every team as dicts. Layout:
+#   MAGIC
+#   one record per business: a 4-byte length followed by the marshal-encoded document
+#   the footer: a marshal-encoded dict with the format version, the stamps of the source files, every team's header
+#     and record offsets (an array of 8-byte offsets in business order) and the id index
+#   the footer's offset and length, 8 bytes each
+MAGIC = b'MLBSTORE'
+FORMAT_VERSION = 1
+STORE_DIR_NAME = '.records'
+STORE_FILE_NAME = 'teams.store'
+_LENGTH = struct.Struct('<I')
+_TRAILER = struct.Struct('<QQ')
+
+def store_path(directory):
+    # Where the record store of a data directory lives
+    return os.path.join(directory, STORE_DIR_NAME, STORE_FILE_NAME)
+
+@profiled('build_store', data_arg=None, result_rows=None)
+def build_store(directory, path=None, cache=None, on_error=None):
+    # Writes the record store of every team file in a directory, with their operation logs applied, and returns its path
+    path = path or store_path(directory)
+    # Stamped before reading, so a file changed while the store is built makes it stale
+    sources = directory_version(directory)
+    teams = {}
+    ids = {}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + f'.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        for filename in list_team_files(directory):
+            data, error = load_team_data(os.path.join(directory, filename), cache)
+            if error is not None:
+                if on_error is not None:
+                    on_error(error)
+                continue
+            if not isinstance(data, list):
+                teams[filename] = (data, None)
+                continue
+            offsets = array('Q')
+            for position, document in enumerate(data):
+                record = marshal.dumps(document)
+                f.write(_LENGTH.pack(len(record)))
+                f.write(record)
+                offsets.append(offset)
+                offset += _LENGTH.size + len(record)
+                business_id = document.get('id')
+                if business_id is not None:
+                    ids.setdefault(business_id, []).append((filename, position))
+            teams[filename] = (data.header, offsets.tobytes())
+        footer = marshal.dumps({
+            'format': FORMAT_VERSION,
+            'version': new_version(),
+            'sources': sources,
+            'teams': teams,
+            'ids': ids,
+        })
+        f.write(footer)
+        f.write(_TRAILER.pack(offset, len(footer)))
+    os.replace(temp_path, path)
+    return path
+
+class RecordList(Sequence):
+    # One team's businesses in a record store. It reads like the team's list (len, indexing, slicing, iteration),
+    # so every function in functions.py and every Query runs on it, but each business is decoded from the mapped file
+    # when it is read and nothing decoded is kept.
+    def __init__(self, store, filename, header, offsets):
+        self.store = store
+        self.filename = filename
+        self.header = header
+        self.offsets = offsets
+        # Results cached for the team are kept until the store is rebuilt (see querycache.data_version)
+        self.version = store.version
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.record(offset) for offset in self.offsets[index]]
+        return self.store.record(self.offsets[index])
+
+    def __iter__(self):
+        record = self.store.record
+        for offset in self.offsets:
+            yield record(offset)
+
+    def position_of(self, business_id):
+        # Returns the position of the business with this id from the store's id index, or None
+        for filename, position in self.store.ids.get(business_id, ()):
+            if filename == self.filename:
+                return position
+        return None
+
+class RecordStore(Mapping):
+    # A read-only mapping from team file name to its RecordList (or to its whole document when the file has no
+    # businesses list), the same shape as the loader's team data. Opening only reads the footer.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:len(MAGIC)] != MAGIC or len(self._map) < len(MAGIC) + _TRAILER.size:
+                raise ValueError(f"Not a record store: {path}")
+            footer_offset, footer_length = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+            footer = marshal.loads(self._map[footer_offset:footer_offset + footer_length])
+        except Exception:
+            self.close()
+            raise
+        if footer['format'] != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Record store format {footer['format']} is not {FORMAT_VERSION}")
+        self.version = footer['version']
+        self.sources = footer['sources']
+        # Business id -> [(file name, position)]; an id can be in several teams
+        self.ids = footer['ids']
+        self.teams = {}
+        for filename, (header, offsets) in footer['teams'].items():
+            if offsets is None:
+                self.teams[filename] = header
+            else:
+                positions = array('Q')
+                positions.frombytes(offsets)
+                self.teams[filename] = RecordList(self, filename, header, positions)
+
+    def record(self, offset):
+        # Decodes the business stored at an offset
+        length, = _LENGTH.unpack_from(self._map, offset)
+        start = offset + _LENGTH.size
+        return marshal.loads(self._map[start:start + length])
+
+    def find(self, business_id):
+        # Returns (file name, business) for every team that has a business with this id
+        return [(filename, self.teams[filename][position]) for filename, position in self.ids.get(business_id, ())]
+
+    def is_fresh(self, directory):
+        # True when no team file or operation log in the directory changed since the store was built
+        return self.sources == directory_version(directory)
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __getitem__(self, filename):
+        return self.teams[filename]
+
+    def __iter__(self):
+        return iter(self.teams)
+
+    def __len__(self):
+        return len(self.teams)
+
+@profiled('open_store', data_arg=None)
+def open_store(directory, cache=None, on_error=None):
+    # Opens the record store of a data directory, building it first when it is missing, unreadable or stale
+    path = store_path(directory)
+    try:
+        store = RecordStore(path)
+        if store.is_fresh(directory):
+            return store
+        store.close()
+    except (FileNotFoundError, ValueError, EOFError, struct.error, KeyError, TypeError):
+        pass
+    build_store(directory, path, cache, on_error)
+    return RecordStore(path)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Record store tools for the MLB restaurant data")
+    arg_parser.add_argument('--data', default='data', help="Directory containing the team JSON files")
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="Build the record store from the team files")
+    subparsers.add_parser('info', help="Show the size of the record store and how long it takes to open")
+
+    args = arg_parser.parse_args()
+    if args.command == 'build':
+        start = time.perf_counter()
+        path = build_store(args.data, cache=SnapshotCache(), on_error=print)
+        print(f"Built {path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    elif args.command == 'info':
+        start = time.perf_counter()
+        store = RecordStore(store_path(args.data))
+        opened = time.perf_counter() - start
+        businesses = sum(len(team) for team in store.values() if isinstance(team, RecordList))
+        print(f"{store.path}: {os.path.getsize(store.path) / (1024 * 1024):.1f} MB, {len(store)} teams, {businesses} businesses")
+        print(f"Opened in {opened * 1000:.1f} ms, {'fresh' if store.is_fresh(args.data) else 'stale'}")
+        store.close()
+
+if __name__ == '__main__':
+    main()
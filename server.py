@@ -0,0 +1,241 @@
+# DSCI 551 Final Project - Darren Parry
+
+import argparse
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import blake2b
+from urllib.parse import urlsplit
+
+from cursor import ResultCursor
+from fanout import run_all_teams
+from loader import LazyTeamData, list_team_files, file_version
+from parser import SimpleJSONParser, dumps
+from query import Query
+from querycache import QueryCache
+from snapshot import SnapshotCache
+
+# A query service in front of the parser and the functions.py operators, so the teams are loaded once for every user
+# and queries can be sent by any program, not only the Streamlit app. Every request is one HTTP call that closes when
+# answered, and the API is JSON:
+#   GET  /health     {"status": "ok", "workers": ..., "cache": {...}}
+#   GET  /teams      {"teams": [team file names]}
+#   POST /query      {"queries": [{"team": "Chicago_Cubs_restaurants.json", "steps": [["filter", "rating", ">=", 4.0]],
+#                                  "by_team": false, "offset": 0, "limit": 25, "version": null}, ...]}
+#                    {"results": [{"rows": [...], "total": 312, "filtered": 312, "offset": 0, "version": "..."},
+#                                 {"error": "..."}, ...]}
+# "steps" are the steps of a Query (Query.steps), "team" may also be "All teams" to query every team at once (see
+# fanout.py), and offset/limit pick the page of rows to send back. The queries of a batch run at the same time.
+# "version" in a result names the data it was computed from. Sending it back with a request for a later page makes
+# the server answer with an error instead of rows from other data when the team was written to in between.
+# Queries run on a pool of worker processes that each keep their own lazily loaded teams, so a slow query only holds
+# up one worker while the event loop keeps answering. Results are cached in the server by the version of the files
+# they read, so repeated queries and the later pages of a result never reach the workers.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8551
+ALL_TEAMS = "All teams"
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# The teams of a worker process, set up by init_worker
+_worker = {}
+
+def init_worker(directory, max_teams, cache, compact_records=False):
+    # Runs once in every worker process (and in the server itself when it has no workers)
+    _worker['directory'] = directory
+    _worker['cache'] = cache
+    _worker['teams'] = LazyTeamData(directory, max_teams, cache, compact_records=compact_records)
+    # File name -> the file_version its loaded copy was read at
+    _worker['versions'] = {}
+
+def _fresh_team(filename, version):
+    # A worker's copy of a team, loaded again first when its file or log changed since it was loaded
+    teams = _worker['teams']
+    if _worker['versions'].get(filename) != version:
+        teams.invalidate(filename)
+        _worker['versions'][filename] = version
+    return teams[filename]
+
+def execute_query(team, version, steps, by_team):
+    # Worker entry point: runs a Query's steps on one team (or on every team) and returns (rows, filtered)
+    plan = Query(steps)
+    counters = {}
+    if team == ALL_TEAMS:
+        teams = _worker['teams']
+        directory = _worker['directory']
+        loaded = {}
+        for filename in teams.loaded_teams():
+            loaded[filename] = _fresh_team(filename, file_version(os.path.join(directory, filename)))
+        rows = run_all_teams(plan, directory, by_team, workers=1, cache=_worker['cache'], loaded=loaded, counters=counters)
+    else:
+        data = _fresh_team(team, version)
+        if data is None:
+            raise ValueError(f"Could not load {team}")
+        rows = plan.execute(data, counters)
+    return rows, counters.get('filtered')
+
+def _as_tuples(value):
+    # JSON arrays as tuples, the way Query keeps its steps
+    if isinstance(value, list):
+        return tuple(_as_tuples(item) for item in value)
+    return value
+
+def version_tag(version):
+    # A short string standing for a file_version (or the versions of every team), sent to clients with each result
+    return blake2b(repr(version).encode('utf-8'), digest_size=12).hexdigest()
+
+def _error(message):
+    # An error result; our JSON writer keeps strings as they are, so double quotes are swapped for single ones
+    return {'error': str(message).replace('"', "'")}
+
+class QueryServer:
+    # The shared state behind the HTTP API: the result cache, the worker pool and the threads waiting on it
+    def __init__(self, directory='data', workers=None, max_teams=8, cache=None, max_cached_queries=256, max_cached_bytes=256 * 1024 * 1024, compact_records=False):
+        self.directory = directory
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.cache = cache
+        self.query_cache = QueryCache(max_cached_queries, max_cached_bytes)
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(directory, max_teams, cache, compact_records))
+        else:
+            # No worker processes: queries run in this process's threads instead
+            self.pool = None
+            init_worker(directory, max_teams, cache, compact_records)
+        # Each query in flight waits for its worker (or the cache) in one of these threads, off the event loop
+        self.threads = ThreadPoolExecutor(max(8, 4 * self.workers), thread_name_prefix='query')
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        self.threads.shutdown(cancel_futures=True)
+
+    def teams(self):
+        return list_team_files(self.directory)
+
+    def version(self, team):
+        # The version of the files a query on a team reads, which keys its cached results
+        if team == ALL_TEAMS:
+            version = ()
+            for filename in self.teams():
+                version += file_version(os.path.join(self.directory, filename))
+            return version
+        return file_version(os.path.join(self.directory, team))
+
+    def results(self, team, steps, by_team, expected_version=None):
+        # The cursor of one query and the version_tag of the data it read, from the cache or from a worker. With an
+        # expected_version, fails when the data is no longer at that version. Runs in one of the server's threads.
+        if team != ALL_TEAMS and team not in self.teams():
+            raise KeyError(f"Unknown team: {team}")
+        plan = Query(steps)
+        version = self.version(team)
+        tag = version_tag(version)
+        if expected_version is not None and expected_version != tag:
+            raise ValueError(f"{team} changed since the first page of this result was sent; run the query again")
+
+        def run():
+            if self.pool is None:
+                rows, filtered = execute_query(team, version, plan.steps, by_team)
+            else:
+                rows, filtered = self.pool.submit(execute_query, team, version, plan.steps, by_team).result()
+            return ResultCursor(rows, notes={'filtered': filtered})
+        return self.query_cache.get_or_run(team, version, (by_team, plan.normalized_key()), run), tag
+
+    async def run_query(self, request):
+        # Answers one query of a batch with its page of rows, or with the error it raised
+        if not isinstance(request, dict):
+            return _error("A query has to be a JSON object")
+        try:
+            offset = int(request.get('offset') or 0)
+            limit = request.get('limit')
+            limit = None if limit is None else int(limit)
+            steps = _as_tuples(request.get('steps') or [])
+            loop = asyncio.get_running_loop()
+            cursor, tag = await loop.run_in_executor(self.threads, self.results, request.get('team'), steps, bool(request.get('by_team')), request.get('version'))
+            rows = cursor.rows[offset:] if limit is None else cursor.rows[offset:offset + limit]
+            result = {'rows': rows, 'total': cursor.total(), 'filtered': cursor.notes.get('filtered'), 'offset': offset, 'version': tag}
+            # Checked here so a row the JSON writer cannot write fails this query instead of the whole batch
+            dumps(result)
+            return result
+        except Exception as e:
+            return _error(f"{type(e).__name__}: {e}")
+
+    async def route(self, method, path, body):
+        # Returns (status, payload) for one request
+        if path == '/health':
+            return 200, {'status': 'ok', 'workers': self.workers, 'cache': self.query_cache.stats()}
+        if path == '/teams':
+            return 200, {'teams': self.teams()}
+        if path == '/query':
+            if method != 'POST':
+                return 405, _error("Send queries with POST")
+            try:
+                batch = SimpleJSONParser().parse(body.decode('utf-8'))
+            except Exception as e:
+                return 400, _error(f"The request is not valid JSON: {e}")
+            if not isinstance(batch, dict) or not isinstance(batch.get('queries'), list):
+                return 400, _error("Expected an object with a 'queries' list")
+            results = await asyncio.gather(*(self.run_query(request) for request in batch['queries']))
+            return 200, {'results': results}
+        return 404, _error(f"No such path: {path}")
+
+    async def handle(self, reader, writer):
+        # Reads one HTTP request, answers it and closes the connection
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length') or 0)
+            if length > MAX_REQUEST_BYTES:
+                status, payload = 413, _error(f"Requests are limited to {MAX_REQUEST_BYTES} bytes")
+            else:
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.route(method, urlsplit(target).path, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, _error(f"Bad request: {e}")
+        except Exception as e:
+            status, payload = 500, _error(f"{type(e).__name__}: {e}")
+        data = dumps(payload).encode('utf-8')
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n"
+        try:
+            writer.write(head.encode('latin-1') + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, started=None):
+        # Serves until cancelled. started, when given, is called with the bound (host, port) once requests are accepted.
+        server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started(server.sockets[0].getsockname()[:2])
+        async with server:
+            await server.serve_forever()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Query server for the MLB restaurant data")
+    arg_parser.add_argument('--data', default='data', help="Directory containing the team JSON files")
+    arg_parser.add_argument('--host', default=DEFAULT_HOST, help="Address to listen on")
+    arg_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port to listen on")
+    arg_parser.add_argument('--workers', type=int, default=None, help="Worker processes running queries (default: one per CPU, 0 runs them in the server)")
+    arg_parser.add_argument('--max-teams', type=int, default=8, help="Teams each worker keeps in memory")
+    arg_parser.add_argument('--compact-records', action='store_true', help="Keep the teams as compact records, which take a fraction of the memory (see records.py)")
+
+    args = arg_parser.parse_args()
+    query_server = QueryServer(args.data, args.workers, args.max_teams, SnapshotCache(), compact_records=args.compact_records)
+    try:
+        asyncio.run(query_server.serve(args.host, args.port, lambda address: print(f"Serving {args.data} on http://{address[0]}:{address[1]} with {query_server.workers} workers")))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        query_server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# DSCI 551 Final Project - Darren Parry
+
+import math
+import os
+import random
+from hashlib import blake2b
+from statistics import NormalDist
+
+from paths import values
+from snapshot import SnapshotCache
+
+# Sketches are small summaries of a team kept next to its data, so the app can answer aggregates approximately
+# without reading every business:
+#   a reservoir sample of the businesses, for count, sum and avg estimates with confidence intervals
+#   a HyperLogLog per field in DISTINCT_FIELDS, for distinct counts
+#   a quantile sketch per field in QUANTILE_FIELDS, for percentiles
+# They are built when a team is loaded (and stored next to its snapshot), and built again the first time they are
+# used after the team was written to.
+
+# Fields, given as paths (see paths.py), whose distinct values are counted
+DISTINCT_FIELDS = ('categories[].alias', 'location.zip_code', 'location.city', 'price')
+# Numeric fields whose percentiles are kept
+QUANTILE_FIELDS = ('rating', 'review_count', 'distance')
+# Businesses kept in a team's sample; a team with fewer is sampled whole and its estimates are exact
+SAMPLE_SIZE = 256
+# The sample is drawn with a fixed seed, so the same data always gives the same estimates
+SAMPLE_SEED = 551
+# HyperLogLog registers are 2 ** DISTINCT_PRECISION; the standard error of a count is 1.04 / sqrt(registers)
+DISTINCT_PRECISION = 12
+# Largest relative error of a percentile from a quantile sketch
+QUANTILE_ACCURACY = 0.01
+# A quantile sketch also counts every value exactly while a field has at most this many distinct values (like rating),
+# and its percentiles are then exact
+MAX_EXACT_VALUES = 64
+# Extension of the stored sketches of a team file, kept next to its snapshot
+SKETCH_EXTENSION = '.sketch'
+
+def stable_hash(value):
+    # A 64-bit hash of a value that is the same in every process (hash() of a string changes between runs)
+    return int.from_bytes(blake2b(repr(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+def z_score(confidence):
+    # The number of standard errors on each side of an estimate for a two-sided confidence level, e.g. 1.96 for 0.95
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+def _numbers(document, field):
+    return [value for value in values(document, field) if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+class HyperLogLog:
+    # Estimates how many distinct values were added in a fixed amount of memory. Each value's hash picks a register
+    # and the register keeps the longest run of leading zero bits seen among the rest of the hash; more distinct
+    # values make longer runs likely. Small counts use linear counting of the empty registers, which is near exact.
+    def __init__(self, precision=DISTINCT_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        h = stable_hash(value)
+        bits = 64 - self.precision
+        register = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * m and empty:
+            return m * math.log(m / empty)
+        return estimate
+
+    def relative_error(self):
+        # The standard error of count() relative to the true count
+        return 1.04 / math.sqrt(len(self.registers))
+
+class QuantileSketch:
+    # Percentiles within QUANTILE_ACCURACY relative error. Values are counted in buckets whose bounds grow
+    # geometrically (each bucket ends at gamma times where it starts), so any value is within the accuracy of its
+    # bucket's middle however spread out the values are. Zero and negative values have buckets of their own.
+    def __init__(self, accuracy=QUANTILE_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # Bucket index -> count, for positive values and for the magnitudes of negative ones
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        # Value -> count, until there are more than MAX_EXACT_VALUES distinct values
+        self.values = {}
+
+    def to_value(self):
+        return {'accuracy': self.accuracy, 'positive': self.positive, 'negative': self.negative, 'zeros': self.zeros,
+                'count': self.count, 'min': self.min, 'max': self.max, 'values': self.values}
+
+    @classmethod
+    def from_value(cls, value):
+        sketch = cls(value['accuracy'])
+        sketch.positive = value['positive']
+        sketch.negative = value['negative']
+        sketch.zeros = value['zeros']
+        sketch.count = value['count']
+        sketch.min = value['min']
+        sketch.max = value['max']
+        sketch.values = value['values']
+        return sketch
+
+    def add(self, value):
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.values is not None:
+            self.values[value] = self.values.get(value, 0) + 1
+            if len(self.values) > MAX_EXACT_VALUES:
+                self.values = None
+        if value == 0:
+            self.zeros += 1
+            return
+        buckets = self.positive if value > 0 else self.negative
+        index = math.ceil(math.log(abs(value)) / self.log_gamma)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def _bucket_value(self, index):
+        # The middle of a bucket, within the accuracy of every value in it
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, fraction):
+        # The value at rank fraction * (count - 1) in sorted order, the same rank functions.quantiles uses, or None
+        # when nothing was added
+        if not self.count:
+            return None
+        rank = int(fraction * (self.count - 1))
+        seen = 0
+        if self.values is not None:
+            for value in sorted(self.values):
+                seen += self.values[value]
+                if seen > rank:
+                    return value
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(self.min, -self._bucket_value(index))
+        seen += self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self.max, max(self.min, self._bucket_value(index)))
+        return self.max
+
+def reservoir_sample(count, size, seed=SAMPLE_SEED):
+    # Picks `size` of the positions 0 .. count - 1 uniformly at random in one pass (reservoir sampling: position i
+    # replaces a random kept one with probability size / (i + 1)), returned in ascending order
+    rng = random.Random(seed)
+    sample = []
+    for position in range(count):
+        if position < size:
+            sample.append(position)
+        else:
+            slot = rng.randint(0, position)
+            if slot < size:
+                sample[slot] = position
+    return sorted(sample)
+
+class TeamSketches:
+    # Every sketch of one team. version is the team data's version they were built from (see Collection.version).
+    def __init__(self, data=(), sample_size=SAMPLE_SIZE):
+        self.version = getattr(data, 'version', None)
+        self.population = len(data)
+        self.sample = reservoir_sample(self.population, sample_size)
+        self.distinct = {field: HyperLogLog() for field in DISTINCT_FIELDS}
+        self.quantiles = {field: QuantileSketch() for field in QUANTILE_FIELDS}
+        for document in data:
+            for field, sketch in self.distinct.items():
+                for value in values(document, field):
+                    if value is not None:
+                        sketch.add(value)
+            for field, sketch in self.quantiles.items():
+                for value in _numbers(document, field):
+                    sketch.add(value)
+
+    def to_value(self):
+        # The sketches as plain values that marshal can store
+        return {
+            'settings': sketch_settings(),
+            'population': self.population,
+            'sample': self.sample,
+            'distinct': {field: bytes(sketch.registers) for field, sketch in self.distinct.items()},
+            'quantiles': {field: sketch.to_value() for field, sketch in self.quantiles.items()},
+        }
+
+    @classmethod
+    def from_value(cls, value):
+        sketches = cls()
+        sketches.population = value['population']
+        sketches.sample = value['sample']
+        sketches.distinct = {field: HyperLogLog(DISTINCT_PRECISION, registers) for field, registers in value['distinct'].items()}
+        sketches.quantiles = {field: QuantileSketch.from_value(sketch) for field, sketch in value['quantiles'].items()}
+        return sketches
+
+def sketch_settings():
+    # What stored sketches were built with; sketches stored with other settings are built again
+    return (SAMPLE_SIZE, SAMPLE_SEED, DISTINCT_PRECISION, QUANTILE_ACCURACY, MAX_EXACT_VALUES, DISTINCT_FIELDS, QUANTILE_FIELDS)
+
+def load_team_sketches(file_path, documents, cache=None, stat=None):
+    # Returns the TeamSketches of a team file's documents as parsed from the file, from their stored copy when the
+    # file is unchanged. stat is the file's stat taken before the documents were loaded, as for load_text_index.
+    if cache is None:
+        return TeamSketches(documents)
+    sketch_cache = SnapshotCache(cache.cache_dir, SKETCH_EXTENSION)
+    current = os.stat(file_path)
+    if stat is None or (stat.st_mtime_ns, stat.st_size) != (current.st_mtime_ns, current.st_size):
+        return TeamSketches(documents)
+    value = sketch_cache.get_or_parse(file_path, lambda path: TeamSketches(documents).to_value())
+    if value.get('settings') != sketch_settings():
+        sketch_cache.invalidate(file_path)
+        value = sketch_cache.get_or_parse(file_path, lambda path: TeamSketches(documents).to_value())
+    return TeamSketches.from_value(value)
+
+def estimate_total(population, sample_size, total, squares, z):
+    # Estimates a population total from the sum and sum of squares of a value over a simple random sample, where
+    # businesses the value does not apply to count as 0. Returns (estimate, half-width of the confidence interval).
+    if not sample_size:
+        return 0, None
+    if sample_size == population:
+        # The whole team was sampled
+        return total, 0.0
+    mean = total / sample_size
+    variance = (squares - total * mean) / (sample_size - 1) if sample_size > 1 else 0
+    coverage = 1 - sample_size / population
+    return population * mean, z * population * math.sqrt(max(0.0, coverage * variance / sample_size))
+
+def estimate_mean(population, sample_size, total, squares, count, z):
+    # Estimates the mean of a value over the businesses it applies to (a ratio of two estimated totals), from the
+    # sample's sum, sum of squares and number of such businesses. Returns (estimate, half-width), like group_aggregate
+    # giving 0 when no business has the value.
+    if not count:
+        return 0, None
+    ratio = total / count
+    residuals = squares - 2 * ratio * total + ratio * ratio * count
+    variance = residuals / (sample_size - 1) if sample_size > 1 else 0
+    coverage = 1 - sample_size / population
+    share = count / sample_size
+    return ratio, z * math.sqrt(max(0.0, coverage * variance / sample_size)) / share
@@ -0,0 +1,89 @@
+# DSCI 551 Final Project - Darren Parry
+
+import marshal
+import os
+import struct
+import sys
+import threading
+
+# Bump this whenever the layout of a snapshot entry changes so old entries are treated as stale
+FORMAT_VERSION = 1
+SNAPSHOT_DIR_NAME = '.snapshots'
+# Every entry starts with the byte length of its key record
+_KEY_LENGTH = struct.Struct('<I')
+
+class SnapshotCache:
+    # On-disk cache of parsed team files. Each entry is keyed by the source path, mtime and size, and is stored
+    # as two marshal records: a small length-prefixed key record followed by the parsed value, so staleness can
+    # be checked without decoding the whole value.
+    def __init__(self, cache_dir=None, extension='.snap'):
+        # With no cache_dir, entries are kept in a .snapshots folder next to each source file. Caches of other values
+        # derived from the same files (e.g. textindex.py) share the folder with their own extension.
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, file_path):
+        # Returns where the snapshot for a source file lives
+        cache_dir = self.cache_dir or os.path.join(os.path.dirname(os.path.abspath(file_path)), SNAPSHOT_DIR_NAME)
+        return os.path.join(cache_dir, os.path.basename(file_path) + self.extension)
+
+    def _key(self, file_path, stat):
+        # The key that has to match for a snapshot to be used
+        return (FORMAT_VERSION, tuple(sys.version_info[:2]), os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+    def load(self, file_path):
+        # Returns the cached value for a source file, or None when there is no fresh snapshot. Stale entries are deleted.
+        entry_path = self.entry_path(file_path)
+        stat = os.stat(file_path)
+        try:
+            with open(entry_path, 'rb') as f:
+                key_length, = _KEY_LENGTH.unpack(f.read(_KEY_LENGTH.size))
+                if marshal.loads(f.read(key_length)) != self._key(file_path, stat):
+                    raise ValueError("Stale snapshot")
+                # marshal.loads on one bytes object is far faster than marshal.load on the file handle
+                value = marshal.loads(f.read())
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (EOFError, ValueError, TypeError, struct.error):
+            self.misses += 1
+            self.invalidate(file_path)
+            return None
+        self.hits += 1
+        return value
+
+    def store(self, file_path, value, stat=None):
+        # Writes a snapshot for a source file. Pass the stat taken before parsing so a file edited mid-parse is not cached as fresh.
+        stat = stat or os.stat(file_path)
+        entry_path = self.entry_path(file_path)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Sessions load teams on their own threads, so two threads of one process may store the same team at once
+        temp_path = entry_path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            key = marshal.dumps(self._key(file_path, stat))
+            f.write(_KEY_LENGTH.pack(len(key)))
+            f.write(key)
+            marshal.dump(value, f)
+        os.replace(temp_path, entry_path)
+
+    def invalidate(self, file_path):
+        # Removes the snapshot for a source file if there is one
+        try:
+            os.remove(self.entry_path(file_path))
+        except FileNotFoundError:
+            pass
+
+    def get_or_parse(self, file_path, parse_func):
+        # Returns the cached value when the source file is unchanged, otherwise parses it and stores a new snapshot
+        value = self.load(file_path)
+        if value is None:
+            stat = os.stat(file_path)
+            value = parse_func(file_path)
+            try:
+                self.store(file_path, value, stat)
+            except OSError:
+                # A read-only or full disk only costs us the cache, never the data
+                pass
+        return value
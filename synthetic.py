@@ -0,0 +1,149 @@
+# DSCI 551 Final Project - Darren Parry
+
+import argparse
+import math
+import os
+import random
+import time
+
+from oplog import write_team_file
+
+# Synthetic team files shaped like the Yelp business records in data/, for measuring the parser and the database
+# functions at sizes the real files never reach. The same seed and sizes always give the same files.
+
+# Businesses per team at scale 1, about the size of the larger real team files (roughly 1 MB)
+BASE_BUSINESSES = 1000
+# Share of a team's businesses that also appear in the next team's file (same id), like businesses near two
+# stadiums in one city, so joining two teams on 'id' has matches
+SHARED_FRACTION = 0.1
+
+NAME_WORDS = ('Golden', 'Red', 'Blue', 'Lucky', 'Little', 'Big', 'Old', 'Happy', 'Urban', 'Rustic', 'Smoky', 'Sunny',
+              'Corner', 'Royal', 'Green', 'Silver', 'Wild', 'Copper', 'Iron', 'Harbor')
+NAME_NOUNS = ('Dragon', 'Oak', 'Pig', 'Goat', 'Anchor', 'Lantern', 'Fork', 'Spoon', 'Garden', 'Barrel', 'Bear', 'Fox',
+              'Hen', 'Rooster', 'Crown', 'Bridge', 'Mill', 'Lotus', 'Olive', 'Pepper')
+NAME_KINDS = ('Kitchen', 'Grill', 'Cafe', 'Tavern', 'Bistro', 'Diner', 'Taqueria', 'Pizzeria', 'Bar', 'Eatery',
+              'Noodle House', 'Smokehouse', 'Bakery', 'Pub', 'Sushi')
+CATEGORIES = (('pizza', 'Pizza'), ('mexican', 'Mexican'), ('tacos', 'Tacos'), ('burgers', 'Burgers'),
+              ('sandwiches', 'Sandwiches'), ('coffee', 'Coffee & Tea'), ('breakfast_brunch', 'Breakfast & Brunch'),
+              ('bars', 'Bars'), ('pubs', 'Pubs'), ('sportsbars', 'Sports Bars'), ('italian', 'Italian'),
+              ('chinese', 'Chinese'), ('japanese', 'Japanese'), ('sushi', 'Sushi Bars'), ('thai', 'Thai'),
+              ('vietnamese', 'Vietnamese'), ('indpak', 'Indian'), ('mediterranean', 'Mediterranean'),
+              ('bbq', 'Barbeque'), ('seafood', 'Seafood'), ('hotdogs', 'Fast Food'), ('chicken_wings', 'Chicken Wings'),
+              ('bakeries', 'Bakeries'), ('desserts', 'Desserts'), ('icecream', 'Ice Cream & Frozen Yogurt'),
+              ('tradamerican', 'American (Traditional)'), ('newamerican', 'American (New)'), ('vegan', 'Vegan'),
+              ('delis', 'Delis'), ('korean', 'Korean'))
+STREETS = ('Main St', 'Oak Ave', 'Broadway', 'Park Pl', 'Lake Shore Dr', 'Market St', 'Elm St', '2nd Ave',
+           'Washington Blvd', 'Sunset Blvd', 'River Rd', 'Hill St')
+RATINGS = (1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0)
+RATING_WEIGHTS = (1, 2, 3, 5, 9, 16, 25, 25, 14)
+# None leaves 'price' out of the business, as in the real files
+PRICES = ('$', '$$', '$$$', '$$$$', None)
+PRICE_WEIGHTS = (30, 49, 1, 1, 19)
+TRANSACTIONS = (('pickup', 'delivery'), ('delivery',), ('delivery', 'pickup'), (), ('pickup',))
+TRANSACTION_WEIGHTS = (44, 22, 22, 10, 2)
+# Radius of the area around the stadium, as in the real headers
+RADIUS_METERS = 3000
+_ID_CHARACTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+
+def team_header(rng, number, businesses):
+    # The header fields of one synthetic team
+    latitude = round(rng.uniform(26.0, 47.0), 6)
+    longitude = round(rng.uniform(-122.0, -71.0), 6)
+    return {
+        'league': 'MLB',
+        'team': f"Synthetic Team {number}",
+        'stadium': f"Synthetic Park {number}",
+        'stadium latitude': latitude,
+        'stadium longitude': longitude,
+        'radius': f"{RADIUS_METERS} meters",
+        'city': f"City {number}",
+        'state': f"State {number}",
+        'absolute total': businesses,
+        'total': businesses,
+    }
+
+def make_business(rng, header, cities):
+    # One business near the team's stadium, with the fields and value types of a real record
+    name = f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_NOUNS)} {rng.choice(NAME_KINDS)}"
+    city, state, zip_codes = rng.choice(cities)
+    business_id = ''.join(rng.choice(_ID_CHARACTERS) for _ in range(22))
+    alias = '-'.join(name.lower().split()) + '-' + '-'.join(city.lower().split()) + '-' + business_id[:4].lower()
+    # A uniform point in the circle around the stadium
+    distance = RADIUS_METERS * math.sqrt(rng.random())
+    bearing = rng.uniform(0, 2 * math.pi)
+    latitude = header['stadium latitude'] + distance * math.cos(bearing) / 111320
+    longitude = header['stadium longitude'] + distance * math.sin(bearing) / (111320 * math.cos(math.radians(header['stadium latitude'])))
+    number = rng.randint(1, 9999)
+    street = rng.choice(STREETS)
+    zip_code = rng.choice(zip_codes)
+    phone = ''.join(str(rng.randint(0, 9)) for _ in range(10))
+
+    business = {
+        'id': business_id,
+        'alias': alias,
+        'name': name,
+        'image_url': f"https://s3-media1.fl.yelpcdn.com/bphoto/{business_id}/o.jpg",
+        'is_closed': rng.random() < 0.02,
+        'url': f"https://www.yelp.com/biz/{alias}?adjust_creative=synthetic&utm_campaign=yelp_api_v3&utm_medium=api_v3_business_search&utm_source=synthetic",
+        'review_count': int(rng.paretovariate(1.1) * 8),
+        'categories': [{'alias': category_alias, 'title': title} for category_alias, title in rng.sample(CATEGORIES, rng.randint(1, 3))],
+        'rating': rng.choices(RATINGS, RATING_WEIGHTS)[0],
+        'coordinates': {'latitude': latitude, 'longitude': longitude},
+        'transactions': list(rng.choices(TRANSACTIONS, TRANSACTION_WEIGHTS)[0]),
+    }
+    price = rng.choices(PRICES, PRICE_WEIGHTS)[0]
+    if price is not None:
+        business['price'] = price
+    business['location'] = {
+        'address1': f"{number} {street}",
+        'address2': None,
+        'address3': '',
+        'city': city,
+        'zip_code': zip_code,
+        'country': 'US',
+        'state': state,
+        'display_address': [f"{number} {street}", f"{city}, {state} {zip_code}"],
+    }
+    business['phone'] = '+1' + phone
+    business['display_phone'] = f"({phone[:3]}) {phone[3:6]}-{phone[6:]}"
+    business['distance'] = distance
+    return business
+
+def generate_teams(directory, teams=2, businesses=BASE_BUSINESSES, seed=551):
+    # Writes `teams` synthetic team files of `businesses` businesses each into a directory and returns their paths.
+    # Every team shares SHARED_FRACTION of its businesses with the next one.
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    shared = []
+    for number in range(1, teams + 1):
+        header = team_header(rng, number, businesses)
+        cities = []
+        for c in range(rng.randint(2, 4)):
+            first_zip = rng.randint(10000, 99000)
+            cities.append((f"City {number}" if c == 0 else f"Town {number}-{c}", f"S{number}", [str(first_zip + z) for z in range(rng.randint(3, 12))]))
+        documents = shared[:businesses]
+        while len(documents) < businesses:
+            documents.append(make_business(rng, header, cities))
+        rng.shuffle(documents)
+        shared = documents[:int(businesses * SHARED_FRACTION)]
+        path = os.path.join(directory, f"Synthetic_Team_{number}_restaurants.json")
+        write_team_file(path, header, documents)
+        paths.append(path)
+    return paths
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Generate synthetic MLB restaurant team files")
+    arg_parser.add_argument('--out', default='synthetic_data', help="Directory to write the team files to")
+    arg_parser.add_argument('--teams', type=int, default=2, help="Number of team files")
+    arg_parser.add_argument('--scale', type=float, default=1, help=f"Businesses per team as a multiple of {BASE_BUSINESSES}")
+    arg_parser.add_argument('--seed', type=int, default=551, help="Random seed; the same seed gives the same files")
+
+    args = arg_parser.parse_args()
+    start = time.perf_counter()
+    paths = generate_teams(args.out, args.teams, int(BASE_BUSINESSES * args.scale), args.seed)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"Wrote {len(paths)} team files ({size / (1024 * 1024):.1f} MB) to {args.out} in {time.perf_counter() - start:.1f} s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# DSCI 551 Final Project - Darren Parry
+
+import heapq
+import os
+import re
+from bisect import bisect_left, insort
+
+from paths import compile_path
+from snapshot import SnapshotCache
+
+# Fields whose words are indexed for search, given as paths (see paths.py)
+TEXT_FIELDS = ('name', 'alias', 'categories[].title')
+# Fields results can be ranked by; their values are kept in the index so ranking does not read the documents
+RANK_FIELDS = ('rating', 'review_count')
+# How a query term has to match a word of a business
+MATCH_MODES = ('words', 'prefix', 'substring')
+# Extension of the persisted text index of a team file, kept next to its snapshot
+INDEX_EXTENSION = '.words'
+# Words are runs of letters and digits; everything else (spaces, '-', '&', "'") separates them
+_WORD = re.compile(r'[^\W_]+')
+
+def tokenize(text):
+    # The lower-case words of a piece of text, in order
+    return _WORD.findall(text.lower())
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def document_tokens(document):
+    # The distinct words of a business's name, alias and category titles
+    tokens = set()
+    for field in TEXT_FIELDS:
+        for value in compile_path(field)(document):
+            if isinstance(value, str):
+                tokens.update(tokenize(value))
+    return tokens
+
+def _rank_values(document):
+    return tuple(value if isinstance(value, (int, float)) and not isinstance(value, bool) else None for value in (document.get(field) for field in RANK_FIELDS))
+
+class TextIndex:
+    # Inverted index over the words of one team's businesses. Each word lists the positions of the businesses holding
+    # it in ascending order (its posting list), so a query intersects a few short lists instead of reading every
+    # business. Prefixes are found with a binary search of the sorted words, and substrings through the trigrams
+    # (3-letter pieces) of every word: only words holding all of the term's trigrams are checked.
+    def __init__(self, data=()):
+        self.postings = {}
+        # Position -> values of RANK_FIELDS, and position -> business id
+        self.ranks = {}
+        self.ids = {}
+        self.trigrams = {}
+        self._words = None
+        for position, document in enumerate(data):
+            self.add(position, document)
+
+    def to_value(self):
+        # The index as plain dicts and lists that marshal can store
+        return {'postings': self.postings, 'ranks': self.ranks, 'ids': self.ids, 'trigrams': self.trigrams}
+
+    @classmethod
+    def from_value(cls, value):
+        index = cls()
+        index.postings = value['postings']
+        index.ranks = value['ranks']
+        index.ids = value['ids']
+        index.trigrams = value['trigrams']
+        return index
+
+    def words(self):
+        # Every indexed word in sorted order, kept until a word is added or removed
+        if self._words is None:
+            self._words = sorted(self.postings)
+        return self._words
+
+    def add(self, position, document):
+        for token in document_tokens(document):
+            postings = self.postings.get(token)
+            if postings is None:
+                self.postings[token] = [position]
+                for trigram in _trigrams(token):
+                    self.trigrams.setdefault(trigram, []).append(token)
+                self._words = None
+            elif not postings or postings[-1] < position:
+                postings.append(position)
+            else:
+                insort(postings, position)
+        self.ranks[position] = _rank_values(document)
+        self.ids[position] = document.get('id')
+
+    def remove(self, position, document):
+        for token in document_tokens(document):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            i = bisect_left(postings, position)
+            if i < len(postings) and postings[i] == position:
+                del postings[i]
+            if not postings:
+                del self.postings[token]
+                for trigram in _trigrams(token):
+                    tokens = self.trigrams[trigram]
+                    tokens.remove(token)
+                    if not tokens:
+                        del self.trigrams[trigram]
+                self._words = None
+        self.ranks.pop(position, None)
+        self.ids.pop(position, None)
+
+    def matching_words(self, term, mode='words'):
+        # The indexed words one query term matches
+        if mode == 'words':
+            return [term] if term in self.postings else []
+        if mode == 'prefix':
+            words = self.words()
+            found = []
+            for i in range(bisect_left(words, term), len(words)):
+                if not words[i].startswith(term):
+                    break
+                found.append(words[i])
+            return found
+        if mode == 'substring':
+            if len(term) < 3:
+                return [word for word in self.postings if term in word]
+            lists = sorted((self.trigrams.get(trigram, ()) for trigram in _trigrams(term)), key=len)
+            candidates = set(lists[0])
+            for tokens in lists[1:]:
+                candidates.intersection_update(tokens)
+                if not candidates:
+                    break
+            return [word for word in candidates if term in word]
+        raise ValueError(f"Unknown match mode: {mode}")
+
+    def search(self, text, mode='words'):
+        # Returns the positions of the businesses matching every word of the query, in ascending order. A term matching
+        # several words (a prefix or substring) takes the union of their posting lists; the terms' lists are then
+        # intersected from the shortest up, so the work stops as soon as nothing is left.
+        terms = tokenize(text)
+        if not terms:
+            return []
+        term_postings = []
+        for term in dict.fromkeys(terms):
+            words = self.matching_words(term, mode)
+            if not words:
+                return []
+            if len(words) == 1:
+                term_postings.append(self.postings[words[0]])
+            else:
+                term_postings.append(sorted({position for word in words for position in self.postings[word]}))
+        term_postings.sort(key=len)
+        result = term_postings[0]
+        for postings in term_postings[1:]:
+            result = intersect(result, postings)
+            if not result:
+                break
+        return list(result)
+
+    def rank_key(self, rank_by, descending=True):
+        # The sort key of a position for ranking by one of RANK_FIELDS; businesses without a value go last
+        slot = RANK_FIELDS.index(rank_by)
+        ranks = self.ranks
+
+        def key(position):
+            value = ranks[position][slot]
+            if value is None:
+                return (1, 0)
+            return (0, -value if descending else value)
+        return key
+
+    def ranked(self, positions, rank_by=None, descending=True, limit=None):
+        # Orders the positions of a search by rating or review_count, ties in position order. With no rank_by the
+        # positions keep their order; with a limit only the best ones are returned, without sorting the rest.
+        if rank_by is None:
+            return positions if limit is None else positions[:limit]
+        key = self.rank_key(rank_by, descending)
+        if limit is None:
+            return sorted(positions, key=key)
+        return heapq.nsmallest(limit, positions, key=key)
+
+def intersect(left, right):
+    # The positions in both of two ascending posting lists. A much shorter list is looked up in the longer one with
+    # binary searches; lists of similar length are merged.
+    if len(left) > len(right):
+        left, right = right, left
+    if len(left) * 8 < len(right):
+        found = []
+        low = 0
+        for position in left:
+            low = bisect_left(right, position, low)
+            if low == len(right):
+                break
+            if right[low] == position:
+                found.append(position)
+        return found
+    found = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] == right[j]:
+            found.append(left[i])
+            i += 1
+            j += 1
+        elif left[i] < right[j]:
+            i += 1
+        else:
+            j += 1
+    return found
+
+def load_text_index(file_path, documents, cache=None, stat=None):
+    # Returns the TextIndex of a team file's documents as parsed from the file, from its persisted copy next to the
+    # snapshot when the file is unchanged. stat is the file's stat taken before the documents were loaded: when the
+    # file changed since, the index is built without being stored, so it is never kept for the wrong documents.
+    if cache is None:
+        return TextIndex(documents)
+    index_cache = SnapshotCache(cache.cache_dir, INDEX_EXTENSION)
+    current = os.stat(file_path)
+    if stat is None or (stat.st_mtime_ns, stat.st_size) != (current.st_mtime_ns, current.st_size):
+        return TextIndex(documents)
+    value = index_cache.get_or_parse(file_path, lambda path: TextIndex(documents).to_value())
+    if 'ids' not in value:
+        # Stored before the index kept business ids
+        index_cache.invalidate(file_path)
+        value = index_cache.get_or_parse(file_path, lambda path: TextIndex(documents).to_value())
+    return TextIndex.from_value(value)
+
+class LeagueTextIndex:
+    # Searches the text indexes of every team together. Only the indexes are kept, with (team, position, id) results,
+    # so lazily loaded teams can be evicted and their documents are looked up again when results are shown (see
+    # find_business).
+    def __init__(self):
+        self.indexes = {}
+        # Version of the team data each team's index belongs to (see Collection.version)
+        self.versions = {}
+
+    def add_team(self, team, data):
+        # Uses the team's own index when it has one (a loaded Collection keeps it up to date as it is written to),
+        # otherwise indexes the businesses
+        index = getattr(data, 'text_index', None)
+        self.indexes[team] = index if index is not None else TextIndex(data)
+        self.versions[team] = getattr(data, 'version', None)
+        return self
+
+    def refresh_team(self, team, data):
+        # Takes the index of a team's current data when it was loaded again or written to since it was added.
+        # Returns True when it did.
+        if team in self.versions and self.versions[team] == getattr(data, 'version', None):
+            return False
+        self.add_team(team, data)
+        return True
+
+    def search(self, text, mode='words', rank_by=None, descending=True, limit=None):
+        # Returns (team, position, id) for every business of every team matching the query. Ranked results are ordered
+        # across teams; ties (and unranked results) go in team order, then position order.
+        matches = []
+        for order, (team, index) in enumerate(self.indexes.items()):
+            positions = index.search(text, mode)
+            if rank_by is None:
+                matches.extend((team, position, index.ids[position]) for position in positions)
+            else:
+                key = index.rank_key(rank_by, descending)
+                matches.extend((key(position), order, team, position) for position in positions)
+        if rank_by is None:
+            return matches if limit is None else matches[:limit]
+        best = sorted(matches) if limit is None else heapq.nsmallest(limit, matches)
+        return [(team, position, self.indexes[team].ids[position]) for _, _, team, position in best]
+
+    def __len__(self):
+        return sum(len(index.ranks) for index in self.indexes.values())